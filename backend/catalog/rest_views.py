@@ -1,8 +1,12 @@
 import datetime
-from django_filters.rest_framework import DjangoFilterBackend, FilterSet, NumberFilter
+from django import forms
+from django_filters.rest_framework import BaseInFilter, DjangoFilterBackend, FilterSet, NumberFilter
 from rest_framework import permissions, viewsets
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 
+from catalog import streaming
 from catalog.rest_serializers import MediaSerializer, MSerializer
 from storage.models import Media
 
@@ -12,13 +16,44 @@ class ReadOnlyPermission(permissions.BasePermission):
         return request.method and request.method in permissions.SAFE_METHODS
 
 
+class IntegerInFilter(BaseInFilter, NumberFilter):
+    """Comma-separated integers, e.g. ?categories_any=1,2"""
+    field_class = forms.IntegerField
+
+
 class MediaFilter(FilterSet):
-    show_year = NumberFilter(name="show_at", lookup_expr="year", min_value=datetime.MINYEAR, max_value=datetime.MAXYEAR)
-    show_month = NumberFilter(name="show_at", lookup_expr="month", min_value=1, max_value=12)
+    # Year & month are a range of show_at, not extracted parts of it -- to be an index scan
+    show_year = NumberFilter(name="show_at", method="filter_show_year",
+                             min_value=datetime.MINYEAR, max_value=datetime.MAXYEAR - 1)
+    show_month = NumberFilter(name="show_at", method="filter_show_month", min_value=1, max_value=12)
+    # Any of (&&) / all of (@>) given categories, see GIN index of Media
+    categories_any = IntegerInFilter(name="categories", lookup_expr="overlap")
+    categories_all = IntegerInFilter(name="categories", lookup_expr="contains")
 
     class Meta:
         model = Media
-        fields = ('show_year', 'show_month')
+        fields = ('show_year', 'show_month', 'categories_any', 'categories_all')
+
+    def filter_show_year(self, queryset, name, value):
+        from catalog.views import get_month_range
+
+        month = self.form.cleaned_data.get('show_month')
+
+        if month:
+            start, end = get_month_range(int(value), int(month))
+        else:
+            start, _ = get_month_range(int(value), 1)
+            end, _ = get_month_range(int(value) + 1, 1)
+
+        return queryset.filter(**{f'{name}__gte': start, f'{name}__lt': end})
+
+    def filter_show_month(self, queryset, name, value):
+        if self.form.cleaned_data.get('show_year') is not None:
+            # Filtered along with the year
+            return queryset
+
+        # The month of any year
+        return queryset.filter(**{f'{name}__month': value})
 
 
 class MediaViewSet(viewsets.ModelViewSet):
@@ -36,6 +71,25 @@ class MediaViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return super().get_queryset().filter(uploader=self.request.user)
 
+    @list_route(methods=['get'])
+    def stream(self, request, *args, **kwargs):
+        """
+        All media (filtered & ordered as by list) streamed while they are read, without pages:
+        `?stream=json` (default) or `?stream=ndjson`
+        """
+        stream_format = streaming.get_format(request, default='json')
+
+        if not stream_format:
+            raise ValidationError({streaming.FORMAT_PARAM: [f'Expected one of: {", ".join(streaming.FORMATS)}']})
+
+        # Server-side cursor: instances are fetched by chunks while the response is written
+        media = self.filter_queryset(self.get_queryset()).iterator()
+        serializer = self.get_serializer()
+
+        return streaming.stream_response({'results': (serializer.to_representation(m) for m in media)},
+                                         stream_format)
+
+
 class MViewSet(viewsets.ModelViewSet):
     queryset = Media.objects.all()
     serializer_class = MSerializer
@@ -109,58 +109,63 @@ function renderMonth(month) {
 
 function toggleMonth(month, $month_div, $month_images) {
     $month_images.innerHTML = '';
+    // Pages of the previous expanding are not rendered
+    $month_images.dataset.loading = (Number($month_images.dataset.loading) || 0) + 1;
+
     if($month_images.classList.contains('expanded')) {
         $month_images.classList.remove('expanded');
     } else {
         $month_images.classList.add('expanded');
-        loadMonth(month, $month_images);
+        loadMonth(`/images/${month}.json`, $month_images, $month_images.dataset.loading);
     }
 }
 
-function loadMonth(month, container) {
-    fetch(`/images/${month}.json`, {
+function loadMonth(url, container, loading) {
+    fetch(url, {
         credentials: 'same-origin',
     }).then(function(response){
         return response.json();
-    }).then(renderMonthMedia.bind(null, container));
+    }).then(function(page) {
+        if(container.dataset.loading !== loading) {
+            return;
+        }
+
+        renderMonthMedia(container, page);
+
+        if(page.next) {
+            loadMonth(page.next, container, loading);
+        }
+    });
 }
 
 function renderDayContainer(day) {
     return renderElement(`
-        <div class="date-container">
+        <div class="date-container" data-day="${day}">
             <div class="day-title">${formatDay(day)}</div>
         </div>
     `);
 }
 
+const HLS_MIMETYPE = 'application/vnd.apple.mpegurl';
 const MEDIA_TYPES = [null, 'media_image', 'media_video', 'media_other'];
 
 
+// Page of media is appended, the day could be continued from the previous page
 function renderMonthMedia(container, medias) {
-    container.innerHTML = '';
-
-    if(!medias.media.length) {
-        return;
-    }
-
-    let prev_day = null;
+    let day_container = container.lastElementChild;
+    let prev_day = day_container ? day_container.dataset.day : null;
     let day = null;
-    let day_container = null;
     for(let media of medias.media) {
         day = media.show_at.substring(0, 10);    // cut 2016-01-01
 
         if(day != prev_day) {
-            if(day_container) {
-                container.appendChild(day_container);
-            }
             day_container = renderDayContainer(day);
+            container.appendChild(day_container);
             prev_day = day;
         }
 
         day_container.appendChild(renderMedia(media));
     }
-
-    container.append(day_container);
 }
 
 // Fastest way according to https://jsperf.com/htmlencoderegex/35
@@ -211,16 +216,18 @@ function showMedia($media) {
     let inner = '';
 
     // TODO: Do not show image for not supported types
-    // TODO: Show "optimized" version instead of "raw" material
     // TODO: Show metadata if requested
 
     // TODO: Indicate information about media from the same shot / burst
 
-    if(media.media_type == MEDIA_IMAGE) {
+    if(media.media_type == MEDIA_IMAGE && media.srcset) {
+        // Browser picks optimized version by screen size, original content is not loaded
+        inner = `<img src="${MEDIA_URL + media.content}" srcset="${media.srcset}" sizes="100vw" />`;
+    } else if(media.media_type == MEDIA_IMAGE) {
         inner = `<img src="${MEDIA_URL + media.content}" />`;
     } else if(media.media_type == MEDIA_VIDEO) {
         inner = `
-        <video src="${MEDIA_URL + media.content}"
+        <video src="${MEDIA_URL + getVideoSource(media)}"
         controls="true"
         autoplay="true"
         poster="${MEDIA_URL + media.screenshot}"
@@ -316,6 +323,48 @@ function getNextMedia($media) {
 }
 
 
+function getSrcset(renditions) {
+    // View-optimized images, see Media.renditions
+    return (renditions || []).filter(function(rendition){
+        return rendition.mimetype.startsWith('image/');
+    }).map(function(rendition){
+        return `${MEDIA_URL + rendition.name} ${rendition.width}w`;
+    }).join(', ');
+}
+
+function getVideoSource(media) {
+    // Seeking in HLS loads only needed segments, but not all browsers play it natively
+    if(media.playlist && document.createElement('video').canPlayType(HLS_MIMETYPE)) {
+        return media.playlist;
+    }
+    return media.video || media.content;
+}
+
+function getVideoRendition(renditions) {
+    // Transcoded video (see processing.play_media.transcode) enough for the screen, or the biggest one
+    let videos = (renditions || []).filter(function(rendition){
+        return rendition.mimetype.startsWith('video/');
+    }).sort(function(a, b){
+        return a.size - b.size;
+    });
+    let screenSize = Math.min(window.screen.width, window.screen.height) * (window.devicePixelRatio || 1);
+
+    for(let video of videos) {
+        if(video.size >= screenSize) {
+            return video.name;
+        }
+    }
+    return videos.length ? videos[videos.length - 1].name : '';
+}
+
+function getPlaylist(renditions) {
+    // HLS master playlist of a long video, see storage.tools.hls
+    let playlist = (renditions || []).find(function(rendition){
+        return rendition.mimetype == HLS_MIMETYPE;
+    });
+    return playlist ? playlist.name : '';
+}
+
 function renderMedia(media) {
     let content = '';
 
@@ -348,6 +397,9 @@ function renderMedia(media) {
         data-content="${media.content}"
         data-media_type="${media.media_type}"
         data-screenshot="${media.screenshot}"
+        data-srcset="${getSrcset(media.renditions)}"
+        data-video="${getVideoRendition(media.renditions)}"
+        data-playlist="${getPlaylist(media.renditions)}"
         onclick="onShowMedia(event)"
         >${content}</div>
     `);
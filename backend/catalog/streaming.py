@@ -0,0 +1,102 @@
+"""
+JSON responses written while rows are read, e.g. from `QuerySet.iterator()`: memory does not depend on the number
+of media, the first bytes are sent before the last row is fetched.
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+# Query parameter: `json` or `ndjson` (one JSON value per line)
+FORMAT_PARAM = 'stream'
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Encoded items are sent by chunks of about this size, not by a write per item
+CHUNK_SIZE = 64 * 1024
+
+
+def get_format(request, default=None):
+    """Requested format, None if it is not supported"""
+    name = request.GET.get(FORMAT_PARAM, default)
+    return name if name in FORMATS else None
+
+
+def join_chunks(parts, chunk_size=CHUNK_SIZE):
+    """
+    >>> list(join_chunks(['a', 'b', 'c'], chunk_size=2))
+    [b'ab', b'c']
+    """
+    chunk = []
+    size = 0
+
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+
+        if size >= chunk_size:
+            yield ''.join(chunk).encode()
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield ''.join(chunk).encode()
+
+
+def iter_json(obj, encoder):
+    """
+    Parts of JSON of the dict: iterables (except strings, lists & dicts) are encoded item by item as arrays,
+    callables are called once previous values are encoded, e.g. for a value known only after an iterator is done.
+
+    >>> ''.join(iter_json({'a': iter([1, 2]), 'b': lambda: None}, DjangoJSONEncoder()))
+    '{"a": [1, 2], "b": null}'
+    """
+    yield '{'
+
+    for num, (key, value) in enumerate(obj.items()):
+        yield f'{", " if num else ""}{encoder.encode(key)}: '
+
+        if callable(value):
+            value = value()
+
+        if is_stream(value):
+            yield '['
+
+            for item_num, item in enumerate(value):
+                yield f'{", " if item_num else ""}{encoder.encode(item)}'
+
+            yield ']'
+        else:
+            yield encoder.encode(value)
+
+    yield '}'
+
+
+def iter_ndjson(obj, encoder):
+    """
+    The same as iter_json, but each item of iterables is a line, other values are lines of {key: value}
+
+    >>> ''.join(iter_ndjson({'a': iter([1, 2]), 'b': lambda: None}, DjangoJSONEncoder()))
+    '1\\n2\\n{"b": null}\\n'
+    """
+    for key, value in obj.items():
+        if callable(value):
+            value = value()
+
+        if is_stream(value):
+            for item in value:
+                yield f'{encoder.encode(item)}\n'
+        else:
+            yield f'{encoder.encode({key: value})}\n'
+
+
+def is_stream(value):
+    return hasattr(value, '__iter__') and not isinstance(value, (str, bytes, dict, list, tuple))
+
+
+def stream_response(obj, stream_format='json', **kwargs):
+    """StreamingHttpResponse of the dict, see iter_json"""
+    encoder = DjangoJSONEncoder()
+    parts = (iter_ndjson if stream_format == 'ndjson' else iter_json)(obj, encoder)
+
+    return StreamingHttpResponse(join_chunks(parts), content_type=FORMATS[stream_format], **kwargs)
@@ -1,3 +1,40 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from catalog.views import decode_cursor, encode_cursor
+
+
+class CursorTest(SimpleTestCase):
+    def test_round_trip(self):
+        for show_at in (
+            datetime.datetime(2017, 6, 1, 10, 0, 0, 5, tzinfo=datetime.timezone.utc),
+            datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+            # Before 1970: negative microseconds
+            datetime.datetime(1969, 12, 31, 23, 59, 59, 999999, tzinfo=datetime.timezone.utc),
+            datetime.datetime(1901, 3, 4, 5, 6, 7, 8, tzinfo=datetime.timezone.utc),
+            datetime.datetime(1, 1, 1, tzinfo=datetime.timezone.utc),
+        ):
+            with self.subTest(show_at=show_at):
+                self.assertEqual(decode_cursor(encode_cursor(show_at, 12)), (show_at, 12))
+
+    def test_before_1970(self):
+        show_at = datetime.datetime(1969, 12, 31, 23, 59, 59, tzinfo=datetime.timezone.utc)
+
+        self.assertEqual(encode_cursor(show_at, 7), '-1000000-7')
+        self.assertEqual(decode_cursor('-1000000-7'), (show_at, 7))
+
+    def test_other_time_zone(self):
+        show_at = datetime.datetime(2017, 6, 1, 12, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+
+        self.assertEqual(encode_cursor(show_at, 1), '1496311200000000-1')
+        self.assertEqual(decode_cursor('1496311200000000-1')[0], show_at)
+
+    def test_invalid(self):
+        for cursor in ('', '12', 'a-1', '1-a', '1e30-1'):
+            with self.subTest(cursor=cursor), self.assertRaises((ValueError, OverflowError)):
+                decode_cursor(cursor)
+
+    def test_out_of_range(self):
+        with self.assertRaises((ValueError, OverflowError)):
+            decode_cursor(f'{10 ** 20}-1')
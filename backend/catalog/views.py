@@ -1,10 +1,17 @@
+import datetime
+
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count
-from django.db.models.functions import TruncMonth
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.template.response import TemplateResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from catalog import streaming
+from storage.models import Media, MediaMonthCounter
+from storage.tools import media_version
 
-from storage.models import Media
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
 
 @login_required
@@ -14,14 +21,12 @@ def catalog(request):
     })
 
 
-# date_trunc('{field}', {source})
-
 # TODO: Migrate to view in REST Framework
 @login_required
 def images_months(request):
-    qs = Media.objects.filter(uploader=request.user)
-    qs = qs.exclude(show_at=None)   # during upload media could have show_at = None => query would crash
-    qs = qs.annotate(month=TruncMonth('show_at')).values_list('month').order_by('month').annotate(Count('id'))
+    # Counted on save of media, see storage.tools.media_counters
+    qs = MediaMonthCounter.objects.filter(uploader=request.user, num__gt=0)
+    qs = qs.values_list('month', 'num').order_by('month')
     return JsonResponse({"months": [{'month': m.strftime('%Y-%m'), 'num': num} for m, num in qs]})
 
 
@@ -39,17 +44,107 @@ MEDIA_FIELDS = (
     "height",
     "content",
     "screenshot",
+    "renditions",
     "mimetype",
     "shot_id",
     "source_filename",
 )
 
 
+def get_month_range(year, month):
+    """
+    [start, end) of the month in the current time zone, like months of images_months
+
+    >>> get_month_range(2016, 12)
+    (datetime.datetime(2016, 12, 1, 0, 0, tzinfo=<UTC>), datetime.datetime(2017, 1, 1, 0, 0, tzinfo=<UTC>))
+    """
+    from django.utils import timezone
+
+    return (timezone.make_aware(datetime.datetime(year, month, 1)),
+            timezone.make_aware(datetime.datetime(year + month // 12, month % 12 + 1, 1)))
+
+
+def encode_cursor(show_at, media_id):
+    """
+    Position after the media in (show_at, id) order, microseconds are integer to be exact
+
+    >>> encode_cursor(datetime.datetime(2017, 6, 1, 10, 0, 0, 5, tzinfo=datetime.timezone.utc), 12)
+    '1496311200000005-12'
+    """
+    return f'{(show_at - EPOCH) // datetime.timedelta(microseconds=1)}-{media_id}'
+
+
+def decode_cursor(cursor):
+    """
+    >>> decode_cursor('1496311200000005-12')
+    (datetime.datetime(2017, 6, 1, 10, 0, 0, 5, tzinfo=datetime.timezone.utc), 12)
+    >>> decode_cursor(encode_cursor(datetime.datetime(1965, 5, 1, tzinfo=datetime.timezone.utc), 7))
+    (datetime.datetime(1965, 5, 1, 0, 0, tzinfo=datetime.timezone.utc), 7)
+    """
+    # Microseconds are negative before 1970
+    microseconds, media_id = cursor.rsplit('-', 1)
+    return EPOCH + datetime.timedelta(microseconds=int(microseconds)), int(media_id)
+
+
+def get_month_etag(request, year=None, month=None):
+    """Any change of uploader's media changes it, so it is computed without queries"""
+    from django.conf import settings
+
+    return '-'.join(str(v) for v in (request.user.id, media_version.get_modified_at(request.user.id),
+                                     year, month, request.GET.get('after', ''), settings.CATALOG_MONTH_PAGE_SIZE,
+                                     streaming.get_format(request, default='json')))
+
+
+def get_month_last_modified(request, year=None, month=None):
+    return media_version.get_last_modified(request.user.id)
+
+
 @login_required
+# Browser always validates the response, but gets 304 while media were not changed
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=get_month_etag, last_modified_func=get_month_last_modified)
 def images_for_month(request, year=None, month=None):
-    qs = Media.objects.filter(uploader=request.user)
+    """
+    Media of the month by pages ordered by (show_at, id): `next` is URL of the next page or null.
+
+    Pages are by position (keyset), not by offset: each one is a range scan, media added meanwhile are not skipped.
+    Page is streamed while rows are read, `?stream=ndjson` -- media per line, then {"next": ...} line.
+    """
+    from django.conf import settings
+
+    stream_format = streaming.get_format(request, default='json')
+
+    if not stream_format:
+        raise Http404('Unknown format')
 
-    qs = qs.filter(show_at__year=year, show_at__month=month)
+    page_size = settings.CATALOG_MONTH_PAGE_SIZE
+    start, end = get_month_range(int(year), int(month))
+
+    qs = Media.objects.filter(uploader=request.user, show_at__gte=start, show_at__lt=end)
+
+    if request.GET.get('after'):
+        try:
+            show_at, media_id = decode_cursor(request.GET['after'])
+        except (ValueError, OverflowError):
+            return HttpResponseBadRequest('Invalid cursor')
+
+        qs = qs.filter(Q(show_at__gt=show_at) | Q(show_at=show_at, id__gt=media_id))
 
     # TODO: Use REST API /api/media/?show_year=year&show_month=month
-    return JsonResponse({"media": list(qs.values(*MEDIA_FIELDS).order_by("show_at"))})
+    # Server-side cursor: rows are fetched by chunks while the response is written
+    rows = qs.values(*MEDIA_FIELDS).order_by("show_at", "id")[:page_size + 1].iterator()
+    page = {'last': None, 'next': None}
+
+    def iter_media():
+        for num, media in enumerate(rows):
+            if num == page_size:
+                # The extra row tells there is the next page
+                cursor = encode_cursor(page['last']['show_at'], page['last']['id'])
+                page['next'] = f'{request.path}?after={cursor}' + (
+                    f'&{streaming.FORMAT_PARAM}={stream_format}' if stream_format != 'json' else '')
+                break
+
+            page['last'] = media
+            yield media
+
+    return streaming.stream_response({"media": iter_media(), "next": lambda: page['next']}, stream_format)
@@ -14,6 +14,8 @@ DATABASES['default'] = dj_database_url.config()
 CACHES = {
     'default': django_cache_url.config(),
     'persistent': django_cache_url.parse(os.environ.get('CACHE_PERSISTENT_URL')),
+    # Results of metadata extractors by file content (see storage.tools.content_cache), must evict by LRU itself
+    'content': django_cache_url.config(env='CACHE_CONTENT_URL'),
 }
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
@@ -82,6 +84,59 @@ CELERY_IMPORTS = [
     'processing.tasks',
 ]
 
+CELERY_BEAT_SCHEDULE = {
+    'sweep-expired-chunked-uploads': {
+        'task': 'upload.tasks.sweep_expired_chunked_uploads',
+        'schedule': 3600,
+    },
+}
+
+# Number of long-living exiftool processes per worker process (see storage.tools.exiftool.ExiftoolPool)
+EXIFTOOL_POOL_SIZE = 1
+# Process that does not answer a command in time is killed (and replaced), the command is retried once
+EXIFTOOL_TIMEOUT_SECONDS = 300
+
+# Run cheap processing states in a single task (see processing.states.ProcessingState.FUSED_STATES)
+PROCESSING_FUSED_STATES = True
+
+# Threads of a process (shared by its runs) for independent processors (see processing.processor.get_pool)
+PROCESSING_THREADS = 4
+
+# Cache to aggregate histograms of processors in, shared by all workers (see processing.metrics), None to disable
+PROCESSING_METRICS_CACHE = 'default'
+# Fraction of processing runs profiled by cProfile, e.g. 0.01; profiles are written to PROCESSING_PROFILE_DIR
+PROCESSING_PROFILE_RATE = 0
+PROCESSING_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Media per response of catalog month listing, next ones are loaded by the following requests
+CATALOG_MONTH_PAGE_SIZE = 500
+
+
+# Calculate SHA1 of uploaded files on the fly, instead of reading them once again
+FILE_UPLOAD_HANDLERS = [
+    'upload.handlers.SHA1MemoryFileUploadHandler',
+    'upload.handlers.SHA1TemporaryFileUploadHandler',
+]
+
+# Max width and height of view-optimized images (see processing.play_media.rendition)
+RENDITION_SIZES = (160, 320, 720, 1440, 2880)
+
+# Generated images are stored in these formats too, if Pillow supports them (see storage.tools.image_formats)
+IMAGE_ALTERNATIVE_FORMATS = ('AVIF', 'WEBP')
+
+# Shorter side of transcoded videos (see processing.play_media.transcode)
+VIDEO_RENDITION_SIZES = (360, 720, 1080)
+
+# Videos of that duration and longer are played by HLS (see storage.tools.hls), None disables it
+HLS_MIN_DURATION_SECONDS = 60
+
+# Max number of ffmpeg transcoding processes per host, each of them uses all cores
+TRANSCODE_CONCURRENCY = 1
+
+# Remove chunked uploads (see upload.chunked) not touched for that long
+CHUNKED_UPLOAD_EXPIRE_SECONDS = 2 * 24 * 3600
+# Max size of a file uploaded by chunks, space for it is allocated on start of the upload
+CHUNKED_UPLOAD_MAX_SIZE = 64 * 1024 ** 3
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
@@ -7,6 +7,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.views.i18n import JavaScriptCatalog
 
+from storage.views import serve_media
+
 urlpatterns = [
     url(r'^login/', LoginView.as_view(), name='login'),
     url(r'^logout/', LogoutView.as_view(), name='logout'),
@@ -21,4 +23,4 @@ urlpatterns = [
     url(r'^upload/', include('upload.urls', namespace='upload')),
     url(r'^', include('catalog.urls', namespace='catalog')),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)   # it works only with DEBUG=True
+] + static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)   # it works only with DEBUG=True
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class ProcessingConfig(AppConfig):
     name = 'processing'
+
+    def ready(self):
+        from processing.states import ProcessingState
+
+        # Resolve processors once per process (before Celery forks workers), instead of on every run
+        ProcessingState.compile_pipelines()
@@ -1,6 +1,9 @@
 import logging
 
-from processing.processor import DataProcessor
+from processing.processor import Concurrent, DataProcessor
+
+# Limit of external tools extracting metadata from a single file
+EXTRACTORS_TIMEOUT_SECONDS = 300
 
 PROCESSORS = (
     'processing.media_processors.get_media_by_id',
@@ -9,14 +12,18 @@ PROCESSORS = (
 
     'processing.base_metadata.common.MimetypeByContent',
     'processing.base_metadata.common.MediatypeByMimeType.run',
-    'processing.base_metadata.common.ExiftoolMetadataByContent',
+    # Independent reads of the same file by external tools, they take as long as the slowest of them
+    Concurrent(
+        'processing.base_metadata.common.ExiftoolMetadataByContent',
+        'processing.base_metadata.video.FfprobeMetadataByContent',
+        timeout=EXTRACTORS_TIMEOUT_SECONDS,
+    ),
     'processing.base_metadata.common.MimetypeByExiftoolMetadata',
 
     'processing.base_metadata.image.DegreeByExiftoolMetadata.run',
     'processing.base_metadata.image.SizeCameraByExiftoolMetadata.run',
     'processing.base_metadata.image.ShotAtByExiftoolMetadata.run',
 
-    'processing.base_metadata.video.FfprobeMetadataByContent',
     'processing.base_metadata.video.DurationSizeByFfprobeMetadata',
     'processing.base_metadata.video.DegreeByFfprobeMetadata',
     'processing.base_metadata.video.CameraByFfprobeMetadata',
@@ -36,3 +43,9 @@ def run(media_id=None):
     result = DataProcessor(PROCESSORS, logger=logger).run(media_id=media_id)
 
     # TODO: Maybe generate SHA1 for binary content, though it is usually re-compressed on metadata removal
+
+
+def run_many(media_ids=None):
+    logger = logging.getLogger(__name__)
+    logger.info('extract base metadata for Media.id in %s', media_ids)
+    return DataProcessor(PROCESSORS, logger=logger).run_many(media_ids=media_ids)
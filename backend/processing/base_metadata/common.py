@@ -3,14 +3,16 @@ import os
 from django.db.models.fields.files import FieldFile
 
 from processing.media_processors import is_image, is_video
+from processing.processor import processor
 from storage.const import MediaConstMixin
 from storage.helpers import get_filled_value, base85_to_hex
 
 
-def MimetypeByContent(content=None):
-    import magic
+@processor(writes=('mimetype',))
+def MimetypeByContent(content=None, sha1_b85=None, size_bytes=None):
+    from storage.tools.libmagic import get_mimetype
 
-    return 'mimetype', magic.from_file(content.path, mime=True)
+    return 'mimetype', get_mimetype(content.path, content_key=(sha1_b85, size_bytes))
 
 
 class MediatypeByMimeType:
@@ -21,21 +23,25 @@ class MediatypeByMimeType:
     TYPE_DEFAULT = MediaConstMixin.MEDIA_OTHER
 
     @staticmethod
+    @processor(writes=('media_type',))
     def run(mimetype=None):
         return 'media_type', MediatypeByMimeType.TYPES.get(mimetype.split('/')[0], MediatypeByMimeType.TYPE_DEFAULT)
 
 
+@processor(writes=('show_at',))
 def ShowAtByShotAtSourceLastModified(shot_at=None, source_lastmodified=None):
     if shot_at:
         return 'show_at', shot_at
     return 'show_at', source_lastmodified
 
 
+@processor(writes=('metadata',))
 def EmptyMetadata():
     return 'metadata', {}
 
 
-def ExiftoolMetadataByContent(content=None, media_type=None, metadata=None):
+@processor(writes=('metadata',))
+def ExiftoolMetadataByContent(content=None, media_type=None, metadata=None, sha1_b85=None, size_bytes=None):
     from storage.tools.exiftool import get_exiftool_info
 
     if not is_image(media_type) and not is_video(media_type):
@@ -45,9 +51,13 @@ def ExiftoolMetadataByContent(content=None, media_type=None, metadata=None):
     # See: http://dev.exiv2.org/projects/exiv2/wiki/How_does_Exiv2_compare_to_Exiftool
 
     # Create a clone before update -- to keep initial state immutable
-    return 'metadata', dict(metadata or {}, exiftool=get_exiftool_info(content.path))
+    # Numeric values are extracted in the same call, so no need to parse print values later
+    return 'metadata', dict(metadata or {}, exiftool=get_exiftool_info(
+        content.path, with_numeric_values=True, content_key=(sha1_b85, size_bytes)
+    ))
 
 
+@processor(writes=('mimetype',))
 def MimetypeByExiftoolMetadata(media_type=None, metadata=None):
     if not is_image(media_type) and not is_video(media_type):
         return
@@ -68,6 +78,7 @@ class ContentByExtensionShowAt:
     }
 
     @staticmethod
+    @processor(writes=('content',))
     def run(mimetype=None, source_filename=None, content=None, uploader_id=None, show_at=None, sha1_b85=None,
             size_bytes=None):
         from storage.models import Media
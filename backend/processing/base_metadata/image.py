@@ -4,13 +4,18 @@ import re
 from django.utils import timezone
 
 from processing.media_processors import is_image
+from processing.processor import processor
 from storage.helpers import get_keys_filled_value
+from storage.tools.exiftool import NUMERIC_SUFFIX
 
 
 class DegreeByExiftoolMetadata:
+    # Tags and their numeric values (see storage.tools.exiftool.NUMERIC_SUFFIX) => degree to rotate clockwise.
+    # Numeric values of maker notes differ between manufacturers, so only their print values are parsed.
     KEYS_IMAGE_ORIENTATION = (
-        'EXIF:Orientation',
-        'MakerNotes:CameraOrientation',
+        # 1 = Horizontal (normal), 3 = Rotate 180, 6 = Rotate 90 CW, 8 = Rotate 270 CW
+        ('EXIF:Orientation', {1: 0, 3: 180, 6: 90, 8: 270}),
+        ('MakerNotes:CameraOrientation', None),
     )
 
     ORIENTATIONS_NO_DEGREE = {
@@ -20,19 +25,18 @@ class DegreeByExiftoolMetadata:
     RE_ORIENTATION = re.compile(r'^Rotate (?P<degree>\d+)(?P<counter> CW)?$')
 
     @staticmethod
-    def run(media_type=None, metadata=None):
-        if not is_image(media_type=media_type):
-            return
-
-        orientation = get_keys_filled_value(metadata['exiftool'], DegreeByExiftoolMetadata.KEYS_IMAGE_ORIENTATION)
-
-        if not orientation:
-            # Was not found -- prompt user to rotate
-            return 'needed_rotate_degree', None
-
+    def parse_orientation(orientation):
+        """
+        Degree by print value, it is the same for all manufacturers
+
+        >>> DegreeByExiftoolMetadata.parse_orientation('Rotate 90 CW')
+        90
+        >>> DegreeByExiftoolMetadata.parse_orientation('Rotate 90')
+        270
+        """
         try:
             # First check exact match
-            return 'needed_rotate_degree', DegreeByExiftoolMetadata.ORIENTATIONS_NO_DEGREE[orientation]
+            return DegreeByExiftoolMetadata.ORIENTATIONS_NO_DEGREE[orientation]
         except KeyError:
             pass
 
@@ -40,17 +44,39 @@ class DegreeByExiftoolMetadata:
         m = DegreeByExiftoolMetadata.RE_ORIENTATION.search(orientation)
 
         if not m:
-            # Failed to parse
+            # Failed to parse, e.g. mirrored image
             raise NotImplementedError(f'Unsupported orientation: {orientation}')
 
         degree = int(m.group('degree'), 10)
 
         if m.group('counter'):
-            # counter-clockwise
-            return 'needed_rotate_degree', degree
+            # clock-wise
+            return degree
+
+        # counter-clockwise
+        return 360 - degree
+
+    @staticmethod
+    @processor(writes=('needed_rotate_degree',), guard=is_image)
+    def run(metadata=None):
+        for key, degrees in DegreeByExiftoolMetadata.KEYS_IMAGE_ORIENTATION:
+            orientation = metadata['exiftool'].get(f'{key}{NUMERIC_SUFFIX}')
 
-        # clock-wise
-        return 'needed_rotate_degree', 360 - degree
+            if degrees is not None and orientation is not None:
+                try:
+                    return 'needed_rotate_degree', degrees[orientation]
+                except KeyError:
+                    # e.g. mirrored image
+                    raise NotImplementedError(f'Unsupported orientation: {key}={orientation!r}')
+
+            # Media extracted before numeric values were stored have only print ones
+            orientation = metadata['exiftool'].get(key)
+
+            if orientation:
+                return 'needed_rotate_degree', DegreeByExiftoolMetadata.parse_orientation(orientation)
+
+        # Was not found -- prompt user to rotate
+        return 'needed_rotate_degree', None
 
 
 class SizeCameraByExiftoolMetadata:
@@ -87,10 +113,8 @@ class SizeCameraByExiftoolMetadata:
     )
 
     @staticmethod
-    def run(media_type=None, metadata=None):
-        if not is_image(media_type=media_type):
-            return
-
+    @processor(writes=('camera', 'width', 'height'), guard=is_image)
+    def run(metadata=None):
         yield 'camera', get_keys_filled_value(metadata['exiftool'], SizeCameraByExiftoolMetadata.KEYS_IMAGE_CAMERA) or ''
 
         width = get_keys_filled_value(metadata['exiftool'], SizeCameraByExiftoolMetadata.KEYS_IMAGE_WIDTH)
@@ -151,10 +175,8 @@ class ShotAtByExiftoolMetadata:
     )
 
     @staticmethod
-    def run(media_type=None, metadata=None):
-        if not is_image(media_type=media_type):
-            return
-
+    @processor(writes=('shot_at',), guard=is_image)
+    def run(metadata=None):
         shot_date = get_keys_filled_value(metadata['exiftool'], ShotAtByExiftoolMetadata.KEYS_IMAGE_SHOOT)
 
         if shot_date:
@@ -1,17 +1,18 @@
 import datetime
 
 from processing.media_processors import is_video
+from processing.processor import processor
 from storage.helpers import resolve_dict, get_filled_value
 
 
-def FfprobeMetadataByContent(media_type=None, content=None, metadata=None):
+@processor(writes=('metadata',), guard=is_video)
+def FfprobeMetadataByContent(content=None, metadata=None, sha1_b85=None, size_bytes=None):
     from storage.tools import ffmpeg
 
-    if not is_video(media_type=media_type):
-        return
-
     # Create a clone before update -- to keep initial state immutable
-    return 'metadata', dict(metadata or {}, ffprobe=ffmpeg.get_ffprobe_info(content.path))
+    return 'metadata', dict(metadata or {}, ffprobe=ffmpeg.get_ffprobe_info(
+        content.path, content_key=(sha1_b85, size_bytes)
+    ))
 
 
 def get_get_video_stream(streams=None):
@@ -24,10 +25,8 @@ def get_get_video_stream(streams=None):
     raise NotImplementedError(f'Multi-stream videos ({len(video_streams)} streams) are not supported')
 
 
-def DurationSizeByFfprobeMetadata(media_type=None, metadata=None):
-    if not is_video(media_type=media_type):
-        return
-
+@processor(writes=('duration', 'width', 'height'), guard=is_video)
+def DurationSizeByFfprobeMetadata(metadata=None):
     video_stream = get_get_video_stream(streams=metadata['ffprobe']['streams'])
 
     yield 'duration', datetime.timedelta(seconds=float(video_stream['duration']))
@@ -41,19 +40,15 @@ def DurationSizeByFfprobeMetadata(media_type=None, metadata=None):
     yield 'height', height
 
 
-def DegreeByFfprobeMetadata(media_type=None):
-    if not is_video(media_type=media_type):
-        return
-
+@processor(writes=('needed_rotate_degree',), guard=is_video)
+def DegreeByFfprobeMetadata():
     # videos are auto-rotated by ffmpeg during playout / screenshot extraction, so no rotation needed
     # OLD: video_stream['side_data_list'][0]['rotation'] OR video_stream['tags']['rotate']
     return 'needed_rotate_degree', 0
 
 
-def CameraByFfprobeMetadata(media_type=None, metadata=None):
-    if not is_video(media_type=media_type):
-        return
-
+@processor(writes=('camera',), guard=is_video)
+def CameraByFfprobeMetadata(metadata=None):
     yield 'camera', resolve_dict('format:tags:com.apple.quicktime.model', metadata['ffprobe']) or ''
 
 
@@ -64,12 +59,10 @@ class ShotAtByFfprobeMetadata:
     )
 
     @staticmethod
-    def run(media_type=None, metadata=None):
+    @processor(writes=('shot_at',), guard=is_video)
+    def run(metadata=None):
         from processing.base_metadata.image import ShotDate
 
-        if not is_video(media_type=media_type):
-            return
-
         shot_date = get_filled_value(ShotAtByFfprobeMetadata.get_shot_dates(metadata=metadata['ffprobe']))
 
         if shot_date:
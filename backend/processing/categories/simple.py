@@ -1,11 +1,14 @@
 from processing.media_processors import is_image, is_video
+from processing.processor import processor
 from storage.const import MediaConstMixin
 
 
+@processor(writes=('categories',))
 def EmptyCategories():
     return 'categories', set()
 
 
+@processor(writes=('categories',))
 def CategoriesToTuple(categories=None):
     return 'categories', tuple(categories) if categories else ()
 
@@ -24,10 +27,12 @@ class CategoryTypeByMediaType:
     }
 
     @staticmethod
+    @processor(writes=('categories',))
     def run(media_type=None, categories=None):
         return 'categories', categories | {CategoryTypeByMediaType.CATEGORY_BY_TYPE[media_type]}
 
 
+@processor(writes=('categories',))
 def CategoryAspectRatioByThumbnailSize(categories=None, thumbnail_width=None, thumbnail_height=None):
     if not thumbnail_width or not thumbnail_height:
         return 'categories', categories | {MediaConstMixin.CATEGORY_NON_MEDIA}
@@ -42,6 +47,7 @@ def CategoryAspectRatioByThumbnailSize(categories=None, thumbnail_width=None, th
     return 'categories', categories | {MediaConstMixin.CATEGORY_MEDIA_PORTRAIT}
 
 
+@processor(writes=('categories',))
 def CategoryPanoramaByThumbnailSize(categories=None, media_type=None, thumbnail_width=None, thumbnail_height=None):
     aspect_ratio = get_aspect_ratio_absolute(thumbnail_width, thumbnail_height)
 
@@ -50,6 +56,7 @@ def CategoryPanoramaByThumbnailSize(categories=None, media_type=None, thumbnail_
         return 'categories', categories | {MediaConstMixin.CATEGORY_PANORAMA}
 
 
+@processor(writes=('categories',))
 def CategoryWidescreenByThumbnailSize(categories=None, media_type=None, thumbnail_width=None, thumbnail_height=None):
     aspect_ratio = get_aspect_ratio_absolute(thumbnail_width, thumbnail_height)
 
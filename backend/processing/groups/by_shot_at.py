@@ -1,10 +1,14 @@
 import logging
 
+from processing.processor import processor
+
 logger = logging.getLogger(__name__)
 
 
+@processor(writes=('num',))
 def GroupMediaByShotAt(media_id=None):
     from storage.models import Media
+    from storage.tools import media_version
 
     # as a first version, we check for every image we got -- not aggregate by shot_at
 
@@ -19,8 +23,8 @@ def GroupMediaByShotAt(media_id=None):
     else:
         logger.warning('Shot at without microsecond cannot be precise identifier: {.shot_at:%Y.%m.%d %H:%M%S.%f%Z}'.format(media))
 
-    # Find all image that were shot exactly at that time
-    shot_media = list(Media.objects.filter(shot_at=media.shot_at))
+    # Find all image of the user that were shot exactly at that time
+    shot_media = list(Media.objects.filter(uploader_id=media.uploader_id, shot_at=media.shot_at))
 
     if len(shot_media) < 2:
         # Somehow it was marked as having the same shot, but actually it is not
@@ -39,6 +43,7 @@ def GroupMediaByShotAt(media_id=None):
         shot_id = Media.get_next_shot_id()
 
     num = Media.objects.filter(id__in=[m.id for m in shot_media]).update(shot_id=shot_id)
+    media_version.touch(m.uploader_id for m in shot_media)
     return 'num', num
 
     # TODO: Consider other checks since they are more strict
@@ -0,0 +1,66 @@
+from django.core.management import BaseCommand
+
+TABLE = 'benchmark_media'
+
+# Filters of MediaFilter: any-of (&&) / all-of (@>) categories, with a month, as sent by catalog
+QUERIES = (
+    ('any-of, rare category', 'uploader_id = 1 AND categories && %s', [[3]]),
+    ('any-of, common categories', 'uploader_id = 1 AND categories && %s', [[10, 11]]),
+    ('all-of', 'uploader_id = 1 AND categories @> %s', [[1, 21]]),
+    ('any-of + month', "uploader_id = 1 AND categories && %s AND show_at >= now() - interval '1 year' "
+                       "AND show_at < now() - interval '11 months'", [[2]]),
+)
+
+
+class Command(BaseCommand):
+    help = "Compare plans and latency of category filters with and without GIN index, on a synthetic table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', action='store', dest='rows', default=1000000, type=int,
+            help='Number of synthetic media',
+        )
+        parser.add_argument(
+            '--uploaders', action='store', dest='uploaders', default=100, type=int,
+            help='Number of users media belong to',
+        )
+        parser.add_argument(
+            '--repeat', action='store', dest='repeat', default=5, type=int,
+            help='Runs per query, median is shown',
+        )
+
+    def handle(self, *, rows=None, uploaders=None, repeat=None, **options):
+        from django.db import connection
+        from storage.tools import query_benchmark
+
+        with connection.cursor() as cursor:
+            self.stdout.write(f'Generating {rows} media of {uploaders} users...')
+            query_benchmark.create_table(cursor, TABLE, rows=rows, uploaders=uploaders)
+            # Like the index of Media.uploader foreign key
+            cursor.execute(f'CREATE INDEX {TABLE}_uploader ON {TABLE} (uploader_id)')
+            query_benchmark.analyze(cursor, TABLE)
+
+            before = self.run_queries(cursor, repeat)
+
+            # The same as Media.Meta.indexes
+            cursor.execute(f'CREATE INDEX {TABLE}_uploader_categories_gin ON {TABLE} USING gin (uploader_id, categories)')
+            query_benchmark.analyze(cursor, TABLE)
+
+            after = self.run_queries(cursor, repeat)
+
+            cursor.execute(f'DROP TABLE {TABLE}')
+
+        for title, results in (('Without GIN index', before), ('With GIN index', after)):
+            self.stdout.write(f'\n{title}:')
+
+            for (name, where, params), result in zip(QUERIES, results):
+                self.stdout.write(query_benchmark.format_result(name, result))
+
+    @staticmethod
+    def run_queries(cursor, repeat):
+        from storage.tools import query_benchmark
+
+        # A page of catalog
+        return [query_benchmark.measure(cursor, f'SELECT id FROM {TABLE} WHERE {where} ORDER BY show_at, id LIMIT 100',
+                                        params, repeat=repeat)
+                for name, where, params in QUERIES]
@@ -0,0 +1,74 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Record plans and latency of catalog & processing queries on a synthetic table with indexes of Media, "
+            "compare them with a previous run")
+
+    TABLE = 'benchmark_media'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', action='store', dest='rows', default=1000000, type=int,
+            help='Number of synthetic media',
+        )
+        parser.add_argument(
+            '--uploaders', action='store', dest='uploaders', default=100, type=int,
+            help='Number of users media belong to',
+        )
+        parser.add_argument(
+            '--repeat', action='store', dest='repeat', default=5, type=int,
+            help='Runs per query, median is recorded',
+        )
+        parser.add_argument(
+            '--no-indexes', action='store_false', dest='indexes', default=True,
+            help='Only primary key, to see what indexes give',
+        )
+        parser.add_argument(
+            '--output', action='store', dest='output', default=None,
+            help='Save results into JSON file, e.g. to be a baseline',
+        )
+        parser.add_argument(
+            '--baseline', action='store', dest='baseline', default=None,
+            help='Results of a previous run: fail on slower queries or changed plans',
+        )
+        parser.add_argument(
+            '--max-slowdown', action='store', dest='max_slowdown', default=1.2, type=float,
+            help='Query is a regression once it is slower than baseline by more times',
+        )
+
+    def handle(self, *, rows=None, uploaders=None, repeat=None, indexes=None, output=None, baseline=None,
+               max_slowdown=None, **options):
+        from django.db import connection
+        from storage.tools import query_benchmark
+
+        with connection.cursor() as cursor:
+            self.stderr.write(f'Generating {rows} media of {uploaders} users...')
+            query_benchmark.create_table(cursor, self.TABLE, rows=rows, uploaders=uploaders)
+
+            if indexes:
+                query_benchmark.create_indexes(cursor, self.TABLE)
+
+            query_benchmark.analyze(cursor, self.TABLE)
+
+            results = query_benchmark.run_queries(cursor, self.TABLE, repeat=repeat)
+
+            cursor.execute(f'DROP TABLE {self.TABLE}')
+
+        for name, result in results.items():
+            self.stdout.write(query_benchmark.format_result(name, result))
+
+        if output:
+            with open(output, 'w') as f:
+                json.dump({'rows': rows, 'uploaders': uploaders, 'indexes': indexes, 'results': results}, f, indent=2)
+
+        if baseline:
+            with open(baseline) as f:
+                regressions = query_benchmark.compare(results, json.load(f)['results'], max_slowdown=max_slowdown)
+
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+
+            self.stdout.write('No regressions')
@@ -0,0 +1,109 @@
+import os
+import resource
+import tempfile
+import time
+from multiprocessing import Pool
+
+from django.core.management import BaseCommand
+
+
+def generate_full(path):
+    """Previous way: decode all pixels, then resample all of them"""
+    from PIL import Image
+    from processing.quick_thumbnail.thumbnail import Thumbnail
+
+    with Image.open(path) as image:
+        image.load()
+
+        try:
+            # Pillow 7+ reduces image before resample by default
+            image.thumbnail(**Thumbnail.THUMBNAIL_RESIZE_SETTINGS, reducing_gap=None)
+        except TypeError:
+            image.thumbnail(**Thumbnail.THUMBNAIL_RESIZE_SETTINGS)
+
+        return image.copy()
+
+
+def generate_reduced(path):
+    from PIL import Image
+    from processing.quick_thumbnail.thumbnail import Thumbnail
+
+    with Image.open(path) as image:
+        thumbnail = Thumbnail.reduce(image)
+        thumbnail.thumbnail(**Thumbnail.THUMBNAIL_RESIZE_SETTINGS)
+        return thumbnail.copy()
+
+
+METHODS = {
+    'full': generate_full,
+    'reduced': generate_reduced,
+}
+
+
+def measure(method, path, repeat):
+    """Run in a fresh worker process, so its peak RSS belongs to this method only"""
+    started_at = time.process_time()
+
+    for _ in range(repeat):
+        thumbnail = METHODS[method](path)
+
+    cpu_seconds = (time.process_time() - started_at) / repeat
+    # KiB on Linux
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return cpu_seconds, max_rss_mb, thumbnail.mode, thumbnail.size, thumbnail.tobytes()
+
+
+class Command(BaseCommand):
+    help = "Compare CPU time, peak RSS and quality of thumbnail generation with and without reducing decoders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', metavar='paths', nargs='*',
+            help='Images, by default a synthetic 24 MP JPEG is used')
+        parser.add_argument(
+            '--repeat', action='store', dest='repeat', default=3, type=int,
+            help='Number of thumbnails per image and method',
+        )
+
+    def handle(self, *, paths=None, repeat=None, **options):
+        from PIL import Image, ImageChops, ImageStat
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = paths or [self.generate_image(os.path.join(tmp_dir, 'synthetic.jpg'))]
+
+            for path in paths:
+                with Image.open(path) as image:
+                    self.stdout.write(f'{path}: {image.format} {image.size[0]}x{image.size[1]} {image.mode}')
+
+                thumbnails = {}
+
+                for method in METHODS:
+                    # New process per measure: peak RSS is never decreased
+                    with Pool(processes=1) as pool:
+                        cpu_seconds, max_rss_mb, mode, size, data = pool.apply(measure, (method, path, repeat))
+
+                    thumbnails[method] = Image.frombytes(mode, size, data)
+                    self.stdout.write(f'    {method:>8}: {cpu_seconds * 1000:8.1f} ms CPU, {max_rss_mb:7.1f} MB peak RSS')
+
+                full, reduced = thumbnails['full'], thumbnails['reduced']
+
+                if full.size != reduced.size:
+                    self.stdout.write(f'    sizes differ: {full.size} != {reduced.size}')
+                    continue
+
+                # Per channel, 0..255
+                diff = ImageStat.Stat(ImageChops.difference(full.convert('RGB'), reduced.convert('RGB')))
+                self.stdout.write(f'    difference: mean {max(diff.mean):.2f}, max {max(high for low, high in diff.extrema)}')
+
+    @staticmethod
+    def generate_image(path, size=(6000, 4000)):
+        """Detailed picture, sensor-like noise makes JPEG decoding as expensive as for a real photo"""
+        from PIL import Image, ImageChops
+
+        image = Image.merge('RGB', [
+            ImageChops.add(Image.effect_mandelbrot(size, extent, quality), Image.effect_noise(size, 8), offset=-128)
+            for extent, quality in [((-2.0, -1.0, 1.0, 1.0), 100), ((-1.0, -0.5, 0.5, 0.5), 50), ((-2, -2, 2, 2), 20)]
+        ])
+        image.save(path, format='JPEG', quality=90)
+        return path
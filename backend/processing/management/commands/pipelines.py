@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Show processing pipelines: processors with fields they read and write"
+
+    def handle(self, **options):
+        from processing.states import ProcessingState
+
+        for name, pipeline in ProcessingState.compile_pipelines():
+            self.stdout.write(f'# {name}')
+            self.stdout.write(f'ARGS: {", ".join(sorted(pipeline.args))}')
+            self.stdout.write(pipeline.format_report())
+            self.stdout.write('')
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Print histograms of processors (see processing.metrics) in Prometheus text format"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', action='store', dest='output', default=None,
+            help='Write into the file instead, e.g. for textfile collector of node_exporter',
+        )
+        parser.add_argument(
+            '--clear', action='store_true', dest='clear', default=False,
+            help='Reset all histograms',
+        )
+
+    def handle(self, *, output=None, clear=False, **options):
+        from processing import metrics
+
+        if clear:
+            metrics.clear()
+            return
+
+        text = metrics.render()
+
+        if not output:
+            self.stdout.write(text, ending='')
+            return
+
+        # Collector must never read a half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)), suffix='.tmp')
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+
+        os.replace(tmp_path, output)
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Recompute numbers of media by month and category (see storage.tools.media_counters)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'uploader_ids', metavar='uploader_ids', nargs='*', type=int,
+            help='User IDs, all users by default')
+
+    def handle(self, *, uploader_ids=None, **options):
+        from storage.tools import media_counters
+
+        media_counters.rebuild(uploader_ids or None)
@@ -1,9 +1,27 @@
+import collections
+import json
+import os
+import time
+
 from django.core.management import BaseCommand, CommandError
 
 
+def run_chunk(state_code, media_ids):
+    """Run in a worker process: returns number of failed media"""
+    from processing.states import ProcessingState
+
+    passed_ids = ProcessingState.run_many(state_code=state_code, media_ids=media_ids)
+    return len(media_ids) - len(passed_ids)
+
+
 class Command(BaseCommand):
     help = "Re-process given media (by id)"
 
+    # Chunks sent to worker processes, but not finished yet, per worker
+    CHUNKS_PER_WORKER = 2
+    PROGRESS_INTERVAL_SECONDS = 1
+    DEFAULT_CHECKPOINT = '.reprocess-checkpoint.json'
+
     def add_arguments(self, parser):
         parser.add_argument(
             'ids', metavar='ids', nargs='*', type=int,
@@ -20,25 +38,198 @@ class Command(BaseCommand):
             '--failed', action='store_true', dest='failed_media', default=False,
             help='Re-process all media with errors',
         )
+        parser.add_argument(
+            '--workers', action='store', dest='workers', default=1, type=int,
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--celery', action='store_true', dest='use_celery', default=False,
+            help='Send chunks to Celery instead of processing them here (checkpoint is not written: '
+                 'chunks are only queued, not processed)',
+        )
+        parser.add_argument(
+            '--chunk-size', action='store', dest='chunk_size', default=100, type=int,
+            help='Number of media processed together (loaded and saved by one query)',
+        )
+        parser.add_argument(
+            '--max-rate', action='store', dest='max_rate', default=None, type=float,
+            help='Max number of media per second, not to starve a live server',
+        )
+        parser.add_argument(
+            '--checkpoint', action='store', dest='checkpoint', default=None,
+            help=f'File to store the last processed media id (default with --resume: {self.DEFAULT_CHECKPOINT})',
+        )
+        parser.add_argument(
+            '--resume', action='store_true', dest='resume', default=False,
+            help='Skip media up to the id stored in checkpoint file',
+        )
 
-    def handle(self, *, state_code=None, ids=None, all_media=None, failed_media=None, **options):
+    def handle(self, *, state_code=None, ids=None, all_media=None, failed_media=None, workers=None, use_celery=None,
+               chunk_size=None, max_rate=None, checkpoint=None, resume=None, **options):
         from storage.models import Media
-        from processing.states import ProcessingState
+
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
+
+        if resume and checkpoint is None:
+            checkpoint = self.DEFAULT_CHECKPOINT
+
+        last_id = self.read_checkpoint(checkpoint, state_code=state_code) if resume else None
+        write_checkpoint = checkpoint is not None and not use_celery
 
         if all_media:
-            ids += list(Media.objects.values_list('id', flat=True))
+            qs = Media.objects.all()
         elif failed_media:
-            ids += list(Media.objects.filter(processing_state_code__lt=0).values_list('id', flat=True))
-        elif not ids:
+            qs = Media.objects.filter(processing_state_code__lt=0)
+        elif ids:
+            qs = Media.objects.filter(id__in=ids)
+        else:
             raise CommandError('Must provide at least one ID or use flags --failed or --all')
 
-        if not ids:
+        if last_id is not None:
+            qs = qs.filter(id__gt=last_id)
+
+        qs = qs.order_by('id').values_list('id', flat=True)
+
+        if use_celery:
+            process_chunks = self.send_chunks
+        elif workers > 1:
+            process_chunks = self.process_chunks_pool
+        else:
+            process_chunks = self.process_chunks
+
+        self.progress = Progress(total=qs.count(), stream=self.stderr)
+
+        if not self.progress.total:
             self.stderr.write('Nothing to do.')
             return
 
-        self.stderr.write(f'Re-process {len(ids)} media...')
+        self.stderr.write(f'Re-process {self.progress.total} media from state {state_code}...')
+
+        chunks = self.get_chunks(qs, chunk_size=chunk_size, max_rate=max_rate)
 
-        for media_id in ids:
-            ProcessingState.run(state_code=state_code, media_id=media_id)
+        for chunk, failed_num in process_chunks(chunks, state_code=state_code, workers=workers):
+            if write_checkpoint:
+                self.write_checkpoint(checkpoint, state_code=state_code, last_id=chunk[-1])
+            self.progress.update(len(chunk), failed_num)
 
+        self.progress.finish()
         self.stderr.write('Done.')
+
+    @staticmethod
+    def get_chunks(qs, chunk_size=None, max_rate=None):
+        """Stream ids by server-side cursor, sleep between chunks to keep the rate"""
+        started_at = time.monotonic()
+        num = 0
+        chunk = []
+
+        for media_id in qs.iterator():
+            chunk.append(media_id)
+
+            if len(chunk) < chunk_size:
+                continue
+
+            yield chunk
+            num += len(chunk)
+            chunk = []
+
+            if max_rate:
+                time.sleep(max(0, started_at + num / max_rate - time.monotonic()))
+
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def process_chunks(chunks, state_code=None, workers=None):
+        for chunk in chunks:
+            yield chunk, run_chunk(state_code, chunk)
+
+    @classmethod
+    def process_chunks_pool(cls, chunks, state_code=None, workers=None):
+        """Yield chunks in the same order as they were read, so checkpoint always has all previous media done"""
+        from multiprocessing import Pool
+        from django.db import connections
+
+        # Do not share DB connections with worker processes
+        connections.close_all()
+
+        pending = collections.deque()
+
+        with Pool(processes=workers) as pool:
+            for chunk in chunks:
+                pending.append((chunk, pool.apply_async(run_chunk, (state_code, chunk))))
+
+                while len(pending) >= workers * cls.CHUNKS_PER_WORKER:
+                    chunk, result = pending.popleft()
+                    yield chunk, result.get()
+
+            while pending:
+                chunk, result = pending.popleft()
+                yield chunk, result.get()
+
+    @staticmethod
+    def send_chunks(chunks, state_code=None, workers=None):
+        from processing.states import ProcessingState
+
+        for chunk in chunks:
+            ProcessingState.delay_many(state_code=state_code, media_ids=chunk, chunk_size=len(chunk))
+            # Failures are not known here, see `--failed` later
+            yield chunk, 0
+
+    @staticmethod
+    def read_checkpoint(path, state_code=None):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'Checkpoint file {path} does not exist')
+
+        if data['state_code'] != state_code:
+            raise CommandError(f'Checkpoint file {path} is for state {data["state_code"]}, not {state_code}')
+
+        return data['last_id']
+
+    @staticmethod
+    def write_checkpoint(path, state_code=None, last_id=None):
+        # Write atomically, to keep previous checkpoint if interrupted
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'state_code': state_code, 'last_id': last_id}, f)
+
+        os.replace(f'{path}.tmp', path)
+
+
+class Progress:
+    def __init__(self, total=None, stream=None, interval=Command.PROGRESS_INTERVAL_SECONDS):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.num = 0
+        self.failed_num = 0
+        self.started_at = time.monotonic()
+        self.shown_at = 0
+
+    def update(self, num, failed_num):
+        self.num += num
+        self.failed_num += failed_num
+
+        if time.monotonic() - self.shown_at >= self.interval:
+            self.show()
+
+    def show(self, ending='\r'):
+        self.shown_at = time.monotonic()
+
+        elapsed = self.shown_at - self.started_at
+        rate = self.num / elapsed if elapsed else 0
+        eta = (self.total - self.num) / rate if rate else 0
+
+        self.stream.write(
+            f'{self.num}/{self.total} ({self.num / self.total:.1%}), failed {self.failed_num}, '
+            f'{rate:.1f} media/s, ETA {int(eta // 3600)}:{int(eta % 3600 // 60):02}:{int(eta % 60):02}',
+            ending=ending
+        )
+
+        if ending == '\r':
+            self.stream.flush()
+
+    def finish(self):
+        self.show(ending='\n')
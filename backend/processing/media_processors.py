@@ -1,16 +1,32 @@
 import inspect
 import json
+from collections import Counter
 
 from channels import Group
 
-from processing.processor import DataProcessor
+from processing.processor import DataProcessor, processor
 from storage.const import MediaConstMixin
 
 
+# First and last processors of a pipeline that works with Media model
+LOAD_PROCESSOR = 'processing.media_processors.get_media_by_id'
+SAVE_PROCESSOR = 'processing.media_processors.save_media'
+
+# Camera RAW formats by exiftool File:FileType, they contain JPEG previews
+RAW_FILE_TYPES = frozenset({
+    '3FR', 'ARW', 'CR2', 'CR3', 'CRW', 'DCR', 'DNG', 'ERF', 'IIQ', 'K25', 'KDC', 'MEF', 'MOS', 'MRW', 'NEF', 'NRW',
+    'ORF', 'PEF', 'RAF', 'RAW', 'RW2', 'RWL', 'SR2', 'SRF', 'SRW', 'X3F',
+})
+
+
 def is_image(media_type=None):
     return media_type == MediaConstMixin.MEDIA_IMAGE
 
 
+def is_raw_image(metadata=None):
+    return bool(metadata and metadata.get('exiftool')) and metadata['exiftool'].get('File:FileType') in RAW_FILE_TYPES
+
+
 def is_video(media_type=None):
     return media_type == MediaConstMixin.MEDIA_VIDEO
 
@@ -19,6 +35,8 @@ def is_other(media_type=None):
     return media_type == MediaConstMixin.MEDIA_OTHER
 
 
+# Loads all fields the pipeline reads
+@processor(writes=DataProcessor.ALL_ARGUMENTS)
 def get_media_by_id(media_id=None, ARGS=None):
     from storage.models import Media
 
@@ -32,24 +50,100 @@ def get_media_by_id(media_id=None, ARGS=None):
     yield from media.items()
 
 
-def save_media(ARGS=None, media_id=None, **kwargs):
+def get_media_by_ids(media_ids=None, ARGS=None):
+    """Batch variant of `get_media_by_id`: {media_id: data} for all found media, loaded by one query"""
+    from storage.models import Media
+
+    # exclude arguments of single variant
+    ARGS = set(ARGS) - set(inspect.getfullargspec(get_media_by_id).args) - DataProcessor.ALL_ARGUMENTS
+
+    result = {}
+
+    for media in Media.objects.filter(id__in=media_ids).only(*ARGS):
+        data = {k: getattr(media, k) for k in ARGS}
+        result[media.id] = {DataProcessor.INITIAL_STATE_ARG: data, **data}
+
+    return result
+
+
+def get_changed_fields(data):
+    """Media fields whose values changed comparing to initial state: {field name: value}"""
     from storage.models import Media
 
-    initial_state = kwargs.pop(DataProcessor.INITIAL_STATE_ARG)
+    initial_state = data[DataProcessor.INITIAL_STATE_ARG]
+
+    # Skip intermediary values that are not fields, e.g. results of fused states
+    names = {f.attname: f.name for f in Media._meta.concrete_fields}
+    names.update({f.name: f.name for f in Media._meta.concrete_fields})
 
     # Save only those values that changed. For mutable objects (e.g. dict) we must receive a copy here.
-    data = {k: v for k, v in kwargs.items() if v is not initial_state.get(k)}
+    return {names[k]: v for k, v in data.items() if k in names and v is not initial_state.get(k)}
+
 
-    media = Media.objects.filter(id=media_id).only('id').get()
+@processor(writes=('media',))
+def save_media(ARGS=None, media_id=None, **kwargs):
+    from django.db import transaction
+    from storage.models import Media
+    from storage.tools import media_counters
+
+    data = get_changed_fields(kwargs)
+
+    with transaction.atomic():
+        # uploader_id is used by post_save signal, counted fields -- to change counters by the saved values
+        media = Media.objects.select_for_update().filter(id=media_id).only(
+            'id', 'uploader_id', *media_counters.FIELDS).get()
+        old_state = media_counters.get_state(media)
 
-    for k, v in data.items():
-        setattr(media, k, v)
+        for k, v in data.items():
+            setattr(media, k, v)
 
-    media.save(update_fields=data.keys())
+        media.save(update_fields=data.keys())
+        media_counters.add(media_counters.get_deltas(media.uploader_id, old_state, media_counters.get_state(media)))
 
     return 'media', media
 
 
+def save_media_many(items=None):
+    """Batch variant of `save_media`: {media_id: data} => {media_id: media}, saved by one UPDATE"""
+    from django.db import transaction
+    from storage.models import Media
+    from storage.tools import media_counters, media_version
+    from storage.tools.bulk_update import bulk_update
+
+    with transaction.atomic():
+        # uploader_id is used to generate names of files (e.g. thumbnail), counted fields -- see save_media
+        medias = Media.objects.select_for_update().filter(id__in=list(items)).only(
+            'id', 'uploader_id', *media_counters.FIELDS).in_bulk()
+
+        objs_fields = []
+        deltas = Counter()
+
+        for media_id, data in items.items():
+            media = medias[media_id]
+            data = get_changed_fields(data)
+            old_state = media_counters.get_state(media)
+
+            for k, v in data.items():
+                setattr(media, k, v)
+
+            objs_fields.append((media, data.keys()))
+            deltas.update(media_counters.get_deltas(media.uploader_id, old_state, media_counters.get_state(media)))
+
+        bulk_update(Media, objs_fields)
+        media_counters.add({key: delta for key, delta in deltas.items() if delta})
+        # UPDATE does not send post_save
+        media_version.touch(media.uploader_id for media, fields in objs_fields)
+
+    return medias
+
+
+# Batch variants of processors, used by DataProcessor.run_many
+BATCH_PROCESSORS = {
+    LOAD_PROCESSOR: get_media_by_ids,
+    SAVE_PROCESSOR: save_media_many,
+}
+
+
 def ws_notify_about_thumbnail(media=None):
     Group(f'upload-{media.uploader_id}').send({'text': json.dumps(
         ('thumbnail', {
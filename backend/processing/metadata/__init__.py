@@ -16,3 +16,9 @@ def run(media_id=None):
     logger = logging.getLogger(__name__)
     logger.info('calculate metadata for Media.id=%s', media_id)
     result = DataProcessor(PROCESSORS, logger=logger).run(media_id=media_id)
+
+
+def run_many(media_ids=None):
+    logger = logging.getLogger(__name__)
+    logger.info('calculate metadata for Media.id in %s', media_ids)
+    return DataProcessor(PROCESSORS, logger=logger).run_many(media_ids=media_ids)
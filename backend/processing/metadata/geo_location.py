@@ -1,3 +1,8 @@
+from processing.processor import processor
+
+
+# Reverse geocoding is a remote call: on reprocessing it is done only if coordinates changed
+@processor(writes=('location',), skip_unchanged=True)
 def LocationByGPS(gps_location=None):
     """
     Options:
@@ -1,7 +1,8 @@
 import re
 
 from lib.point_field import Point
-from storage.helpers import get_re_keys_filled_value
+from processing.processor import processor
+from storage.tools.exiftool import NUMERIC_SUFFIX
 
 
 def dms_dict2dd(degrees=0, minutes=0, seconds=0, direction='N'):
@@ -21,7 +22,7 @@ RE_DMS = re.compile(
 
 
 def parse_dms(text):
-    """
+    r"""
     >>> parse_dms('51 deg 50\' 20.13" N')
     {'degrees': '51', 'minutes': '50', 'seconds': '20.13', 'direction': 'N'}
     >>> parse_dms('51 deg 50\' 20.13"')
@@ -34,7 +35,7 @@ def parse_dms(text):
 
 
 def dms2dd(text):
-    """
+    r"""
     >>> dms2dd('51 deg 50\' 20.13" N')
     51.838925
     >>> dms2dd('51 deg 50\' 20.13"')
@@ -82,23 +83,65 @@ def text2m(text):
         return float(m.group('meters'))
 
 
+def to_float(value):
+    """
+    >>> to_float(51.838925)
+    51.838925
+    >>> to_float('48.3')
+    48.3
+    >>> to_float('')
+    """
+    if value is None or value == '':
+        return
+    return float(value)
+
+
 class GPSByExiftoolMetadata:
-    RE_LATITUDE = re.compile('(?i)GPSLatitude$')  # Composite:GPSLatitude  | EXIF:GPSLatitude
-    RE_LONGITUDE = re.compile('(?i)GPSLongitude$')  # Composite:GPSLongitude | EXIF:GPSLongitude
-    RE_ALTITUDE = re.compile('(?i)GPSAltitude$')  # Composite:GPSAltitude  | EXIF:GPSAltitude
-    PRECISION = 'EXIF:GPSHPositioningError'
+    # In order of preference: Composite:* ones are signed, others need *Ref tags
+    KEYS_LATITUDE = ('Composite:GPSLatitude', 'EXIF:GPSLatitude', 'XMP:GPSLatitude')
+    KEYS_LONGITUDE = ('Composite:GPSLongitude', 'EXIF:GPSLongitude', 'XMP:GPSLongitude')
+    KEYS_ALTITUDE = ('Composite:GPSAltitude', 'EXIF:GPSAltitude', 'XMP:GPSAltitude')
+    KEYS_PRECISION = ('EXIF:GPSHPositioningError',)
+
+    @staticmethod
+    def get_value(exiftool, keys, parse):
+        """
+        Value of the first filled key: numeric one (see storage.tools.exiftool.NUMERIC_SUFFIX) or parsed print one,
+        media extracted before numeric values were stored have only print values.
+
+        >>> GPSByExiftoolMetadata.get_value({'EXIF:GPSLatitude#': 51.8, 'Composite:GPSLatitude#': -51.8},
+        ...                                 GPSByExiftoolMetadata.KEYS_LATITUDE, dms2dd)
+        -51.8
+        >>> GPSByExiftoolMetadata.get_value({'EXIF:GPSAltitude': '48.3 m Above Sea Level'},
+        ...                                 GPSByExiftoolMetadata.KEYS_ALTITUDE, alt2m)
+        48.3
+        """
+        for key in keys:
+            value = to_float(exiftool.get(f'{key}{NUMERIC_SUFFIX}'))
+
+            if value is not None:
+                return value
+
+            value = exiftool.get(key)
+
+            if isinstance(value, (int, float)):
+                return float(value)
+
+            if value:
+                return parse(value)
 
     @staticmethod
+    @processor(writes=('gps_location', 'gps_altitude_m', 'gps_precision_m'))
     def run(metadata):
         if not metadata.get('exiftool'):
             return
 
-        point = Point(dms2dd(get_re_keys_filled_value(metadata['exiftool'], GPSByExiftoolMetadata.RE_LATITUDE)),
-                 dms2dd(get_re_keys_filled_value(metadata['exiftool'], GPSByExiftoolMetadata.RE_LONGITUDE))
-                 )
+        exiftool = metadata['exiftool']
+        point = Point(GPSByExiftoolMetadata.get_value(exiftool, GPSByExiftoolMetadata.KEYS_LATITUDE, dms2dd),
+                      GPSByExiftoolMetadata.get_value(exiftool, GPSByExiftoolMetadata.KEYS_LONGITUDE, dms2dd))
 
         return {
             'gps_location': point if point.x and point.y else None,
-            'gps_altitude_m': alt2m(get_re_keys_filled_value(metadata['exiftool'], GPSByExiftoolMetadata.RE_ALTITUDE)),
-            'gps_precision_m': text2m(metadata['exiftool'].get(GPSByExiftoolMetadata.PRECISION)),
+            'gps_altitude_m': GPSByExiftoolMetadata.get_value(exiftool, GPSByExiftoolMetadata.KEYS_ALTITUDE, alt2m),
+            'gps_precision_m': GPSByExiftoolMetadata.get_value(exiftool, GPSByExiftoolMetadata.KEYS_PRECISION, text2m),
         }
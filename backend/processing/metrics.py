@@ -0,0 +1,262 @@
+"""
+Instrumentation of processors: wall time, CPU time and growth of peak memory of each processor call.
+
+Each call is logged with structured fields (`extra` of the log record, see `log`) and added to Prometheus-style
+histograms labelled by pipeline and processor path. Histograms are counters in a shared cache
+(settings.PROCESSING_METRICS_CACHE), so all workers add to the same ones, see `render` for the text format.
+
+A sampled fraction of runs is profiled by cProfile (settings.PROCESSING_PROFILE_RATE), see `Profile`.
+"""
+import hashlib
+import logging
+import os
+import random
+import resource
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'processing_metrics'
+SERIES_KEY = f'{KEY_PREFIX}:series'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (0, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30)
+
+
+class Histogram(namedtuple('Histogram', ['name', 'help', 'field', 'buckets', 'scale'])):
+    """
+    field -- of Measurement, scale -- values are stored as integer counters, e.g. microseconds for seconds
+    """
+
+    def get_bucket(self, value):
+        """
+        Index of the first bucket value fits, buckets are cumulative only once rendered
+
+        >>> WALL_SECONDS.get_bucket(0.3)
+        6
+        >>> WALL_SECONDS.get_bucket(1000)
+        15
+        """
+        return next((num for num, le in enumerate(self.buckets) if value <= le), len(self.buckets))
+
+
+WALL_SECONDS = Histogram('processing_processor_wall_seconds', 'Wall time of processor call',
+                         'wall_seconds', SECONDS_BUCKETS, 10 ** 6)
+CPU_SECONDS = Histogram('processing_processor_cpu_seconds',
+                        'CPU time of the thread calling processor, external tools are not included',
+                        'cpu_seconds', SECONDS_BUCKETS, 10 ** 6)
+MAX_RSS_DELTA_BYTES = Histogram('processing_processor_max_rss_delta_bytes',
+                                'Growth of peak resident memory of the process during processor call',
+                                'max_rss_delta_bytes', BYTES_BUCKETS, 1)
+HISTOGRAMS = (WALL_SECONDS, CPU_SECONDS, MAX_RSS_DELTA_BYTES)
+
+
+class Measurement(namedtuple('Measurement', ['started_at', 'finished_at', 'cpu_seconds', 'max_rss_delta_bytes'])):
+    @property
+    def wall_seconds(self):
+        return self.finished_at - self.started_at
+
+    @property
+    def timing(self):
+        """(started at, finished at), see processing.processor.get_critical_path"""
+        return self.started_at, self.finished_at
+
+
+def get_thread_cpu_seconds():
+    # Python 3.6 has no time.thread_time
+    usage = resource.getrusage(getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF))
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_max_rss_bytes():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Call fn, returns its result and Measurement.
+
+    Peak memory is of the whole process: steps running meanwhile in other threads are counted too,
+    it grows only when the call makes a new peak, e.g. decoding of a huge image.
+    """
+    started_at = time.monotonic()
+    cpu_started = get_thread_cpu_seconds()
+    max_rss_started = get_max_rss_bytes()
+
+    result = fn(*args, **kwargs)
+
+    return result, Measurement(started_at, time.monotonic(), get_thread_cpu_seconds() - cpu_started,
+                               get_max_rss_bytes() - max_rss_started)
+
+
+def log(pipeline, path, measurement):
+    logger.info('%s %s: %.3fs, cpu %.3fs, max rss +%dKB', pipeline, path, measurement.wall_seconds,
+                measurement.cpu_seconds, measurement.max_rss_delta_bytes // 1024,
+                extra={
+                    'pipeline': pipeline,
+                    'processor': path,
+                    'wall_seconds': measurement.wall_seconds,
+                    'cpu_seconds': measurement.cpu_seconds,
+                    'max_rss_delta_bytes': measurement.max_rss_delta_bytes,
+                })
+
+
+def get_cache():
+    from django.conf import settings
+    from django.core.cache import caches
+
+    alias = settings.PROCESSING_METRICS_CACHE
+    return caches[alias] if alias else None
+
+
+def get_key(histogram, pipeline, path, suffix):
+    """
+    Series is hashed: names of pipelines & processors could have spaces (e.g. Concurrent ones) or be long,
+    memcached does not accept such keys
+
+    >>> get_key(WALL_SECONDS, 'fused:1,2', 'Concurrent(a, b)', 'sum')
+    'processing_metrics:processing_processor_wall_seconds:f8e8590a0c8cdfbd771e7f33ef64d391:sum'
+    """
+    series = hashlib.md5(f'{pipeline}:{path}'.encode('utf-8')).hexdigest()
+    return f'{KEY_PREFIX}:{histogram.name}:{series}:{suffix}'
+
+
+def get_counters(pipeline, measurements):
+    """{cache key: increment} for [(path, Measurement), ...] of a run"""
+    counters = {}
+
+    for path, measurement in measurements:
+        for histogram in HISTOGRAMS:
+            value = getattr(measurement, histogram.field)
+
+            for suffix, increment in ((histogram.get_bucket(value), 1),
+                                      ('sum', round(value * histogram.scale)),
+                                      ('count', 1)):
+                key = get_key(histogram, pipeline, path, suffix)
+                counters[key] = counters.get(key, 0) + increment
+
+    return counters
+
+
+def add(cache, key, increment):
+    # Counters never expire
+    if not cache.add(key, increment, timeout=None):
+        cache.incr(key, increment)
+
+
+def record(pipeline, measurements):
+    """Add [(path, Measurement), ...] of a run to histograms, once per run to not slow down processors"""
+    cache = get_cache()
+
+    if cache is None or not measurements:
+        return
+
+    try:
+        series = cache.get(SERIES_KEY) or []
+        missing = [[pipeline, path] for path, measurement in measurements if [pipeline, path] not in series]
+
+        if missing:
+            # Race of two workers could lose a series, it is added back by the next run
+            cache.set(SERIES_KEY, series + missing, timeout=None)
+
+        for key, increment in get_counters(pipeline, measurements).items():
+            add(cache, key, increment)
+    except Exception as ex:
+        # Metrics must not fail processing
+        logger.warning('Could not record metrics of %s: %r', pipeline, ex)
+
+
+def format_labels(**labels):
+    """
+    >>> format_labels(pipeline='fused:1,2', processor='a"b')
+    '{pipeline="fused:1,2",processor="a\\\\"b"}'
+    """
+    escaped = ((k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels.items())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def render():
+    """All histograms in Prometheus text exposition format"""
+    cache = get_cache()
+    series = (cache.get(SERIES_KEY) or []) if cache is not None else []
+    lines = []
+
+    for histogram in HISTOGRAMS:
+        lines.append(f'# HELP {histogram.name} {histogram.help}')
+        lines.append(f'# TYPE {histogram.name} histogram')
+
+        for pipeline, path in series:
+            suffixes = [*range(len(histogram.buckets) + 1), 'sum', 'count']
+            values = cache.get_many([get_key(histogram, pipeline, path, suffix) for suffix in suffixes])
+            values = [values.get(get_key(histogram, pipeline, path, suffix), 0) for suffix in suffixes]
+            *buckets, total, count = values
+
+            cumulative = 0
+
+            for le, value in zip([*histogram.buckets, '+Inf'], buckets):
+                cumulative += value
+                labels = format_labels(pipeline=pipeline, processor=path, le=le)
+                lines.append(f'{histogram.name}_bucket{labels} {cumulative}')
+
+            labels = format_labels(pipeline=pipeline, processor=path)
+            lines.append(f'{histogram.name}_sum{labels} {total / histogram.scale}')
+            lines.append(f'{histogram.name}_count{labels} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def clear():
+    cache = get_cache()
+    series = cache.get(SERIES_KEY) or []
+
+    cache.delete_many([get_key(histogram, pipeline, path, suffix)
+                       for histogram in HISTOGRAMS
+                       for pipeline, path in series
+                       for suffix in [*range(len(histogram.buckets) + 1), 'sum', 'count']])
+    cache.delete(SERIES_KEY)
+
+
+class Profile:
+    """
+    cProfile of a sampled run: `with Profile(pipeline, media_id) as profile: ...` (profile is None if not sampled).
+
+    Profiler sees only the thread it is enabled in, so processors of profiled runs must be called in it.
+    Stats are dumped into settings.PROCESSING_PROFILE_DIR, e.g. for `python -m pstats` or snakeviz.
+    """
+
+    def __init__(self, pipeline, media_id=None):
+        from django.conf import settings
+
+        self.pipeline = pipeline
+        self.media_id = media_id
+        self.profiler = None
+
+        rate = settings.PROCESSING_PROFILE_RATE
+
+        if rate and random.random() < rate:
+            import cProfile
+            self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        if self.profiler is None:
+            return None
+
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        from django.conf import settings
+
+        if self.profiler is None:
+            return
+
+        self.profiler.disable()
+
+        os.makedirs(settings.PROCESSING_PROFILE_DIR, exist_ok=True)
+        path = os.path.join(settings.PROCESSING_PROFILE_DIR,
+                            f'{self.pipeline}-{self.media_id}-{time.strftime("%Y%m%d%H%M%S")}.prof')
+
+        self.profiler.dump_stats(path)
+        logger.info('%s: profile of Media.id=%s is %s', self.pipeline, self.media_id, path)
@@ -4,17 +4,39 @@ from processing.processor import DataProcessor
 
 
 PROCESSORS = (
-    # TODO: Implement
+    'processing.media_processors.get_media_by_id',
+
+    'processing.play_media.image.RenditionsByContentDegree',
+    'processing.play_media.image.RenditionsByExiftoolMetadataEmbedContentDegree',
+
+    'processing.play_media.video.RenditionsByScreenShotDegree',
+
+    'processing.media_processors.save_media',
 )
 
 
 def run(media_id=None):
+    from processing.play_media.transcode import delay_transcode_many
+
     logger = logging.getLogger(__name__)
     logger.info('generate play media for Media.id=%s', media_id)
     result = DataProcessor(PROCESSORS, logger=logger).run(media_id=media_id)
+    # Videos are playable as is (if browser supports them) until transcoded
+    delay_transcode_many(media_ids=[media_id])
     # TODO: Mark media as ready for "play"
     """Optimize media for web, e.g. transcode video (multiple codecs) and pack images, find good screenshot"""
     """Extract screenshot of the video"""
     # See http://superuser.com/questions/538112/meaningful-thumbnails-for-a-video-using-ffmpeg
-    # TODO: Implement generating content, optimized for viewing in browser, e.g. max 2880 x 1800, jpeg / mp4
     # TODO: Consider generating "original rotated" media, identical with quality but ready for usage
+    return result
+
+
+def run_many(media_ids=None):
+    from processing.play_media.transcode import delay_transcode_many
+
+    logger = logging.getLogger(__name__)
+    logger.info('generate play media for Media.id in %s', media_ids)
+    results = DataProcessor(PROCESSORS, logger=logger).run_many(media_ids=media_ids)
+    delay_transcode_many(media_ids=[media_id for media_id, result in results.items()
+                                    if not isinstance(result, Exception)])
+    return results
@@ -0,0 +1,53 @@
+import logging
+
+from processing.media_processors import is_image, is_raw_image
+from processing.processor import processor
+
+logger = logging.getLogger(__name__)
+
+
+@processor(writes=('renditions',), guard=is_image)
+def RenditionsByContentDegree(media_id=None, uploader_id=None, metadata=None, content=None, needed_rotate_degree=None):
+    from django.conf import settings
+    from processing.play_media.rendition import Rendition
+
+    if is_raw_image(metadata):
+        # Decoding of RAW is expensive (if supported at all) -- use embed preview instead, see the next processor
+        return 'renditions', None
+
+    try:
+        renditions = Rendition.generate_from_path(content.path, sizes=settings.RENDITION_SIZES,
+                                                  needed_rotate_degree=needed_rotate_degree)
+    except Rendition.SourceImageError:
+        return 'renditions', None
+
+    return 'renditions', Rendition.store(uploader_id=uploader_id, media_id=media_id, renditions=renditions)
+
+
+@processor(writes=('renditions',), guard=is_image)
+def RenditionsByExiftoolMetadataEmbedContentDegree(media_id=None, uploader_id=None, renditions=None, metadata=None,
+                                                   content=None, needed_rotate_degree=None):
+    from django.conf import settings
+    from storage.tools.exiftool import extract_any_embed_image
+    from processing.play_media.rendition import Rendition
+
+    if renditions is not None:
+        return
+
+    if not metadata.get('exiftool'):
+        return 'renditions', []
+
+    max_size = max(settings.RENDITION_SIZES)
+
+    try:
+        # Use the smallest image which is enough for the biggest rendition, e.g. PreviewImage, not JpgFromRaw
+        embed_image = extract_any_embed_image(metadata['exiftool'], content.path, min_size=(max_size, max_size))
+    except ValueError as ex:
+        # Content is shown as is
+        logger.info(f'Media.id={media_id}: no renditions: {ex}')
+        return 'renditions', []
+
+    renditions = Rendition.generate_from_fp(embed_image, sizes=settings.RENDITION_SIZES,
+                                            needed_rotate_degree=needed_rotate_degree)
+
+    return 'renditions', Rendition.store(uploader_id=uploader_id, media_id=media_id, renditions=renditions)
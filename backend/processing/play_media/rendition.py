@@ -0,0 +1,119 @@
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from storage.tools.image_formats import encode_alternatives, save_with_alternatives
+
+
+class Rendition:
+    """Image of limited size, optimized for viewing in browser"""
+    RESAMPLE = Image.LANCZOS
+    SETTINGS = {
+        'format': 'JPEG',
+        'quality': 85,
+        'progressive': True,
+        'optimize': True,
+    }
+    MIMETYPE = 'image/jpeg'
+    EXTENSION = 'jpg'
+
+    class SourceImageError(ValueError):
+        pass
+
+    @staticmethod
+    def get_size(size, max_side):
+        """
+        Size to fit into max_side x max_side with the same aspect ratio, None if image is already smaller
+
+        >>> Rendition.get_size((6000, 4000), 1440)
+        (1440, 960)
+        >>> Rendition.get_size((3000, 4000), 1440)
+        (1080, 1440)
+        >>> Rendition.get_size((1000, 800), 1440)
+        """
+        scale = max_side / max(size)
+
+        if scale >= 1:
+            return None
+
+        return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    @staticmethod
+    def generate_from_path(path=None, sizes=None, needed_rotate_degree=None):
+        with open(path, 'rb') as f:
+            return Rendition.generate_from_fp(f, sizes=sizes, needed_rotate_degree=needed_rotate_degree)
+
+    @staticmethod
+    def generate_from_fp(f, sizes=None, needed_rotate_degree=None):
+        """
+        Decode image once and resample it to each of sizes (max of width and height), not bigger than the image.
+
+        The biggest rendition is resampled from the decoded image, every next one -- from the previous rendition.
+        Returns [(size, file, width, height), ...] from the biggest to the smallest.
+        """
+        from processing.quick_thumbnail.thumbnail import Thumbnail
+
+        try:
+            image = Image.open(f)
+        except OSError as ex:
+            raise Rendition.SourceImageError(*ex.args)
+
+        renditions = []
+
+        try:
+            # Do not upscale
+            sizes = sorted((size for size in sizes if Rendition.get_size(image.size, size)), reverse=True)
+
+            if not sizes:
+                return renditions
+
+            # Decode at the lowest resolution that keeps quality of the biggest rendition
+            max_side = sizes[0] * Thumbnail.REDUCING_GAP
+            rendition = Thumbnail.reduce(image, min_size=(max_side, max_side))
+
+            if rendition.mode not in ('RGB', 'L'):
+                rendition = rendition.convert('RGB')
+
+            for size in sizes:
+                rendition = rendition.resize(Rendition.get_size(rendition.size, size) or rendition.size,
+                                             Rendition.RESAMPLE)
+
+                if needed_rotate_degree and not renditions:
+                    # Rotate the biggest rendition, others are resampled from it
+                    # PIL rotate rotates counter clockwise => invert it
+                    rendition = rendition.rotate(-needed_rotate_degree, expand=True)
+
+                target = SimpleUploadedFile(name=f'{size}.{Rendition.EXTENSION}', content=b'',
+                                            content_type=Rendition.MIMETYPE)
+                rendition.save(target, **Rendition.SETTINGS)
+                target.seek(0)
+                # Smaller formats, stored next to JPEG, see Rendition.store
+                target.alternatives = encode_alternatives(rendition)
+
+                renditions.append((size, target, rendition.size[0], rendition.size[1]))
+        finally:
+            image.close()
+
+        return renditions
+
+    @staticmethod
+    def store(uploader_id=None, media_id=None, renditions=None):
+        """Save generated renditions into storage, returns value of Media.renditions"""
+        from django.core.files.storage import default_storage
+        from storage.models import Media
+
+        result = []
+
+        for size, rendition_file, width, height in renditions:
+            name = Media.generate_rendition_filename(uploader_id=uploader_id, media_id=media_id, size=size,
+                                                     extension=Rendition.EXTENSION)
+            result.append({
+                'size': size,
+                'width': width,
+                'height': height,
+                'mimetype': Rendition.MIMETYPE,
+                # Overwrite rendition of the previous processing, name is the same
+                'name': save_with_alternatives(default_storage, name, rendition_file, rendition_file.alternatives),
+            })
+
+        # From the smallest to the biggest, like sizes in `srcset`
+        return result[::-1]
@@ -0,0 +1,335 @@
+"""
+Video renditions: MP4 (H.264 + AAC) which every browser plays, with moov atom at the start to play while loading.
+
+Long videos are also cut into HLS segments (see storage.tools.hls), so seeking loads only the needed ones.
+
+Transcoding is long and CPU-bound, so it is not a processor of play_media state, but a task of its own queue
+(see ProcessingState.QUEUE_TRANSCODE), queued once play_media state is done.
+"""
+import logging
+import os
+import shutil
+
+from processing.media_processors import is_video
+from storage.tools import hls
+
+logger = logging.getLogger(__name__)
+
+
+class VideoRendition:
+    MIMETYPE = 'video/mp4'
+    EXTENSION = 'mp4'
+
+    # Source streams that browsers decode as is -- the top rung is remuxed without re-encoding
+    WEB_VIDEO_CODECS = {'h264'}
+    WEB_VIDEO_PROFILES = {'Constrained Baseline', 'Baseline', 'Main', 'High'}
+    WEB_PIXEL_FORMATS = {'yuv420p', 'yuvj420p'}
+    WEB_AUDIO_CODECS = {'aac', 'mp3'}
+
+    # Keyframes at the same times in all rungs: HLS segments are aligned, player switches between them seamlessly
+    VIDEO_OPTIONS = ('-c:v', 'libx264', '-preset', 'medium', '-crf', 23, '-profile:v', 'high', '-pix_fmt', 'yuv420p',
+                     '-force_key_frames', f'expr:gte(t,n_forced*{hls.SEGMENT_SECONDS})')
+    VIDEO_COPY_OPTIONS = ('-c:v', 'copy')
+    AUDIO_OPTIONS = ('-c:a', 'aac', '-b:a', '128k')
+    AUDIO_COPY_OPTIONS = ('-c:a', 'copy')
+    CONTAINER_OPTIONS = ('-movflags', '+faststart', '-f', 'mp4')
+
+    # Shorter side is `size`, the other one keeps aspect ratio and is even (required by yuv420p).
+    # Rotation is applied by ffmpeg before filters, so it works for portrait videos too.
+    SCALE_FILTER = "scale=w='if(gt(iw,ih),-2,{size})':h='if(gt(iw,ih),{size},-2)'"
+
+    @staticmethod
+    def get_audio_stream(streams=None):
+        return next((stream for stream in streams if stream['codec_type'] == 'audio'), None)
+
+    @staticmethod
+    def is_web_video(stream):
+        return (stream.get('codec_name') in VideoRendition.WEB_VIDEO_CODECS
+                and stream.get('profile') in VideoRendition.WEB_VIDEO_PROFILES
+                and stream.get('pix_fmt') in VideoRendition.WEB_PIXEL_FORMATS)
+
+    @staticmethod
+    def is_web_audio(stream):
+        return stream.get('codec_name') in VideoRendition.WEB_AUDIO_CODECS
+
+    @staticmethod
+    def get_size(width, height, size):
+        """
+        Video size with shorter side equal to `size`
+
+        >>> VideoRendition.get_size(1920, 1080, 720)
+        (1280, 720)
+        >>> VideoRendition.get_size(1080, 1920, 360)
+        (360, 640)
+        """
+        if width > height:
+            return round(width * size / height / 2) * 2, size
+        return size, round(height * size / width / 2) * 2
+
+    @staticmethod
+    def plan(width=None, height=None, video_stream=None, sizes=None):
+        """
+        Rungs of the ladder: [(size, remux), ...] from the smallest, sizes are of the shorter side.
+
+        Source is never upscaled. If it is not bigger than the top of the ladder, it becomes the top rung:
+        as is (remux) if browsers play it, transcoded otherwise. Bigger source is transcoded down to the ladder.
+        Transcoded sizes are even (required by yuv420p).
+
+        >>> VideoRendition.plan(1920, 1080, {'codec_name': 'hevc'}, (360, 720, 1080))
+        [(360, False), (720, False), (1080, False)]
+        >>> VideoRendition.plan(3840, 2160, {'codec_name': 'hevc'}, (360, 720, 1080))
+        [(360, False), (720, False), (1080, False)]
+        >>> VideoRendition.plan(1280, 720, {'codec_name': 'h264', 'profile': 'High', 'pix_fmt': 'yuv420p'}, (360, 720))
+        [(360, False), (720, True)]
+        >>> VideoRendition.plan(3840, 2160, {'codec_name': 'h264', 'profile': 'High', 'pix_fmt': 'yuv420p'}, (360, 720))
+        [(360, False), (720, False)]
+        >>> VideoRendition.plan(641, 479, {'codec_name': 'hevc'}, (360, 720))
+        [(360, False), (478, False)]
+        """
+        source_size = min(width, height)
+        fits = source_size <= max(sizes)
+        remux = fits and VideoRendition.is_web_video(video_stream)
+
+        transcoded = {size - size % 2 for size in sizes if size < source_size}
+
+        if fits and not remux:
+            transcoded.add(source_size - source_size % 2)
+
+        rungs = [(size, False) for size in sorted(transcoded)]
+
+        if remux:
+            rungs.append((source_size, True))
+
+        return rungs
+
+    @staticmethod
+    def get_ffmpeg_args(rungs=None, paths=None, audio_stream=None):
+        """
+        Filter graph and outputs for storage.tools.ffmpeg.transcode: the source is decoded once,
+        split and scaled to each transcoded rung.
+        """
+        scaled = [size for size, remux in rungs if not remux]
+
+        filters = []
+
+        if scaled:
+            filters.append(f'[0:v:0]split={len(scaled)}' + ''.join(f'[s{size}]' for size in scaled))
+            filters += [f'[s{size}]{VideoRendition.SCALE_FILTER.format(size=size)}[v{size}]' for size in scaled]
+
+        if audio_stream is None:
+            audio_options = ()
+        elif VideoRendition.is_web_audio(audio_stream):
+            audio_options = ('-map', '0:a:0', *VideoRendition.AUDIO_COPY_OPTIONS)
+        else:
+            audio_options = ('-map', '0:a:0', *VideoRendition.AUDIO_OPTIONS)
+
+        outputs = []
+
+        for (size, remux), path in zip(rungs, paths):
+            if remux:
+                video_options = ('-map', '0:v:0', *VideoRendition.VIDEO_COPY_OPTIONS)
+            else:
+                video_options = ('-map', f'[v{size}]', *VideoRendition.VIDEO_OPTIONS)
+
+            outputs.append((path, (*video_options, *audio_options, *VideoRendition.CONTAINER_OPTIONS)))
+
+        return ';'.join(filters) or None, outputs
+
+    @staticmethod
+    def generate(media):
+        """Transcode media.content into the ladder, returns [(rung, name, temporary path), ...]"""
+        from django.conf import settings
+        from django.core.files.storage import default_storage
+        from processing.base_metadata.video import get_get_video_stream
+        from storage.models import Media
+        from storage.tools.ffmpeg import transcode
+        from storage.tools.host_semaphore import HostSemaphore
+
+        # ffprobe result of base_metadata state, not probed again
+        streams = media.metadata['ffprobe']['streams']
+        video_stream = get_get_video_stream(streams=streams)
+        rungs = VideoRendition.plan(width=video_stream['width'], height=video_stream['height'],
+                                    video_stream=video_stream, sizes=settings.VIDEO_RENDITION_SIZES)
+
+        if not rungs:
+            return []
+
+        names = [Media.generate_rendition_filename(uploader_id=media.uploader_id, media_id=media.id, size=size,
+                                                   extension=VideoRendition.EXTENSION)
+                 for size, remux in rungs]
+        # Written next to target, then replace it -- previous version is served until new one is ready
+        paths = [f'{default_storage.path(name)}.part' for name in names]
+
+        for path in paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        filter_complex, outputs = VideoRendition.get_ffmpeg_args(
+            rungs=rungs, paths=paths, audio_stream=VideoRendition.get_audio_stream(streams=streams))
+
+        logger.info(f'transcode Media.id={media.id} into {rungs}')
+
+        try:
+            # ffmpeg uses all cores by itself, do not let workers of the host to overcommit them
+            with HostSemaphore('transcode', size=settings.TRANSCODE_CONCURRENCY):
+                transcode(media.content.path, outputs, filter_complex=filter_complex, hide_log=True)
+        except Exception:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        return list(zip(rungs, names, paths))
+
+    @staticmethod
+    def store(width=None, height=None, results=None):
+        """Move transcoded files into their places, returns entries of Media.renditions"""
+        from django.core.files.storage import default_storage
+
+        renditions = []
+
+        for (size, remux), name, path in results:
+            os.replace(path, default_storage.path(name))
+
+            rendition_width, rendition_height = (width, height) if remux else VideoRendition.get_size(width, height,
+                                                                                                      size)
+            renditions.append({
+                'size': size,
+                'width': rendition_width,
+                'height': rendition_height,
+                'mimetype': VideoRendition.MIMETYPE,
+                'name': name,
+                'remux': remux,
+            })
+
+        return renditions
+
+    @staticmethod
+    def segment(uploader_id=None, media_id=None, duration=None, renditions=None):
+        """
+        Cut stored renditions into HLS segments without re-encoding, returns entry of Media.renditions for
+        the master playlist. Directory is replaced as a whole, so playlists never point to segments of another run.
+
+        Renditions must be transcoded ones (not remuxed): only their keyframes are forced at segment boundaries.
+        """
+        from django.core.files.storage import default_storage
+        from storage.models import Media
+        from storage.tools.ffmpeg import transcode
+
+        dirname = Media.generate_hls_dirname(uploader_id=uploader_id, media_id=media_id)
+        directory = default_storage.path(dirname)
+        tmp_directory = f'{directory}.part'
+
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        segment_type = hls.get_segment_type()
+        variants = []
+
+        try:
+            for rendition in renditions:
+                playlist_name = hls.get_media_playlist_name(rendition['size'])
+                transcode(default_storage.path(rendition['name']),
+                          [(os.path.join(tmp_directory, playlist_name),
+                            hls.get_segment_options(tmp_directory, rendition['size'], segment_type))],
+                          hide_log=True)
+                # Average bitrate, peak one is not known without parsing of segments
+                bandwidth = round(default_storage.size(rendition['name']) * 8 / duration.total_seconds())
+                variants.append((playlist_name, bandwidth, rendition['width'], rendition['height']))
+
+            with open(os.path.join(tmp_directory, hls.MASTER_PLAYLIST_NAME), 'w') as f:
+                f.write(hls.render_master_playlist(variants, version=hls.VERSIONS[segment_type]))
+        except Exception:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_directory, directory)
+
+        top = renditions[-1]
+
+        return {
+            'size': top['size'],
+            'width': top['width'],
+            'height': top['height'],
+            'mimetype': hls.MIMETYPE,
+            'name': f'{dirname}/{hls.MASTER_PLAYLIST_NAME}',
+        }
+
+    @staticmethod
+    def save(media_id=None, renditions=None):
+        """Add renditions to Media.renditions, replacing previous videos & playlists"""
+        from django.db import transaction
+        from storage.models import Media
+
+        with transaction.atomic():
+            # Renditions of the poster could be updated meanwhile by play_media state
+            media = Media.objects.select_for_update().only('id', 'uploader_id', 'renditions').get(id=media_id)
+            media.renditions = [rendition for rendition in media.renditions
+                                if rendition['mimetype'] not in (VideoRendition.MIMETYPE, hls.MIMETYPE)] + renditions
+            media.save(update_fields=['renditions'])
+
+        return renditions
+
+
+def is_segmented(duration=None):
+    """Whether video is long enough to be played by HLS"""
+    from django.conf import settings
+
+    min_seconds = settings.HLS_MIN_DURATION_SECONDS
+
+    return min_seconds is not None and duration is not None and duration.total_seconds() >= min_seconds
+
+
+def transcode_media(media_id=None):
+    from django.core.files.storage import default_storage
+    from storage.models import Media
+
+    media = Media.objects.filter(id=media_id).only('id', 'uploader_id', 'media_type', 'content', 'metadata',
+                                                   'width', 'height', 'duration').get()
+
+    if not is_video(media.media_type):
+        return []
+
+    results = VideoRendition.generate(media)
+
+    # Media.width & height are of the rotated video, like ffmpeg's output
+    renditions = VideoRendition.store(width=media.width, height=media.height, results=results)
+
+    # Remuxed rung keeps keyframes of the source, its segments would not be aligned with others
+    segmented = [rendition for rendition in renditions if not rendition['remux']]
+    playlist = None
+    error = None
+
+    if segmented and is_segmented(media.duration):
+        try:
+            playlist = VideoRendition.segment(uploader_id=media.uploader_id, media_id=media.id,
+                                              duration=media.duration, renditions=segmented)
+        except Exception as ex:
+            logger.exception(f'segment Media.id={media.id} failed')
+            error = ex
+
+    if playlist is None:
+        # Short video, HLS is disabled or failed
+        shutil.rmtree(default_storage.path(Media.generate_hls_dirname(uploader_id=media.uploader_id, media_id=media.id)),
+                      ignore_errors=True)
+    else:
+        renditions.append(playlist)
+
+    # MP4 files are already in place, they are recorded and played without HLS even if segmenting failed
+    renditions = VideoRendition.save(media_id=media.id, renditions=renditions)
+
+    if error is not None:
+        # The task fails, so missing HLS is seen among failed tasks, not only in the log
+        raise error
+
+    return renditions
+
+
+def delay_transcode_many(media_ids=None):
+    """Queue transcoding of videos among given media"""
+    from processing import tasks
+    from processing.states import ProcessingState
+    from storage.models import Media
+
+    for media_id in Media.objects.filter(id__in=media_ids, media_type=Media.MEDIA_VIDEO).values_list('id', flat=True):
+        tasks.transcode_video.apply_async((media_id,), queue=ProcessingState.QUEUE_TRANSCODE)
@@ -0,0 +1,19 @@
+from processing.media_processors import is_video
+from processing.processor import processor
+
+
+@processor(writes=('renditions',), guard=is_video)
+def RenditionsByScreenShotDegree(media_id=None, uploader_id=None, screenshot=None,
+                                 needed_rotate_degree=None, renditions=None):
+    """Renditions of the poster, transcoded videos (see processing.play_media.transcode) are kept"""
+    from django.conf import settings
+    from processing.play_media.rendition import Rendition
+
+    if not screenshot:
+        return
+
+    videos = [rendition for rendition in renditions or () if rendition['mimetype'] != Rendition.MIMETYPE]
+    posters = Rendition.generate_from_path(screenshot.path, sizes=settings.RENDITION_SIZES,
+                                           needed_rotate_degree=needed_rotate_degree)
+
+    return 'renditions', Rendition.store(uploader_id=uploader_id, media_id=media_id, renditions=posters) + videos
@@ -1,65 +1,585 @@
+import functools
 import inspect
+import os
 import pydoc
+import threading
+import time
 import types
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+# Single processor of a compiled pipeline: input argument names, callable, dotted path (name),
+# names of values it writes, guard (see `processor`) and its argument names
+Step = namedtuple('Step', ['args', 'fn', 'path', 'writes', 'guard', 'guard_args'])
+
+
+class Pipeline(namedtuple('Pipeline', ['steps', 'args'])):
+    """Compiled processors: resolved callables with their arguments and union of all arguments"""
+
+    def report(self):
+        """Fields each step reads and writes (as declared by `processor`), steps it waits for"""
+        dependencies = get_dependencies(self.steps)
+
+        return [
+            {
+                'path': step.path,
+                'reads': sorted(step.args | step.guard_args),
+                'writes': sorted(step.writes),
+                'after': [self.steps[i].path for i in sorted(dependencies[num])],
+            }
+            for num, step in enumerate(self.steps)
+        ]
+
+    def format_report(self):
+        return '\n'.join(
+            '{path}\n    reads: {reads}\n    writes: {writes}\n    after: {after}'.format(
+                path=item['path'],
+                reads=', '.join(item['reads']) or '-',
+                writes=', '.join(item['writes']) or '-',
+                after=', '.join(item['after']) or '-',
+            )
+            for item in self.report()
+        )
+
+
+def processor(writes=None, guard=None, skip_unchanged=False):
+    """
+    Declare how the scheduler (see DataProcessor.run_steps) treats the processor.
+
+    writes -- names of values it returns, required: steps are ordered by them (see get_dependencies).
+        DataProcessor.ALL_ARGUMENTS -- any value, e.g. loaded fields, so the processor is a barrier
+    guard -- predicate of processor arguments, e.g. `is_video`: processor is not called while it is false
+    skip_unchanged -- all results are Media fields, computed only from arguments: processor is not called
+        if its arguments are the same as loaded ones and results are loaded (filled) too, e.g. on reprocessing
+    """
+    def decorator(fn):
+        fn.writes = frozenset(writes) if writes is not None else None
+        fn.guard = guard
+        fn.skip_unchanged = skip_unchanged
+        return fn
+
+    return decorator
+
+
+class CycleError(ValueError):
+    pass
+
+
+class UndeclaredWritesError(ValueError):
+    pass
+
+
+def is_barrier(step):
+    """Step that needs all previous values (e.g. saves media) or writes any ones, so others can't pass it"""
+    return (step.args is DataProcessor.ALL_ARGUMENTS or 'ARGS' in step.args
+            or DataProcessor.ALL_ARGUMENTS <= step.writes)
+
+
+@functools.lru_cache(maxsize=None)
+def get_dependencies(steps):
+    """
+    Indexes of steps each step waits for, so results are the same as if they were run one by one in order:
+    step goes after the last writers of values it reads and after previous readers & writers of values it writes.
+    Barrier goes after all previous steps, all next ones go after it.
+    """
+    undeclared = [step.path for step in steps if step.writes is None]
+
+    if undeclared:
+        raise UndeclaredWritesError(f'Processors must declare values they write by @processor(writes=...): '
+                                    f'{undeclared}')
+
+    dependencies = []
+    last_writers = {}
+    # Steps that read value since its last writer
+    readers = {}
+    last_barrier = None
+    since_barrier = set()
+
+    for num, step in enumerate(steps):
+        after = {last_barrier} if last_barrier is not None else set()
+
+        if is_barrier(step):
+            dependencies.append(after | since_barrier)
+            last_barrier, since_barrier, last_writers, readers = num, set(), {}, {}
+            continue
+
+        for arg in step.args | step.guard_args:
+            if arg in last_writers:
+                after.add(last_writers[arg])
+
+        for name in step.writes:
+            if name in last_writers:
+                after.add(last_writers[name])
+            after.update(readers.get(name, ()))
+
+        after.discard(num)
+        dependencies.append(after)
+
+        for arg in step.args | step.guard_args:
+            readers.setdefault(arg, set()).add(num)
+
+        for name in step.writes:
+            last_writers[name] = num
+            readers[name] = set()
+
+        since_barrier.add(num)
+
+    check_cycles(steps, dependencies)
+    return dependencies
+
+
+def check_cycles(steps, dependencies):
+    """Fail fast if steps could not be ordered (Kahn's algorithm)"""
+    waiting = {num: set(after) for num, after in enumerate(dependencies)}
+
+    while waiting:
+        ready = {num for num, after in waiting.items() if not after}
+
+        if not ready:
+            raise CycleError(f'Processors depend on each other: {[steps[num].path for num in sorted(waiting)]}')
+
+        for num in ready:
+            del waiting[num]
+
+        for after in waiting.values():
+            after -= ready
+
+
+def get_critical_path(steps, dependencies, timings):
+    """
+    The longest chain of dependent steps by their duration, it is the duration of the whole run.
+
+    timings -- {step index: (started at, finished at)} => [(path, seconds), ...], total seconds
+    """
+    finished_in = {}
+    previous = {}
+
+    for num in range(len(steps)):
+        started_at, finished_at = timings.get(num, (0, 0))
+        before = max(dependencies[num], key=lambda i: finished_in[i], default=None)
+        finished_in[num] = (finished_in[before] if before is not None else 0) + finished_at - started_at
+        previous[num] = before
+
+    num = max(finished_in, key=finished_in.get, default=None)
+    total = finished_in.get(num, 0)
+    path = []
+
+    while num is not None:
+        started_at, finished_at = timings.get(num, (0, 0))
+        path.append((steps[num].path, finished_at - started_at))
+        num = previous[num]
+
+    return path[::-1], total
+
+
+class Concurrent(namedtuple('Concurrent', ['processors', 'timeout'])):
+    """
+    Independent processors that are run concurrently as a single step, e.g. extractors calling external tools
+    for the same file: the step takes as long as the slowest of them.
+
+    Concurrency is thread-based: processors are run by threads of get_pool(). They must not read values written
+    by each other. Values written by several of them must be dicts, they are merged, e.g. `metadata` extended
+    by each extractor. Once any of them failed or `timeout` seconds passed, the step fails.
+
+    Timeout only stops waiting: threads could not be stopped, so processors that are still running are not
+    interrupted and child processes they started are not killed. External tools are limited by their own
+    timeouts (see storage.tools.pipe.run, settings.EXIFTOOL_TIMEOUT_SECONDS).
+    """
+    def __new__(cls, *processors, timeout=None):
+        return super().__new__(cls, tuple(processors), timeout)
+
+    @property
+    def name(self):
+        return f'Concurrent({", ".join(DataProcessor.get_name(path) for path in self.processors)})'
+
+
+class ConcurrentStep:
+    """Compiled Concurrent processors, called as a single processor by DataProcessor"""
+
+    def __init__(self, steps, timeout=None):
+        self.steps = steps
+        self.timeout = timeout
+
+    def __call__(self, **data):
+        steps = [step for step in self.steps if not DataProcessor.is_guarded(step, data)]
+        pool = get_pool()
+        futures = [pool.submit(call_processor_in_thread, step.fn, DataProcessor.get_input(step, data))
+                   for step in steps]
+
+        if not futures:
+            return None
+
+        done, pending = wait(futures, timeout=self.timeout, return_when=FIRST_EXCEPTION)
+
+        # Only ones that are not started yet could be cancelled, see Concurrent
+        for future in pending:
+            future.cancel()
+
+        for future in futures:
+            if future in done and future.exception():
+                raise future.exception()
+
+        if pending:
+            raise TimeoutError(f'Not finished in {self.timeout} seconds: '
+                               f'{[step.path for future, step in zip(futures, steps) if future in pending]}')
+
+        merged = {}
+
+        for future in futures:
+            results, measurement = future.result()
+
+            for key, value in (get_processor_results(results) or {}).items():
+                merged[key] = {**merged[key], **value} if key in merged else value
+
+        return merged
+
+
+def call_processor(fn, input_data):
+    results = fn(**input_data)
+
+    if isinstance(results, types.GeneratorType):
+        # iterate over each "yield" -> run all code to catch all exceptions
+        return dict(results)
+    return results
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Threads running processors (see DataProcessor.run_steps), shared by all runs of the process.
+    Pool is re-created after fork, e.g. in Celery workers -- threads are not inherited by child processes.
+    """
+    from django.conf import settings
+
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.PROCESSING_THREADS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def call_processor_in_thread(fn, input_data):
+    """Returns results and processing.metrics.Measurement"""
+    from django.db import connections
+    from processing.metrics import measure
+
+    try:
+        return measure(call_processor, fn, input_data)
+    finally:
+        # Django closes connections of requests & tasks only, not ones of pool threads -- do not leave them open
+        connections.close_all()
+
+
+def get_processor_results(results):
+    """Processor returns None, (k, v) or {k: v, ...} => None or dict"""
+    if not results:
+        return None
+    elif not isinstance(results, dict):
+        return {results[0]: results[1]}
+    return results
 
 
 class DataProcessor:
     PROCESSORS_DATA = ()
     ARGS = ()
-    ALL_ARGUMENTS = {'ALL'}
+    ALL_ARGUMENTS = frozenset({'ALL'})
     INITIAL_STATE_ARG = 'INITIAL_STATE'
     logger = None
+    # Path of processor that raised an exception
+    failed_path = None
+    # Paths of processors that raised an exception, by media id (see run_many)
+    failed_paths = None
+    # [(path, seconds), ...] of the last run, see get_critical_path
+    critical_path = None
+    # Label of metrics (see processing.metrics), e.g. name of the state
+    name = None
+
+    # Compiled pipelines by processors, shared by all runs in the process
+    PIPELINES = {}
 
-    def __init__(self, processors, logger=None):
+    def __init__(self, processors, logger=None, name=None):
         self.logger = logger
-        # TODO: Maybe initialize once on application startup
+        self.name = name or (logger.name if logger else None)
 
-        processors_fns = [(pydoc.locate(path), path) for path in processors]
+        pipeline = self.compile(processors)
+
+        self.PROCESSORS_DATA = pipeline.steps
+        self.ARGS = pipeline.args
+
+    @classmethod
+    def compile(cls, processors):
+        """Resolve processors once, e.g. on application startup. Processors must be hashable."""
+        processors = tuple(processors)
+
+        try:
+            return cls.PIPELINES[processors]
+        except KeyError:
+            pass
+
+        # Processor is a dotted path or, for generated ones, a callable
+        processors_fns = [(pydoc.locate(path) if isinstance(path, str) else path, cls.get_name(path))
+                          for path in processors if not isinstance(path, Concurrent)]
 
         missing_processors = [path for fn, path in processors_fns if not fn]
         assert not missing_processors, 'Some processors are missing: %r' % (missing_processors)
 
-        processors_args = ((inspect.getfullargspec(fn), fn, path) for fn, path in processors_fns)
+        steps = tuple(cls.compile_step(path) for path in processors)
+
+        # Fail fast, before any run
+        get_dependencies(steps)
+
+        pipeline = Pipeline(steps=steps, args=frozenset(
+            arg
+            for step in steps
+            # Results of skip_unchanged steps are loaded to be compared
+            for arg in step.args | step.guard_args | (step.writes if getattr(step.fn, 'skip_unchanged', False) else set())
+        ))
+        cls.PIPELINES[processors] = pipeline
+        return pipeline
+
+    @classmethod
+    def compile_step(cls, processor):
+        if isinstance(processor, Concurrent):
+            sub_steps = cls.compile(processor.processors).steps
+            args = frozenset(arg for step in sub_steps for arg in step.args | step.guard_args)
+            fn = ConcurrentStep(sub_steps, timeout=processor.timeout)
+            return Step(cls.ALL_ARGUMENTS if cls.ALL_ARGUMENTS <= args else args, fn, processor.name,
+                        frozenset().union(*(step.writes for step in sub_steps)), None, frozenset())
+
+        fn = pydoc.locate(processor) if isinstance(processor, str) else processor
+        args = inspect.getfullargspec(fn)
 
-        self.PROCESSORS_DATA = [
-            (((set(args.args) - {'self', 'cls'}) if not args.varkw else self.ALL_ARGUMENTS), fn, path)
-            for args, fn, path in processors_args
-            ]
+        writes = getattr(fn, 'writes', None)
+        guard = getattr(fn, 'guard', None)
 
-        self.ARGS = {arg for args, fn, path in self.PROCESSORS_DATA for arg in args}
+        return Step(frozenset(set(args.args) - {'self', 'cls'}) if not args.varkw else cls.ALL_ARGUMENTS,
+                    fn, cls.get_name(processor), writes,
+                    guard, frozenset(inspect.getfullargspec(guard).args) if guard else frozenset())
+
+    @staticmethod
+    def get_name(processor):
+        if isinstance(processor, Concurrent):
+            return processor.name
+        return processor if isinstance(processor, str) else processor.__qualname__
 
     def run(self, **kwargs):
-        data = {**kwargs, 'ARGS': self.ARGS}
+        from processing.metrics import Profile
 
-        results = ()
+        data = {**kwargs, 'ARGS': self.ARGS}
 
         self.logger.info('INPUT: %r', kwargs)
 
-        for args, fn, path in self.PROCESSORS_DATA:
-            input_data = data if args is self.ALL_ARGUMENTS else {k: data[k] for k in args}
-            try:
-                results = fn(**input_data)
+        with Profile(self.name, kwargs.get('media_id')) as profile:
+            return self.run_steps(self.PROCESSORS_DATA, data, inline=profile is not None)
+
+    @classmethod
+    def get_input(cls, step, data):
+        return data if step.args is cls.ALL_ARGUMENTS else {k: data[k] for k in step.args}
+
+    @staticmethod
+    def is_guarded(step, data):
+        """Guard of processor excludes it, e.g. video processor for an image"""
+        return bool(step.guard) and not step.guard(**{k: data[k] for k in step.guard_args})
+
+    @classmethod
+    def is_unchanged(cls, step, data):
+        """Arguments of skip_unchanged processor are the same as loaded ones, so its loaded results are still valid"""
+        initial_state = data.get(cls.INITIAL_STATE_ARG)
+
+        if not getattr(step.fn, 'skip_unchanged', False) or initial_state is None:
+            return False
+
+        return (all(k in initial_state and initial_state[k] == data[k] for k in step.args)
+                and all(initial_state.get(k) is not None for k in step.writes))
+
+    @staticmethod
+    def is_inline(step):
+        """
+        Step that is run in the current thread: barriers (e.g. load & save) and Concurrent ones,
+        which wait for threads of the pool and must not hold one of them meanwhile
+        """
+        return is_barrier(step) or isinstance(step.fn, ConcurrentStep)
+
+    def run_steps(self, steps, data, inline=False):
+        """
+        Run each step once steps it depends on are done (see get_dependencies), independent ones in threads.
+        Results are the same as if steps were run one by one, returns results of the last one.
+
+        inline -- run all steps in the current thread, e.g. to be seen by profiler
+        """
+        from processing import metrics
+
+        steps = tuple(steps)
+        dependencies = get_dependencies(steps)
+        waiting = set(range(len(steps)))
+        done = set()
+        running = {}
+        # {step index: (started at, finished at)}, for critical path
+        timings = {}
+        # [(path, Measurement), ...] of called steps
+        measurements = []
+        last_results = None
+
+        def finish(num, results, measurement):
+            nonlocal last_results
+
+            step = steps[num]
+            results = get_processor_results(results)
+
+            if measurement:
+                measurements.append((step.path, measurement))
+                metrics.log(self.name, step.path, measurement)
 
-                if isinstance(results, types.GeneratorType):
-                    # iterate over each "yield" -> run all code to catch all exceptions
-                    results = dict(results)
+            if results:
+                data.update(results)
 
-                if not results:
-                    # Nothing to do, go to the next processor
+                if 'ARGS' not in step.args:
+                    # skip results for special loader
+                    self.logger.info('%s: %r', step.path, results)
+
+            if num == len(steps) - 1:
+                # Return not all intermediary variables but result of last command
+                # If you want to -- you could make your last command to return all variables
+                last_results = dict(results) if results else None
+
+            timings[num] = measurement.timing if measurement else (time.monotonic(), time.monotonic())
+            done.add(num)
+
+        pool = get_pool()
+        num = None
+
+        try:
+            while waiting or running:
+                ready = [num for num in sorted(waiting) if dependencies[num] <= done]
+                # Start threads first, inline steps run meanwhile
+                ready.sort(key=lambda num: self.is_inline(steps[num]))
+
+                for num in ready:
+                    waiting.remove(num)
+                    step = steps[num]
+
+                    if self.is_guarded(step, data) or self.is_unchanged(step, data):
+                        finish(num, None, None)
+                    elif inline or self.is_inline(step) or (len(ready) == 1 and not running):
+                        finish(num, *metrics.measure(call_processor, step.fn, self.get_input(step, data)))
+                    else:
+                        running[pool.submit(call_processor_in_thread, step.fn, self.get_input(step, data))] = num
+
+                if not running:
                     continue
-                elif not isinstance(results, dict):
-                    # result is a tuple: (k, v)
-                    results = {results[0]: results[1]}
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    num = running.pop(future)
+                    finish(num, *future.result())
+        except Exception as ex:
+            for future in running:
+                future.cancel()
+
+            # Threads are shared by other runs, do not leave them working for the failed one
+            wait(running)
+
+            path = steps[num].path if num is not None else None
+            self.logger.error('%s: %r', path, ex)
+            self.failed_path = path
+            raise
+        finally:
+            metrics.record(self.name, measurements)
+
+        self.critical_path, total = get_critical_path(steps, dependencies, timings)
+        self.logger.info('critical path %.3fs: %s', total,
+                         ' -> '.join(f'{path} {seconds:.3f}s' for path, seconds in self.critical_path if seconds))
+
+        return last_results
+
+    def run_many(self, media_ids=None, **kwargs):
+        """
+        Run processors for each media, but load and save all of them at once.
+
+        First and last processors are replaced by their batch variants (see media_processors.BATCH_PROCESSORS).
+        Failure of one media does not stop others: returns {media_id: result or exception},
+        failed processors are in `failed_paths` {media_id: path}.
+        """
+        from processing import metrics
+        from processing.media_processors import BATCH_PROCESSORS
+
+        steps = list(self.PROCESSORS_DATA)
+
+        load_many = BATCH_PROCESSORS.get(steps[0].path) if steps else None
+        save_many = BATCH_PROCESSORS.get(steps[-1].path) if len(steps) > 1 else None
+        load_path = steps[0].path if load_many else None
+        save_path = steps[-1].path if save_many else None
+
+        if load_many:
+            steps.pop(0)
+        if save_many:
+            steps.pop()
+
+        self.logger.info('INPUT: %r', {**kwargs, 'media_ids': media_ids})
+
+        items = self.run_batch(load_many, media_ids=media_ids, ARGS=self.ARGS) if load_many else {}
+
+        results = {}
+        passed = {}
+        self.failed_paths = {}
+
+        for media_id in media_ids:
+            if load_many and media_id not in items:
+                results[media_id] = LookupError(f'Media.id={media_id} does not exist')
+                self.failed_paths[media_id] = load_path
+                continue
+
+            data = {**kwargs, 'media_id': media_id, 'ARGS': self.ARGS, **items.get(media_id, {})}
+
+            try:
+                with metrics.Profile(self.name, media_id) as profile:
+                    results[media_id] = self.run_steps(steps, data, inline=profile is not None)
             except Exception as ex:
-                self.logger.error('%s: %r', path, ex)
-                raise
+                results[media_id] = ex
+                self.failed_paths[media_id] = self.failed_path
+                continue
+
+            passed[media_id] = data
+
+        if not save_many or not passed:
+            return results
+
+        try:
+            saved = self.run_batch(save_many, items=passed)
+        except Exception as ex:
+            self.logger.error('%s: %r', save_path, ex)
+
+            # Find out which media could not be saved
+            saved = {}
+
+            for media_id, data in passed.items():
+                try:
+                    saved.update(save_many(items={media_id: data}))
+                except Exception as ex:
+                    self.logger.error('%s: Media.id=%s: %r', save_path, media_id, ex)
+                    results[media_id] = ex
+                    self.failed_paths[media_id] = save_path
+
+        for media_id, media in saved.items():
+            results[media_id] = {'media': media}
+
+        return results
+
+    def run_batch(self, fn, **kwargs):
+        """Call batch processor of run_many, measured as a processor of its own"""
+        from processing import metrics
 
-            data.update(results)
+        path = f'{fn.__module__}.{fn.__qualname__}'
+        result, measurement = metrics.measure(fn, **kwargs)
 
-            if 'ARGS' not in args:
-                # skip results for special loader
-                self.logger.info('%s: %r', path, results)
+        metrics.log(self.name, path, measurement)
+        metrics.record(self.name, [(path, measurement)])
 
-        # Return not all intermediary variables but result of last command
-        # If you want to -- you could make your last command to return all variables
-        return dict(results) if results else None
\ No newline at end of file
+        return result
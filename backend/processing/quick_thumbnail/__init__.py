@@ -22,4 +22,18 @@ def run(media_id=None):
     logger.info('generate quick thumbnail for Media.id=%s', media_id)
     result = DataProcessor(PROCESSORS, logger=logger).run(media_id=media_id)
 
-    ws_notify_about_thumbnail(**result)
\ No newline at end of file
+    ws_notify_about_thumbnail(**result)
+
+
+def run_many(media_ids=None):
+    from processing.media_processors import ws_notify_about_thumbnail
+
+    logger = logging.getLogger(__name__)
+    logger.info('generate quick thumbnail for Media.id in %s', media_ids)
+    results = DataProcessor(PROCESSORS, logger=logger).run_many(media_ids=media_ids)
+
+    for result in results.values():
+        if not isinstance(result, Exception):
+            ws_notify_about_thumbnail(**result)
+
+    return results
@@ -1,33 +1,37 @@
-import tempfile
+from processing.media_processors import is_image, is_raw_image
+from processing.processor import processor
 
-from processing.media_processors import is_image
+THUMBNAIL_WRITES = ('thumbnail', 'thumbnail_width', 'thumbnail_height')
 
 
-def ThumbnailByContentDegree(media_type=None, content=None, needed_rotate_degree=None):
+@processor(writes=THUMBNAIL_WRITES, guard=is_image)
+def ThumbnailByContentDegree(media_id=None, uploader_id=None, metadata=None, content=None, needed_rotate_degree=None):
     from processing.quick_thumbnail.thumbnail import Thumbnail
 
-    if not is_image(media_type):
-        return
+    if is_raw_image(metadata):
+        # Decoding of RAW is expensive (if supported at all) -- use embed preview instead, see the next processor
+        return 'thumbnail', None
 
     try:
-        return Thumbnail.generate_from_path(content.path, needed_rotate_degree=needed_rotate_degree)
+        result = Thumbnail.generate_from_path(content.path, needed_rotate_degree=needed_rotate_degree)
     except Thumbnail.SourceImageError:
         return 'thumbnail', None
 
+    return Thumbnail.store(result, uploader_id=uploader_id, media_id=media_id)
+
 
-def ThumbnailByExiftoolMetadataEmbedContentDegree(media_type=None, thumbnail=None, metadata=None, content=None,
-                                                  needed_rotate_degree=None):
+@processor(writes=THUMBNAIL_WRITES, guard=is_image)
+def ThumbnailByExiftoolMetadataEmbedContentDegree(media_id=None, uploader_id=None, thumbnail=None, metadata=None,
+                                                  content=None, needed_rotate_degree=None):
     from storage.tools.exiftool import extract_any_embed_image
     from processing.quick_thumbnail.thumbnail import Thumbnail
 
-    if not is_image(media_type):
-        return
-
     if thumbnail:
         return
 
-    with tempfile.TemporaryFile('w+b') as embed_image:
-        # Use biggest image to generate thumbnail
-        extract_any_embed_image(metadata['exiftool'], content.path, target=embed_image, biggest=True)
+    # Use the smallest image which gives thumbnail of the best quality, e.g. PreviewImage, not JpgFromRaw
+    embed_image = extract_any_embed_image(metadata['exiftool'], content.path, min_size=Thumbnail.get_min_source_size())
+
+    result = Thumbnail.generate_from_file(embed_image, needed_rotate_degree=needed_rotate_degree)
 
-        return Thumbnail.generate_from_file(embed_image, needed_rotate_degree=needed_rotate_degree)
+    return Thumbnail.store(result, uploader_id=uploader_id, media_id=media_id)
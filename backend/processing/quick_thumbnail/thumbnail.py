@@ -1,6 +1,10 @@
-from PIL import Image
+import math
+
+from PIL import Image, Jpeg2KImagePlugin
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+from storage.tools.image_formats import encode_alternatives, save_with_alternatives
+
 
 class Thumbnail:
     THUMBNAIL_RESIZE_SETTINGS = {
@@ -16,6 +20,11 @@ class Thumbnail:
     }
     MIMETYPE = 'image/jpeg'
 
+    # Before the final resample, image is cheaply reduced to that many times of thumbnail size:
+    # JPEG is decoded with DCT scaling (1/2, 1/4, 1/8), JPEG 2000 -- at lower resolution level, others -- box filter.
+    # 2 is close to resample of the whole image (see reducing_gap of Image.thumbnail in Pillow 7+)
+    REDUCING_GAP = 2
+
     class SourceImageError(ValueError):
         pass
 
@@ -43,18 +52,19 @@ class Thumbnail:
         size = None, None
 
         try:
-            image.thumbnail(**Thumbnail.THUMBNAIL_RESIZE_SETTINGS)
-            # TODO: Sharpen by taste or multi-step downsampling
+            thumbnail = Thumbnail.reduce(image)
+            thumbnail.thumbnail(**Thumbnail.THUMBNAIL_RESIZE_SETTINGS)
+            # TODO: Sharpen by taste
 
             # Rotate thumbnail, not whole image
             if needed_rotate_degree:
                 # PIL rotate rotates counter clockwise => invert it
-                thumbnail = image.rotate(-needed_rotate_degree, expand=True)
-            else:
-                thumbnail = image
+                thumbnail = thumbnail.rotate(-needed_rotate_degree, expand=True)
 
             size = thumbnail.size
             thumbnail.save(target, **Thumbnail.THUMBNAIL_SETTINGS)
+            # Smaller formats, stored next to JPEG, see Thumbnail.store
+            target.alternatives = encode_alternatives(thumbnail)
         finally:
             image.close()
 
@@ -63,3 +73,55 @@ class Thumbnail:
             'thumbnail_width': size[0],
             'thumbnail_height': size[1],
         }
+
+    @staticmethod
+    def store(result, uploader_id=None, media_id=None):
+        """Save generated thumbnail with its alternative formats, under the same name on every processing"""
+        from django.core.files.storage import default_storage
+        from storage.models import Media
+
+        thumbnail = result['thumbnail']
+        thumbnail.seek(0)
+
+        name = Media.generate_thumbnail_filename(Media(id=media_id, uploader_id=uploader_id), thumbnail.name)
+
+        return {
+            **result,
+            'thumbnail': save_with_alternatives(default_storage, name, thumbnail, thumbnail.alternatives),
+        }
+
+    @staticmethod
+    def get_min_source_size():
+        """Source of that size (width or height) is enough for thumbnail of the best quality"""
+        width, height = Thumbnail.THUMBNAIL_RESIZE_SETTINGS['size']
+        return width * Thumbnail.REDUCING_GAP, height * Thumbnail.REDUCING_GAP
+
+    @staticmethod
+    def reduce(image, min_size=None):
+        """
+        Load not yet loaded image at the lowest resolution which still gives thumbnail of the best quality.
+
+        min_size -- (width, height) image is reduced to fit into, by default for the thumbnail
+        """
+        min_width, min_height = min_size or Thumbnail.get_min_source_size()
+        scale = min(min_width / image.size[0], min_height / image.size[1])
+
+        if scale >= 1:
+            return image
+
+        reduced_size = max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale))
+
+        # JPEG: decode at 1/2, 1/4 or 1/8 of size, but not less than reduced size
+        image.draft(None, reduced_size)
+
+        if isinstance(image, Jpeg2KImagePlugin.Jpeg2KImageFile):
+            # Every resolution level halves the size
+            image.reduce = int(math.log2(1 / scale))
+
+        image.load()
+
+        if image.size[0] < 2 * reduced_size[0] or image.size[1] < 2 * reduced_size[1]:
+            # Not worth it, final resample is not much more expensive
+            return image
+
+        return image.resize(reduced_size, Image.BOX)
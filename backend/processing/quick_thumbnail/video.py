@@ -1,13 +1,21 @@
-import tempfile
+import logging
+from subprocess import CalledProcessError
 
-from django.core.files import File
-from django.core.files.uploadedfile import TemporaryUploadedFile, SimpleUploadedFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from processing.media_processors import is_video
+from processing.processor import processor
+
+logger = logging.getLogger(__name__)
 
 
 class ScreenShotByDurationVideoContent:
+    # Screenshot if no keyframe is chosen, see select_keyframe
     VIDEO_SCREENSHOT_SECOND = 10
+    # Keyframes to choose the screenshot from, spread over the video
+    CANDIDATES_NUM = 8
+    # Keyframes are scored at this resolution, aspect ratio does not matter
+    SCORE_SIZE = 128
     SCREENSHOT_SETTINGS = {
         'format': 'JPEG',
         'quality': 95,
@@ -16,38 +24,95 @@ class ScreenShotByDurationVideoContent:
     }
 
     @staticmethod
-    def run(media_type=None, duration=None, content=None):
+    def get_candidate_offsets(duration_seconds, num):
+        """
+        >>> ScreenShotByDurationVideoContent.get_candidate_offsets(90, 2)
+        [30.0, 60.0]
+        """
+        return [round(duration_seconds * (i + 1) / (num + 1), 3) for i in range(num)]
+
+    @staticmethod
+    def score(pixels):
+        """
+        Contrast (std of luminance) times sharpness (std of Laplacian): black, flat and blurry frames get low score
+
+        >>> import numpy as np
+        >>> gradient = np.tile(np.arange(8, dtype=np.uint8) * 32, (8, 1))
+        >>> checkers = (np.indices((8, 8)).sum(axis=0) % 2 * 255).astype(np.uint8)
+        >>> ScreenShotByDurationVideoContent.score(gradient)
+        0.0
+        >>> ScreenShotByDurationVideoContent.score(checkers) > 0
+        True
+        """
+        import numpy as np
+
+        image = pixels.astype(np.float32)
+        laplacian = 4 * image[1:-1, 1:-1] - image[:-2, 1:-1] - image[2:, 1:-1] - image[1:-1, :-2] - image[1:-1, 2:]
+
+        return float(image.std() * laplacian.std())
+
+    @staticmethod
+    def select_keyframe(path, duration_seconds):
+        """
+        Offset of the best of candidate keyframes, None if there are no keyframes after offsets
+        or they could not be decoded -- a screenshot at the fixed offset is taken then
+        """
+        import numpy as np
+        from storage.tools import ffmpeg
+
+        size = ScreenShotByDurationVideoContent.SCORE_SIZE
+        offsets = ScreenShotByDurationVideoContent.get_candidate_offsets(
+            duration_seconds, ScreenShotByDurationVideoContent.CANDIDATES_NUM)
+
+        try:
+            keyframes = ffmpeg.get_keyframes(path, offsets, width=size, height=size, hide_log=True)
+
+            scores = [(ScreenShotByDurationVideoContent.score(np.frombuffer(keyframe, dtype=np.uint8)
+                                                              .reshape(size, size)), offset)
+                      for offset, keyframe in zip(offsets, keyframes) if keyframe]
+        except (CalledProcessError, ValueError) as ex:
+            logger.warning(f'keyframes of {path} are not scored, fixed offset is used: {ex!r}')
+            return None
+
+        return max(scores)[1] if scores else None
+
+    @staticmethod
+    @processor(writes=('screenshot', 'width', 'height'), guard=is_video)
+    def run(duration=None, content=None):
         from storage.tools import ffmpeg
         from PIL import Image
 
-        if not is_video(media_type):
-            return
+        screenshot_second = ScreenShotByDurationVideoContent.select_keyframe(content.path, duration.total_seconds())
+        is_keyframe = screenshot_second is not None
 
-        screenshot_second = min(duration.total_seconds() // 3, ScreenShotByDurationVideoContent.VIDEO_SCREENSHOT_SECOND)
+        if not is_keyframe:
+            screenshot_second = min(duration.total_seconds() // 3,
+                                    ScreenShotByDurationVideoContent.VIDEO_SCREENSHOT_SECOND)
 
         # TODO: Refactor to generate only thumbnail
 
-        screenshot = TemporaryUploadedFile(name='screenshot.jpg', content_type='', size=0, charset='')
+        screenshot = SimpleUploadedFile(name='screenshot.jpg', content=b'', content_type='image/jpeg')
 
-        with tempfile.TemporaryFile('w+b') as screenshot_raw:
-            ffmpeg.get_screenshot(content.path, seconds_offset=screenshot_second, hide_log=True, target=screenshot_raw)
+        # The same keyframe as scored one: only it is decoded in full resolution
+        with ffmpeg.get_screenshot(content.path, seconds_offset=screenshot_second, hide_log=True,
+                                   keyframe=is_keyframe) as screenshot_raw:
 
             with Image.open(screenshot_raw) as image:
                 image.save(screenshot, **ScreenShotByDurationVideoContent.SCREENSHOT_SETTINGS)
+                screenshot.seek(0)
 
                 return {
-                    # Don't use screenshot directly since it would be deleted before closing, making TempFile crash
-                    'screenshot': File(screenshot),
+                    'screenshot': screenshot,
                     # screenshot is full-size of content, save dimensions into content width and height
                     'width': image.size[0],
                     'height': image.size[1],
                 }
 
 
-def ThumbnailByScreenShotDegree(media_type=None, screenshot=None, needed_rotate_degree=None):
+@processor(writes=('thumbnail', 'thumbnail_width', 'thumbnail_height'), guard=is_video)
+def ThumbnailByScreenShotDegree(media_id=None, uploader_id=None, screenshot=None, needed_rotate_degree=None):
     from processing.quick_thumbnail.thumbnail import Thumbnail
 
-    if not is_video(media_type):
-        return
+    result = Thumbnail.generate_from_file(screenshot, needed_rotate_degree=needed_rotate_degree)
 
-    return Thumbnail.generate_from_file(screenshot, needed_rotate_degree=needed_rotate_degree)
+    return Thumbnail.store(result, uploader_id=uploader_id, media_id=media_id)
@@ -1,8 +1,11 @@
+import logging
 import pydoc
 from collections import namedtuple
 from itertools import zip_longest
 
-State = namedtuple('State', ['code', 'task', 'command'])
+logger = logging.getLogger(__name__)
+
+State = namedtuple('State', ['code', 'task', 'command', 'processors', 'queue'])
 
 
 class ProcessingState:
@@ -15,21 +18,44 @@ class ProcessingState:
     STATE_CATEGORIES = 25
     STATE_GROUPS = 30
 
+    # Queue for states that run external tools / decode media, so they do not delay cheap ones.
+    # None means default queue.
+    QUEUE_HEAVY = 'processing_heavy'
+    # Video transcoding (see processing.play_media.transcode), it takes minutes, but is not needed to show media
+    QUEUE_TRANSCODE = 'processing_transcode'
+
     STATES = (
-        State(STATE_INITIAL, 'processing.tasks.initial_state', None),
-        State(STATE_BASE_METADATA, 'processing.tasks.extract_base_metadata', 'processing.base_metadata.run'),
-        State(STATE_QUICK_THUMBNAIL, 'processing.tasks.generate_quick_thumbnail', 'processing.quick_thumbnail.run'),
-        State(STATE_PLAY_MEDIA, 'processing.tasks.generate_play', 'processing.play_media.run'),
-        State(STATE_METADATA, 'processing.tasks.calculate_metadata', 'processing.metadata.run'),
-        State(STATE_CATEGORIES, 'processing.tasks.categorize', 'processing.categories.run'),
-        State(STATE_GROUPS, 'processing.tasks.group', 'processing.groups.run'),
+        State(STATE_INITIAL, 'processing.tasks.initial_state', None, None, None),
+        State(STATE_BASE_METADATA, 'processing.tasks.extract_base_metadata', 'processing.base_metadata.run',
+              'processing.base_metadata.PROCESSORS', QUEUE_HEAVY),
+        State(STATE_QUICK_THUMBNAIL, 'processing.tasks.generate_quick_thumbnail', 'processing.quick_thumbnail.run',
+              'processing.quick_thumbnail.PROCESSORS', QUEUE_HEAVY),
+        State(STATE_PLAY_MEDIA, 'processing.tasks.generate_play', 'processing.play_media.run',
+              'processing.play_media.PROCESSORS', QUEUE_HEAVY),
+        State(STATE_METADATA, 'processing.tasks.calculate_metadata', 'processing.metadata.run',
+              'processing.metadata.PROCESSORS', None),
+        State(STATE_CATEGORIES, 'processing.tasks.categorize', 'processing.categories.run',
+              'processing.categories.PROCESSORS', None),
+        State(STATE_GROUPS, 'processing.tasks.group', 'processing.groups.run',
+              'processing.groups.PROCESSORS', None),
     )
 
     STATES_DICT = {state.code: (state, next_state)
                    for state, next_state in zip_longest(STATES, STATES[1:])}
 
+    # Consecutive cheap states that are run by a single task: media is loaded and saved once for all of them.
+    # Their `run` must do nothing but DataProcessor(PROCESSORS).run(media_id=...)
+    FUSED_STATES = (STATE_METADATA, STATE_CATEGORIES, STATE_GROUPS)
+
+    # Checkpoint processors of fused states by state code
+    CHECKPOINTS = {}
+
+    # Batch variants of tasks and commands have the same name with this suffix, e.g. `run_many`
+    BATCH_SUFFIX = '_many'
+
     @classmethod
     def run(cls, state_code, media_id):
+        from django.conf import settings
         from storage.models import Media
 
         state, next_state = cls.STATES_DICT.get(state_code, (None, None))
@@ -37,7 +63,11 @@ class ProcessingState:
         if not state:
             raise NotImplementedError(state_code)
 
-        if state.command:
+        if settings.PROCESSING_FUSED_STATES and state.code in cls.FUSED_STATES:
+            states = cls.get_fused_states(state.code)
+            cls.run_fused(states, media_id)
+            state, next_state = cls.STATES_DICT[states[-1].code]
+        elif state.command:
             command = pydoc.locate(state.command)
             try:
                 command(media_id=media_id)
@@ -49,4 +79,180 @@ class ProcessingState:
 
         if next_state and next_state.task:
             task = pydoc.locate(next_state.task)
-            task.delay(media_id)
+            task.apply_async((media_id,), queue=next_state.queue)
+
+    @classmethod
+    def run_many(cls, state_code, media_ids):
+        """
+        Batch variant of `run`: failed media are marked as failed, the rest go to the next state together.
+        Returns ids of passed media.
+        """
+        from django.conf import settings
+        from storage.models import Media
+
+        state, next_state = cls.STATES_DICT.get(state_code, (None, None))
+
+        if not state:
+            raise NotImplementedError(state_code)
+
+        if settings.PROCESSING_FUSED_STATES and state.code in cls.FUSED_STATES:
+            states = cls.get_fused_states(state.code)
+            passed_ids = cls.run_fused_many(states, media_ids)
+            state, next_state = cls.STATES_DICT[states[-1].code]
+        elif state.command:
+            command = pydoc.locate(state.command + cls.BATCH_SUFFIX)
+            results = command(media_ids=media_ids)
+
+            passed_ids = [media_id for media_id in media_ids if not isinstance(results[media_id], Exception)]
+            failed_ids = [media_id for media_id in media_ids if isinstance(results[media_id], Exception)]
+
+            Media.objects.filter(id__in=passed_ids).update(processing_state_code=state.code)
+            if failed_ids:
+                Media.objects.filter(id__in=failed_ids).update(processing_state_code=-state.code)
+        else:
+            passed_ids = list(media_ids)
+
+        if next_state and next_state.task and passed_ids:
+            task = pydoc.locate(next_state.task + cls.BATCH_SUFFIX)
+            task.apply_async((passed_ids,), queue=next_state.queue)
+
+        return passed_ids
+
+    @classmethod
+    def delay_many(cls, state_code, media_ids, chunk_size):
+        """Queue batch tasks for given state, `chunk_size` media per task"""
+        state, next_state = cls.STATES_DICT[state_code]
+        task = pydoc.locate(state.task + cls.BATCH_SUFFIX)
+
+        media_ids = list(media_ids)
+
+        for i in range(0, len(media_ids), chunk_size):
+            task.apply_async((media_ids[i:i + chunk_size],), queue=state.queue)
+
+    @classmethod
+    def get_fused_states(cls, state_code):
+        """Given state and following fused ones, e.g. `reprocess --state` could start in the middle"""
+        states = []
+
+        for state in cls.STATES:
+            if state.code < state_code:
+                continue
+            if state.code not in cls.FUSED_STATES:
+                break
+            states.append(state)
+
+        return states
+
+    @classmethod
+    def get_checkpoint(cls, state):
+        """Processor that marks the state as done, the same one for each state to keep pipelines cached"""
+        from processing.processor import processor
+
+        try:
+            return cls.CHECKPOINTS[state.code]
+        except KeyError:
+            pass
+
+        @processor(writes=('processing_state_code',))
+        def checkpoint():
+            return 'processing_state_code', state.code
+
+        checkpoint.__qualname__ = f'{cls.__qualname__}.checkpoint({state.code})'
+        cls.CHECKPOINTS[state.code] = checkpoint
+        return checkpoint
+
+    @classmethod
+    def get_fused_processors(cls, states):
+        """Processors of all given states, each state is followed by its checkpoint: [(processor, state), ...]"""
+        from processing.media_processors import LOAD_PROCESSOR, SAVE_PROCESSOR
+
+        processors = [(LOAD_PROCESSOR, states[0])]
+
+        for state in states:
+            processors += [(path, state) for path in pydoc.locate(state.processors)
+                           if path not in (LOAD_PROCESSOR, SAVE_PROCESSOR)]
+            processors.append((cls.get_checkpoint(state), state))
+
+        # Failed on saving -- blame the last state
+        processors.append((SAVE_PROCESSOR, states[-1]))
+        return processors
+
+    @classmethod
+    def run_fused(cls, states, media_id):
+        """
+        Run processors of all given states in one DataProcessor.
+
+        Each state is followed by a checkpoint that sets `processing_state_code`, so it is saved by the same UPDATE.
+        On failure nothing is saved, even results of passed states, so media is marked by a negative code of the first
+        state: resuming from it runs all of them again on saved inputs.
+        """
+        from processing.processor import DataProcessor
+        from storage.models import Media
+
+        processors = cls.get_fused_processors(states)
+
+        logger.info('run fused states %s for Media.id=%s', [state.code for state in states], media_id)
+
+        processor = DataProcessor([path for path, state in processors], logger=logger, name=cls.get_fused_name(states))
+
+        try:
+            processor.run(media_id=media_id)
+        except Exception:
+            failed_state = cls.get_failed_state(processors, processor.failed_path)
+            logger.info('fused state %s failed for Media.id=%s', failed_state.code, media_id)
+            Media.objects.filter(id=media_id).update(processing_state_code=-states[0].code)
+            raise
+
+    @classmethod
+    def run_fused_many(cls, states, media_ids):
+        """Batch variant of `run_fused`, returns ids of media that passed all states"""
+        from processing.processor import DataProcessor
+        from storage.models import Media
+
+        processors = cls.get_fused_processors(states)
+
+        logger.info('run fused states %s for Media.id in %s', [state.code for state in states], media_ids)
+
+        processor = DataProcessor([path for path, state in processors], logger=logger, name=cls.get_fused_name(states))
+        processor.run_many(media_ids=media_ids)
+
+        for media_id, path in processor.failed_paths.items():
+            logger.info('fused state %s failed for Media.id=%s', cls.get_failed_state(processors, path).code, media_id)
+
+        if processor.failed_paths:
+            # Nothing of failed media is saved, see `run_fused`
+            Media.objects.filter(id__in=list(processor.failed_paths)).update(processing_state_code=-states[0].code)
+
+        return [media_id for media_id in media_ids if media_id not in processor.failed_paths]
+
+    @staticmethod
+    def get_fused_name(states):
+        return 'fused:' + ','.join(str(state.code) for state in states)
+
+    @staticmethod
+    def get_failed_state(processors, failed_path):
+        from processing.processor import DataProcessor
+
+        return next((state for path, state in processors if DataProcessor.get_name(path) == failed_path),
+                    processors[0][1])
+
+    @classmethod
+    def get_pipelines(cls):
+        """Processors of all states, as they are run"""
+        from django.conf import settings
+
+        fused_states = cls.get_fused_states(cls.FUSED_STATES[0]) if settings.PROCESSING_FUSED_STATES else ()
+
+        for state in cls.STATES:
+            if state.processors and state not in fused_states:
+                yield state.processors, pydoc.locate(state.processors)
+
+        if fused_states:
+            yield cls.get_fused_name(fused_states), [path for path, state in cls.get_fused_processors(fused_states)]
+
+    @classmethod
+    def compile_pipelines(cls):
+        """Compile all pipelines once, e.g. on application startup, to be shared by all runs"""
+        from processing.processor import DataProcessor
+
+        return [(name, DataProcessor.compile(processors)) for name, processors in cls.get_pipelines()]
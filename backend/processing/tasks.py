@@ -36,3 +36,46 @@ def categorize(media_id):
 @shared_task
 def group(media_id):
     ProcessingState.run(state_code=ProcessingState.STATE_GROUPS, media_id=media_id)
+
+
+@shared_task
+def transcode_video(media_id):
+    from processing.play_media.transcode import transcode_media
+
+    transcode_media(media_id=media_id)
+
+
+# Batch variants, see ProcessingState.run_many
+@shared_task
+def initial_state_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_INITIAL, media_ids=media_ids)
+
+
+@shared_task
+def extract_base_metadata_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_BASE_METADATA, media_ids=media_ids)
+
+
+@shared_task
+def generate_quick_thumbnail_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_QUICK_THUMBNAIL, media_ids=media_ids)
+
+
+@shared_task
+def generate_play_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_PLAY_MEDIA, media_ids=media_ids)
+
+
+@shared_task
+def calculate_metadata_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_METADATA, media_ids=media_ids)
+
+
+@shared_task
+def categorize_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_CATEGORIES, media_ids=media_ids)
+
+
+@shared_task
+def group_many(media_ids):
+    ProcessingState.run_many(state_code=ProcessingState.STATE_GROUPS, media_ids=media_ids)
@@ -0,0 +1,139 @@
+import logging
+
+from django.test import SimpleTestCase
+
+from processing.metrics import BYTES_BUCKETS, WALL_SECONDS, Histogram, format_labels
+from processing.processor import (CycleError, DataProcessor, Step, UndeclaredWritesError, check_cycles,
+                                  get_critical_path, get_dependencies, processor)
+
+
+@processor(writes=('a',))
+def write_a(media_id=None):
+    return 'a', media_id
+
+
+@processor(writes=('b',))
+def write_b(a=None):
+    return 'b', a + 1
+
+
+@processor(writes=('c',))
+def write_c(a=None):
+    return 'c', a + 2
+
+
+@processor(writes=('a',))
+def overwrite_a(b=None, c=None):
+    return 'a', b + c
+
+
+@processor(writes=DataProcessor.ALL_ARGUMENTS)
+def load(media_id=None):
+    return {'a': media_id}
+
+
+def undeclared(a=None):
+    return 'b', a
+
+
+class CompileTest(SimpleTestCase):
+    PROCESSORS = ('processing.tests.write_a', 'processing.tests.write_b')
+
+    def test_compiled_once(self):
+        pipeline = DataProcessor.compile(self.PROCESSORS)
+
+        self.assertIs(DataProcessor.compile(list(self.PROCESSORS)), pipeline)
+        self.assertIs(DataProcessor(self.PROCESSORS).PROCESSORS_DATA, pipeline.steps)
+
+    def test_steps(self):
+        pipeline = DataProcessor.compile(self.PROCESSORS)
+
+        self.assertEqual([step.path for step in pipeline.steps], list(self.PROCESSORS))
+        self.assertEqual([step.fn for step in pipeline.steps], [write_a, write_b])
+        self.assertEqual(pipeline.steps[1].args, {'a'})
+        self.assertEqual(pipeline.steps[1].writes, {'b'})
+        self.assertEqual(pipeline.args, {'media_id', 'a'})
+
+    def test_report(self):
+        report = DataProcessor.compile(self.PROCESSORS).report()
+
+        self.assertEqual(report[1], {
+            'path': 'processing.tests.write_b',
+            'reads': ['a'],
+            'writes': ['b'],
+            'after': ['processing.tests.write_a'],
+        })
+
+    def test_missing_processor(self):
+        with self.assertRaises(AssertionError):
+            DataProcessor.compile(('processing.tests.write_a', 'processing.tests.missing'))
+
+
+class DependenciesTest(SimpleTestCase):
+    @staticmethod
+    def get_dependencies(*names):
+        return get_dependencies(DataProcessor.compile(f'processing.tests.{name}' for name in names).steps)
+
+    def test_readers_after_writer(self):
+        self.assertEqual(self.get_dependencies('write_a', 'write_b', 'write_c'), [set(), {0}, {0}])
+
+    def test_writer_after_readers(self):
+        self.assertEqual(self.get_dependencies('write_a', 'write_b', 'write_c', 'overwrite_a'),
+                         [set(), {0}, {0}, {0, 1, 2}])
+
+    def test_barrier(self):
+        self.assertEqual(self.get_dependencies('write_b', 'write_c', 'load', 'write_b'),
+                         [set(), set(), {0, 1}, {2}])
+
+    def test_undeclared_writes(self):
+        with self.assertRaises(UndeclaredWritesError):
+            self.get_dependencies('write_a', 'undeclared')
+
+    def test_cycle(self):
+        steps = tuple(Step(frozenset(), None, path, frozenset(), None, frozenset()) for path in 'abc')
+
+        check_cycles(steps, [set(), {0}, {0, 1}])
+
+        with self.assertRaisesRegex(CycleError, r"\['b', 'c'\]"):
+            check_cycles(steps, [set(), {2}, {1}])
+
+    def test_critical_path(self):
+        steps = DataProcessor.compile(('processing.tests.write_a', 'processing.tests.write_b',
+                                       'processing.tests.write_c', 'processing.tests.overwrite_a')).steps
+        timings = {0: (0, 1), 1: (1, 2), 2: (1, 4), 3: (4, 4.5)}
+
+        path, total = get_critical_path(steps, get_dependencies(steps), timings)
+
+        self.assertEqual(path, [('processing.tests.write_a', 1), ('processing.tests.write_c', 3),
+                                ('processing.tests.overwrite_a', 0.5)])
+        self.assertEqual(total, 4.5)
+
+    def test_run(self):
+        data_processor = DataProcessor(('processing.tests.write_a', 'processing.tests.write_b',
+                                        'processing.tests.write_c', 'processing.tests.overwrite_a'),
+                                       logger=logging.getLogger(__name__))
+
+        self.assertEqual(data_processor.run(media_id=1), {'a': 5})
+
+
+class HistogramTest(SimpleTestCase):
+    def test_get_bucket(self):
+        histogram = Histogram('test', 'Test', 'value', (1, 2.5, 10), 1)
+
+        self.assertEqual([histogram.get_bucket(value) for value in (0, 1, 1.0001, 2.5, 3, 10, 11)],
+                         [0, 0, 1, 1, 2, 2, 3])
+
+    def test_get_bucket_of_defaults(self):
+        self.assertEqual(WALL_SECONDS.get_bucket(0), 0)
+        self.assertEqual(WALL_SECONDS.get_bucket(float('inf')), len(WALL_SECONDS.buckets))
+        self.assertEqual(Histogram('test', 'Test', 'value', BYTES_BUCKETS, 1).get_bucket(1 << 20), 1)
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels(pipeline='fused:1,2', processor='Concurrent(a, b)', le=0.5),
+                         '{pipeline="fused:1,2",processor="Concurrent(a, b)",le="0.5"}')
+
+    def test_format_labels_escaped(self):
+        self.assertEqual(format_labels(processor='a\\b"c\nd'), '{processor="a\\\\b\\"c\\nd"}')
+
+    def test_no_labels(self):
+        self.assertEqual(format_labels(), '{}')
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 14:20
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0004_auto_20170129_1505'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='renditions',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list, help_text='View-optimized images: [{size, width, height, mimetype, name}, ...] from the smallest'),
+        ),
+    ]
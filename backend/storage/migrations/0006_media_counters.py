@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 13:51
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_media(apps, schema_editor):
+    """The same as storage.tools.media_counters.rebuild, by historical models"""
+    from django.db.models import Count
+    from django.db.models.functions import TruncMonth
+    from storage.const import MediaConstMixin
+
+    Media = apps.get_model('storage', 'Media')
+    MediaMonthCounter = apps.get_model('storage', 'MediaMonthCounter')
+    MediaCategoryCounter = apps.get_model('storage', 'MediaCategoryCounter')
+
+    months = (Media.objects.exclude(show_at=None).annotate(month=TruncMonth('show_at'))
+              .values_list('uploader_id', 'month').order_by().annotate(Count('id')))
+    MediaMonthCounter.objects.bulk_create([
+        MediaMonthCounter(uploader_id=uploader_id, month=month.date(), num=num) for uploader_id, month, num in months
+    ])
+
+    for category, name in MediaConstMixin.CATEGORIES:
+        categories = (Media.objects.filter(categories__contains=[category])
+                      .values_list('uploader_id').order_by().annotate(Count('id')))
+        MediaCategoryCounter.objects.bulk_create([
+            MediaCategoryCounter(uploader_id=uploader_id, category=category, num=num)
+            for uploader_id, num in categories
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('storage', '0005_media_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaCategoryCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num', models.IntegerField(default=0)),
+                ('category', models.IntegerField(choices=[(1, 'Image'), (2, 'Selfie'), (3, 'Parnorama'), (20, 'Burst'), (4, 'Screenshot'), (10, 'Video'), (11, 'Interval video'), (12, 'Slo-mo video'), (13, 'Widescreen video'), (30, 'Not image or video'), (21, 'Portrait media'), (22, 'Landscape media'), (23, 'Square media')])),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaMonthCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num', models.IntegerField(default=0)),
+                ('month', models.DateField(help_text='The first day of the month of Media.show_at, in the current time zone')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediamonthcounter',
+            unique_together=set([('uploader', 'month')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediacategorycounter',
+            unique_together=set([('uploader', 'category')]),
+        ),
+        migrations.RunPython(count_media, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 13:51
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGinExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_media_counters'),
+    ]
+
+    operations = [
+        # GIN operator classes of scalar types, e.g. for uploader_id
+        BtreeGinExtension(),
+        migrations.AddIndex(
+            model_name='media',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['uploader', 'categories'], name='media_uploader_categories_gin'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2026-10-18 13:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_media_categories_gin'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['uploader', 'show_at', 'id'], name='media_uploader_show_at_id'),
+        ),
+        migrations.AddIndex(
+            model_name='media',
+            index=models.Index(fields=['uploader', 'shot_at'], name='media_uploader_shot_at'),
+        ),
+        # Media whose processing is not finished (30 is the last state) or failed (negative codes),
+        # e.g. for `reprocess --failed`: a few rows, not the whole table. Django 1.11 has no partial indexes.
+        migrations.RunSQL(
+            'CREATE INDEX media_unfinished_state ON storage_media (processing_state_code, id) '
+            'WHERE processing_state_code < 30',
+            'DROP INDEX media_unfinished_state',
+        ),
+    ]
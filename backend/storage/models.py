@@ -8,10 +8,11 @@ from django.conf import settings
 from lib.point_field import PointField
 
 from django.contrib.postgres.fields import JSONField, ArrayField, HStoreField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 
 from processing.states import ProcessingState
 from storage.helpers import base85_to_hex, hex_to_base85
@@ -71,6 +72,24 @@ class Media(MediaConstMixin, models.Model):
             content_extension=content_extension
         )
 
+    RENDITION_FILENAME_TMPL = 'rendition/{uploader_id}/{media_id}_{size}.{extension}'
+
+    @staticmethod
+    def generate_rendition_filename(uploader_id=None, media_id=None, size=None, extension=None):
+        return Media.RENDITION_FILENAME_TMPL.format(
+            uploader_id=uploader_id,
+            media_id=media_id,
+            size=size,
+            extension=extension,
+        )
+
+    # Playlists and segments of HTTP Live Streaming, see processing.play_media.transcode
+    HLS_DIRNAME_TMPL = 'hls/{uploader_id}/{media_id}'
+
+    @staticmethod
+    def generate_hls_dirname(uploader_id=None, media_id=None):
+        return Media.HLS_DIRNAME_TMPL.format(uploader_id=uploader_id, media_id=media_id)
+
     def generate_content_filename(instance, filename):
         # It is in initial file generation
         return 'content/{0.uploader_id}/{0.sha1_hex}_{0.size_bytes}'.format(instance)
@@ -142,7 +161,10 @@ class Media(MediaConstMixin, models.Model):
 
     location = HStoreField(blank=True, default=dict)
 
-    # TODO: Add field to store view-optimized content
+    renditions = JSONField(
+        default=list, blank=True,
+        help_text=_('View-optimized images: [{size, width, height, mimetype, name}, ...] from the smallest'),
+    )
 
     @classmethod
     def get_next_shot_id(cls):
@@ -152,6 +174,15 @@ class Media(MediaConstMixin, models.Model):
         unique_together = (
             ('uploader', 'sha1_b85', 'size_bytes'),
         )
+        indexes = [
+            # Filter by any-of (&&) / all-of (@>) categories of the user, uploader_id is indexed by btree_gin
+            GinIndex(fields=['uploader', 'categories'], name='media_uploader_categories_gin'),
+            # Catalog: media of the user by range of show_at, pages by (show_at, id)
+            models.Index(fields=['uploader', 'show_at', 'id'], name='media_uploader_show_at_id'),
+            # Grouping of media shot at the same time
+            models.Index(fields=['uploader', 'shot_at'], name='media_uploader_shot_at'),
+            # + partial index of not finished processing, see migration 0008_media_access_indexes
+        ]
 
     @property
     def unique_key(self):
@@ -193,22 +224,64 @@ class Media(MediaConstMixin, models.Model):
 
     @classmethod
     def post_save(cls, sender, instance, created, **kwargs):
+        from storage.tools import media_counters, media_version
+
+        media_version.touch([instance.uploader_id])
+
         if created:
+            # Further changes are counted by processing.media_processors.save_media
+            media_counters.add(media_counters.get_deltas(instance.uploader_id,
+                                                         new_state=media_counters.get_state(instance)))
             instance.process()
 
-    # TODO: Cache
+    @classmethod
+    def post_delete(cls, sender, instance, **kwargs):
+        from storage.tools import media_counters, media_version
+
+        media_version.touch([instance.uploader_id])
+        media_counters.add(media_counters.get_deltas(instance.uploader_id,
+                                                     old_state=media_counters.get_state(instance)))
+
     @classmethod
     def categories_w_count(cls, uploader=None):
-        return [
-            (c_id, c_name, Media.objects.filter(uploader=uploader, categories__contains=[c_id]).count())
-            for c_id, c_name in cls.CATEGORIES
-        ]
+        counts = dict(MediaCategoryCounter.objects.filter(uploader=uploader).values_list('category', 'num'))
+
+        return [(c_id, c_name, counts.get(c_id, 0)) for c_id, c_name in cls.CATEGORIES]
+
+
+class MediaCounter(models.Model):
+    """Number of uploader's media by some key, changed with media (see storage.tools.media_counters)"""
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE)
+    num = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class MediaMonthCounter(MediaCounter):
+    month = models.DateField(help_text=_('The first day of the month of Media.show_at, in the current time zone'))
+
+    class Meta:
+        unique_together = (
+            ('uploader', 'month'),
+        )
+
+
+class MediaCategoryCounter(MediaCounter):
+    category = models.IntegerField(choices=MediaConstMixin.CATEGORIES)
+
+    class Meta:
+        unique_together = (
+            ('uploader', 'category'),
+        )
+
 
 # We must make it static after initialization, otherwise methods would not work in FileField
 Media.generate_thumbnail_filename = staticmethod(Media.generate_thumbnail_filename)
 Media.generate_screenshot_filename = staticmethod(Media.generate_screenshot_filename)
 
 post_save.connect(Media.post_save, sender=Media)
+post_delete.connect(Media.post_delete, sender=Media)
 
 """
 Re-process not finished processes:
@@ -1,3 +1,82 @@
-from django.test import TestCase
+import datetime
+from unittest import mock
 
-# Create your tests here.
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import sql
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase
+
+from storage.models import Media
+from storage.tools import media_counters
+from storage.tools.bulk_update import bulk_update
+
+
+class BulkUpdateTest(SimpleTestCase):
+    def bulk_update(self, objs_fields):
+        """SQL of the update instead of its execution, returns (result, (sql, params))"""
+        executed = []
+
+        def update(qs, **kwargs):
+            query = qs.query.clone(sql.UpdateQuery)
+            query.add_update_values(kwargs)
+            executed.append(query.get_compiler(qs.db).as_sql())
+            return len(objs_fields)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            result = bulk_update(Media, objs_fields)
+
+        self.assertLessEqual(len(executed), 1)
+        return result, executed[0] if executed else None
+
+    def test_case_by_field(self):
+        result, (query, params) = self.bulk_update([
+            (Media(id=1, processing_state_code=10, size_bytes=5), ('processing_state_code', 'size_bytes')),
+            (Media(id=2, processing_state_code=20), ('processing_state_code',)),
+        ])
+
+        self.assertEqual(result, 2)
+        self.assertIn('"processing_state_code" = CASE WHEN "storage_media"."id" = %s THEN %s '
+                      'WHEN "storage_media"."id" = %s THEN %s ELSE "storage_media"."processing_state_code" END',
+                      query)
+        self.assertIn('"size_bytes" = CASE WHEN "storage_media"."id" = %s THEN %s '
+                      'ELSE "storage_media"."size_bytes" END', query)
+        self.assertIn('WHERE "storage_media"."id" IN (%s, %s)', query)
+        self.assertEqual(params[:6], (1, 10, 2, 20, 1, 5))
+        self.assertEqual(sorted(params[6:]), [1, 2])
+
+    def test_nothing_to_update(self):
+        self.assertEqual(self.bulk_update([(Media(id=1), ())]), (0, None))
+
+
+class MediaCountersAddTest(SimpleTestCase):
+    def add(self, deltas):
+        """[(sql, params), ...] executed by media_counters.add"""
+        with mock.patch.object(connections[DEFAULT_DB_ALIAS], 'cursor') as get_cursor:
+            media_counters.add(deltas)
+
+        cursor = get_cursor.return_value.__enter__.return_value
+        return [call[0] for call in cursor.execute.call_args_list]
+
+    def test_order(self):
+        june, july = datetime.date(2017, 6, 1), datetime.date(2017, 7, 1)
+
+        executed = self.add({
+            ('month', 2, june): 1,
+            ('category', 1, 3): -1,
+            ('month', 1, july): 1,
+            ('month', 1, june): -1,
+            ('category', 1, 2): 1,
+            ('month', 2, july): 2,
+        })
+
+        self.assertEqual([(query.split()[0], params) for query, params in executed], [
+            # Rows of each table are locked in order of (uploader_id, key), consecutive inserts by one statement
+            ('UPDATE', [-1, 1, june]),
+            ('INSERT', [1, july, 1, 2, june, 1, 2, july, 2]),
+            ('INSERT', [1, 2, 1]),
+            ('UPDATE', [-1, 1, 3]),
+        ])
+        self.assertIn('VALUES (%s, %s, %s), (%s, %s, %s), (%s, %s, %s) ON CONFLICT', executed[1][0])
+
+    def test_nothing_to_add(self):
+        self.assertEqual(self.add({}), [])
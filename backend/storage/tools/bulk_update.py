@@ -0,0 +1,31 @@
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Cast
+
+
+def bulk_update(model, objs_fields):
+    """
+    Update objects with a single `UPDATE ... SET field = CASE WHEN id = ... THEN ... ELSE field END`.
+
+    objs_fields -- [(obj, fields to update), ...], each object could update its own set of fields
+
+    Analogue of QuerySet.bulk_update (Django 2.2+), but calls Field.pre_save like Model.save does,
+    e.g. FileField saves not yet committed files to storage.
+    """
+    whens = {}
+
+    for obj, fields in objs_fields:
+        for name in fields:
+            field = model._meta.get_field(name)
+            value = field.pre_save(obj, add=False)
+            whens.setdefault(field, []).append(When(pk=obj.pk, then=Value(value, output_field=field)))
+
+    if not whens:
+        return 0
+
+    updates = {
+        # PostgreSQL could not guess type of CASE with parameters only => cast it explicitly
+        field.name: Cast(Case(*field_whens, default=F(field.name), output_field=field), output_field=field)
+        for field, field_whens in whens.items()
+    }
+
+    return model.objects.filter(pk__in={obj.pk for obj, fields in objs_fields}).update(**updates)
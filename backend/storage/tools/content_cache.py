@@ -0,0 +1,72 @@
+import functools
+import hashlib
+import logging
+
+from storage.helpers import base85_to_hex
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'content'
+
+_MISSING = object()
+
+
+def cached_by_content(extractor, version):
+    """
+    Cache results of `fn(filename, ...)` by file content, i.e. (sha1, size), extractor name and version.
+
+    Callers provide `content_key=(sha1_b85, size_bytes)`, without it result is not cached.
+    Filename is a part of the key too: results contain it (e.g. SourceFile, File:Directory of exiftool),
+    so the same file of another uploader must not get them.
+    Bump version once extractor output changes -- it invalidates results of this extractor only.
+    Eviction (LRU, memory limit) is up to the cache backend, see CACHES['content'].
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(filename, *args, content_key=None, **kwargs):
+            if not content_key or None in content_key:
+                return fn(filename, *args, **kwargs)
+
+            key = get_key(extractor, filename, content_key, args, kwargs)
+            result = get_cached(key, version)
+
+            if result is _MISSING:
+                result = fn(filename, *args, **kwargs)
+                set_cached(key, version, result)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def get_key(extractor, filename, content_key, args, kwargs):
+    sha1_b85, size_bytes = content_key
+
+    return ':'.join((
+        extractor,
+        # Paths could be long and have any characters, unlike keys of memcached
+        hashlib.sha1(filename.encode()).hexdigest(),
+        base85_to_hex(sha1_b85),
+        str(size_bytes),
+        *(repr(arg) for arg in args),
+        *(f'{k}={v!r}' for k, v in sorted(kwargs.items())),
+    ))
+
+
+def get_cached(key, version):
+    from django.core.cache import caches
+
+    result = caches[CACHE_ALIAS].get(key, _MISSING, version=version)
+
+    if result is not _MISSING:
+        logger.debug(f'Use cached result: {key}')
+
+    return result
+
+
+def set_cached(key, version, result):
+    from django.core.cache import caches
+
+    caches[CACHE_ALIAS].set(key, result, timeout=None, version=version)
@@ -1,34 +1,269 @@
+import atexit
 import logging
+import os
+import queue
 import re
+import selectors
+import threading
+import time
 
 from PIL import Image
 
+from storage.tools.content_cache import cached_by_content
+
 logger = logging.getLogger(__name__)
 
 
-def get_exiftool_info(filename, numeric_values=False):
-    import tempfile
+class ExiftoolProcess:
+    """
+    Long-living `exiftool -stay_open True -@ -` process.
+
+    Every command is written to stdin as one argument per line and terminated by `-execute{N}`,
+    exiftool answers with the command output followed by `{readyN}` on stdout.
+    `-echo4` prints the same marker to stderr, so both streams could be read up to the end of the command.
+    They are read together, so neither of them could fill its pipe buffer and block exiftool.
+
+    See: https://sno.phy.queensu.ca/~phil/exiftool/exiftool_pod.html#stay_open-FLAG
+    """
+    CMD = ("exiftool", "-stay_open", "True", "-@", "-", "-common_args", "-charset", "filename=utf8")
+    READ_SIZE = 64 * 1024
+
+    class ProcessError(RuntimeError):
+        pass
+
+    class ProcessTimeout(ProcessError):
+        pass
+
+    def __init__(self, timeout=None):
+        from subprocess import Popen, PIPE
+
+        self.counter = 0
+        self.timeout = timeout
+        self.process = Popen(self.CMD, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+
+    @property
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def execute(self, *args):
+        """Run exiftool with given arguments, return (stdout, stderr) as bytes"""
+        args = [str(arg) for arg in args]
+
+        # Arguments are split by new line, so it is impossible to pass them as is
+        assert not any('\n' in arg for arg in args), f'New line in exiftool arguments: {args!r}'
+
+        self.counter += 1
+        marker = f'{{ready{self.counter}}}'.encode('utf-8')
+
+        command = args + ['-echo4', marker.decode('utf-8'), f'-execute{self.counter}']
+
+        try:
+            self.process.stdin.write('\n'.join(command).encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+
+            return self.read_until(marker)
+        except self.ProcessTimeout:
+            # Hung one would answer the next command with the rest of this one
+            self.process.kill()
+            self.process.wait()
+            raise
+        except (OSError, ValueError) as ex:
+            raise self.ProcessError(f'exiftool process {self.process.pid} failed: {ex!r}') from ex
+
+    def read_until(self, marker):
+        """Read stdout & stderr up to the marker, whichever exiftool writes to, returns (stdout, stderr)"""
+        marker += b'\n'
+        streams = (self.process.stdout, self.process.stderr)
+        results = {stream: bytearray() for stream in streams}
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+
+        with selectors.DefaultSelector() as selector:
+            for stream in streams:
+                selector.register(stream, selectors.EVENT_READ)
+
+            while selector.get_map():
+                timeout = deadline - time.monotonic() if deadline is not None else None
+
+                if timeout is not None and timeout <= 0:
+                    raise self.ProcessTimeout(f'exiftool process {self.process.pid} did not answer '
+                                              f'in {self.timeout} seconds')
+
+                for key, events in selector.select(timeout):
+                    chunk = os.read(key.fd, self.READ_SIZE)
+
+                    if not chunk:
+                        raise self.ProcessError(f'exiftool process {self.process.pid} exit with code '
+                                                f'{self.process.poll()}')
+
+                    result = results[key.fileobj]
+                    result += chunk
+
+                    if result.endswith(marker):
+                        selector.unregister(key.fileobj)
+
+        return tuple(bytes(results[stream][:-len(marker)]) for stream in streams)
+
+    def close(self):
+        if not self.is_alive:
+            return
+
+        try:
+            self.process.stdin.write(b'-stay_open\nFalse\n')
+            self.process.stdin.flush()
+            self.process.communicate(timeout=5)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+
+
+class ExiftoolPool:
+    """
+    Pool of long-living exiftool processes, one pool per OS process (e.g. Celery worker).
+
+    Processes are started lazily, crashed and hung ones (see ExiftoolProcess.timeout) are replaced by new ones.
+    Pool is re-created after fork -- pipes of parent process must not be shared.
+    """
+    RETRIES = 1
+
+    _pool = None
+    _pid = None
+    _lock = threading.Lock()
+
+    def __init__(self, size, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.semaphore = threading.BoundedSemaphore(size)
+        self.processes = []
+
+    @classmethod
+    def get(cls):
+        from django.conf import settings
+
+        with cls._lock:
+            if cls._pool is None or cls._pid != os.getpid():
+                cls._pool = cls(size=settings.EXIFTOOL_POOL_SIZE, timeout=settings.EXIFTOOL_TIMEOUT_SECONDS)
+                cls._pid = os.getpid()
+                atexit.register(cls._pool.close)
+            return cls._pool
+
+    def acquire(self):
+        self.semaphore.acquire()
+
+        try:
+            process = self.idle.get_nowait()
+        except queue.Empty:
+            process = None
+
+        if process and process.is_alive:
+            return process
+
+        if process:
+            logger.warning(f'exiftool process {process.process.pid} died, start a new one')
+
+        try:
+            process = ExiftoolProcess(timeout=self.timeout)
+        except Exception:
+            self.semaphore.release()
+            raise
+
+        self.processes.append(process)
+        return process
+
+    def release(self, process, broken=False):
+        if broken:
+            process.close()
+            self.processes.remove(process)
+        else:
+            self.idle.put(process)
+
+        self.semaphore.release()
+
+    def execute(self, *args):
+        for attempt in range(self.RETRIES + 1):
+            process = self.acquire()
+
+            try:
+                result = process.execute(*args)
+            except ExiftoolProcess.ProcessError:
+                self.release(process, broken=True)
+
+                if attempt == self.RETRIES:
+                    raise
+
+                logger.warning(f'exiftool process crashed or hung, retry: {args!r}')
+                continue
+
+            self.release(process)
+            return result
+
+    def close(self):
+        for process in self.processes:
+            process.close()
+        self.processes = []
+
+
+def exiftool_execute(*args):
+    return ExiftoolPool.get().execute(*args)
+
+
+# Suffix of keys with numeric (not print-converted) values, the same as exiftool uses for `-TAG#` arguments
+NUMERIC_SUFFIX = '#'
+
+
+@cached_by_content('exiftool', version=1)
+def get_exiftool_info(filename, numeric_values=False, with_numeric_values=False):
+    """
+    Extract metadata as a flat dict {"<group>:<tag>": value}.
+
+    numeric_values -- return numeric values instead of print ones (i.e. `-n`)
+    with_numeric_values -- return print values and, where they differ, numeric ones as "<group>:<tag>#" keys.
+        Uses `-long` output, so both come from a single exiftool call.
+    """
     import json
-    from subprocess import Popen
 
     if numeric_values:
-        cmd = ("exiftool", '-groupNames', '-n', '-json', '-sort', filename)
+        args = ('-groupNames', '-n', '-json', '-sort', filename)
+    elif with_numeric_values:
+        args = ('-groupNames', '-long', '-json', '-sort', filename)
     else:
-        cmd = ("exiftool", '-groupNames', '-json', '-sort', filename)
+        args = ('-groupNames', '-json', '-sort', filename)
+
+    out, err = exiftool_execute(*args)
 
-    with tempfile.TemporaryFile("w+b") as f:
-        # Use file to avoid PIPE's deadlock
-        p = Popen(cmd, stdout=f)
-        p.wait()
+    if not out:
+        raise RuntimeError(f'Command exiftool {" ".join(args)} failed: {err.decode("utf-8", "replace")}')
 
-        f.seek(0)
+    # for some reason ujson gets a segmentation error here, so use standard JSON library
+    # result is 1-item list with a dict
+    result = json.loads(out.decode('utf-8'))[0]
 
-        if p.returncode:
-            raise RuntimeError(f'Command {" ".join(cmd)} exit with code {p.returncode}')
+    if with_numeric_values:
+        return merge_long_values(result)
+    return result
 
-        # for some reason ujson gets a segmentation error here, so use standard JSON library
-        # result is 1-item list with a dict
-        return json.load(f)[0]
+
+def merge_long_values(data):
+    """
+    Convert `-long` output into print values with numeric values alongside.
+
+    >>> merge_long_values({'SourceFile': 'a.jpg', 'EXIF:Orientation': {'desc': 'Orientation', 'id': 274, 'num': 6, 'val': 'Rotate 90 CW'}, 'File:ImageWidth': {'desc': 'Image Width', 'val': 4000}})
+    {'SourceFile': 'a.jpg', 'EXIF:Orientation': 'Rotate 90 CW', 'EXIF:Orientation#': 6, 'File:ImageWidth': 4000}
+    """
+    result = {}
+
+    for key, value in data.items():
+        if not isinstance(value, dict) or 'val' not in value:
+            # e.g. SourceFile
+            result[key] = value
+            continue
+
+        result[key] = value['val']
+
+        if 'num' in value and value['num'] != value['val']:
+            result[key + NUMERIC_SUFFIX] = value['num']
+
+    return result
 
 
 def extract_embed_resource(filename, resource, target=None, hide_log=False):
@@ -48,21 +283,22 @@ def extract_embed_resource(filename, resource, target=None, hide_log=False):
              JpgFromRaw, etc.) from files in directory "dir", adding the tag
              name to the output preview image file names.
     """
-    import os
-    import tempfile
-    from subprocess import Popen
+    import io
 
-    target = target or tempfile.TemporaryFile("w+b")
+    out, err = exiftool_execute("-b", f'-{resource}', filename)
 
-    cmd = ("exiftool", "-b", f'-{resource}', filename)
+    if err and not hide_log:
+        logger.warning(f'exiftool -b -{resource} {filename}: {err.decode("utf-8", "replace")}')
 
-    with open(os.devnull,"wb") as stderr:
-        p = Popen(cmd, stdout=target, stderr=stderr if hide_log else None)
-        p.wait()
+    if target is None:
+        # Output is already in memory, read from exiftool's pipe
+        return io.BytesIO(out)
 
+    # Target could be re-used for multiple resources
+    target.seek(0)
+    target.truncate()
+    target.write(out)
     target.seek(0)
-
-    assert not p.returncode
 
     return target
 
@@ -76,34 +312,56 @@ def list_embed_resources(metadata):
 
 
 def check_if_image(fp):
+    return get_image_size(fp) is not None
+
+
+def get_image_size(fp):
     try:
-        # Do not use Image context manager since it would close fp
-        Image.open(fp)
-        return True
+        # Do not use Image context manager since it would close fp. Only header is read.
+        return Image.open(fp).size
     except OSError:
-        return False
+        return None
     finally:
         fp.seek(0)
 
 
-def extract_any_embed_image(metadata, filename, target=None, hide_log=False, biggest=False):
+def extract_any_embed_image(metadata, filename, target=None, hide_log=False, biggest=False, min_size=None):
+    """
+    Extract embed image, smallest one (by bytes) by default. Returns target or in-memory file if it is not given.
+
+    min_size -- (width, height), use the smallest image which width or height is at least that,
+                e.g. preview instead of full-size JpgFromRaw, or the biggest image if none of them is
+    """
     # Get binary resources
     binary_resources = list_embed_resources(metadata)
 
     # Sort by size
-    binary_resources = sorted(binary_resources.items(), key=lambda x: x[1], reverse=biggest)
+    binary_resources = sorted(binary_resources.items(), key=lambda x: x[1], reverse=biggest and not min_size)
 
     logger.debug(f'Found binary resources: {binary_resources}')
 
+    last_image_resource = None
+
     for resource, size in binary_resources:
         # We could check if name contains "data", e.g. "OriginalDecisionData" but we could simply check for an image
         result = extract_embed_resource(filename=filename, resource=resource, target=target, hide_log=hide_log)
+        image_size = get_image_size(result)
 
-        if not check_if_image(result):
+        if image_size is None:
             logger.info(f'Resource {resource} is not a image')
             continue
 
+        if min_size and image_size[0] < min_size[0] and image_size[1] < min_size[1]:
+            logger.info(f'Resource {resource} is too small: {image_size}')
+            last_image_resource = resource
+            continue
+
         logger.info(f'Used resource {resource} as an image')
         return result
 
+    if last_image_resource:
+        logger.info(f'Used resource {last_image_resource} as the biggest image')
+        return extract_embed_resource(filename=filename, resource=last_image_resource, target=target,
+                                      hide_log=hide_log)
+
     raise ValueError(f'Found no image in resources: {binary_resources}')
@@ -1,45 +1,117 @@
+from storage.tools.content_cache import cached_by_content
+
+
+FFPROBE_CMD = ("ffprobe", "-hide_banner", "-v", "quiet", "-print_format", "json",
+               "-show_error", "-show_format", "-show_streams")
+# ffprobe reads only headers, it takes that long only if it hung, e.g. on a broken network mount
+FFPROBE_TIMEOUT_SECONDS = 300
+
+
+@cached_by_content('ffprobe', version=1)
 def get_ffprobe_info(filename):
-    import tempfile
+    from storage.tools import pipe
+
+    # Error is a part of JSON output
+    with pipe.run((*FFPROBE_CMD, filename), check=False, timeout=FFPROBE_TIMEOUT_SECONDS) as f:
+        return parse_ffprobe_info(f)
+
+
+def parse_ffprobe_info(f):
     import json
-    from subprocess import Popen
 
-    cmd = ("ffprobe", "-hide_banner", "-v", "quiet", "-print_format", "json",
-           "-show_error", "-show_format", "-show_streams", filename)
+    # for some reason ujson gets a segmentation error here, so use standard JSON library
+    # result is 1-item list with a dict
+    result = json.load(f)
 
-    with tempfile.TemporaryFile("w+b") as f:
-        # Use file to avoid PIPE's deadlock
-        p = Popen(cmd, stdout=f)
-        p.wait()
+    if result.get('error'):
+        raise ValueError(f"ffprobe error code={result['error']['code']}: {result['error']['string']}")
+
+    return result
+
+
+def get_screenshot(filename, seconds_offset, hide_log=False, keyframe=False):
+    """
+    JPEG file (in memory unless it is huge), see storage.tools.pipe.run
 
-        f.seek(0)
+    keyframe -- the first keyframe since seconds_offset, like in get_keyframes
+    """
+    from storage.tools import pipe
 
-        # for some reason ujson gets a segmentation error here, so use standard JSON library
-        # result is 1-item list with a dict
-        result = json.load(f)
+    cmd = ("ffmpeg", "-hide_banner", *(("-skip_frame", "nokey") if keyframe else ()), "-ss", seconds_offset,
+           "-i", filename, "-frames:v", 1, "-q:v", 1, "-c:v", "mjpeg", "-f", "image2", "-")
 
-        if result.get('error'):
-            raise ValueError(f"ffprobe error code={result['error']['code']}: {result['error']['string']}")
+    return pipe.run(cmd, hide_log=hide_log)
 
-        return result
 
+def transcode(filename, outputs, filter_complex=None, hide_log=False):
+    """
+    Single ffmpeg process reads (and decodes) the file once and writes all outputs.
 
-def get_screenshot(filename, seconds_offset, hide_log=False, target=None):
+    outputs -- [(path, output options), ...], e.g. [('a.mp4', ('-map', '0:v:0', '-c:v', 'copy')), ...]
+    """
     import os
-    import tempfile
-    from subprocess import Popen
+    from subprocess import Popen, DEVNULL
+
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-y", "-i", filename]
+
+    if filter_complex:
+        cmd += ["-filter_complex", filter_complex]
 
-    target = target or tempfile.TemporaryFile("w+b")
+    for path, options in outputs:
+        cmd += [*options, path]
 
-    cmd = ("ffmpeg", "-hide_banner", "-ss", seconds_offset, "-i", filename, "-frames:v", 1, "-q:v", 1, "-c:v", "mjpeg",
-           "-f", "image2", "-")
-    cmd = (str(c) for c in cmd)
+    cmd = [str(c) for c in cmd]
 
-    with open(os.devnull,"wb") as stderr:
-        p = Popen(cmd, stdout=target, stderr=stderr if hide_log else None)
+    with open(os.devnull, "wb") as stderr:
+        p = Popen(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=stderr if hide_log else None)
         p.wait()
 
-    target.seek(0)
+    if p.returncode:
+        raise ValueError(f'ffmpeg error code={p.returncode}: {" ".join(cmd)}')
+
+
+def get_keyframes(filename, seconds_offsets, width, height, hide_log=False):
+    """
+    The first keyframe since each of offsets as 8-bit grayscale pixels of width x height, None if there is no such.
+
+    Single ffmpeg process seeks to each offset and decodes only keyframes (one per offset),
+    so the cost does not depend on video duration.
+    """
+    import os
+    import tempfile
+    from subprocess import Popen, DEVNULL
+
+    cmd = ["ffmpeg", "-hide_banner", "-nostdin", "-y"]
+
+    for seconds_offset in seconds_offsets:
+        cmd += ["-skip_frame", "nokey", "-ss", seconds_offset, "-i", filename]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, f'{num}.gray') for num in range(len(seconds_offsets))]
+
+        for num, path in enumerate(paths):
+            cmd += ["-map", f"{num}:v:0", "-frames:v", 1, "-vf", f"scale={width}:{height}", "-pix_fmt", "gray",
+                    "-f", "rawvideo", path]
+
+        cmd = [str(c) for c in cmd]
+
+        with open(os.devnull, "wb") as stderr:
+            p = Popen(cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=stderr if hide_log else None)
+            p.wait()
+
+        if p.returncode:
+            raise ValueError(f'ffmpeg error code={p.returncode}: {" ".join(cmd)}')
+
+        keyframes = []
+
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = None
 
-    assert not p.returncode
+            # Offset is after the last keyframe -- nothing was written
+            keyframes.append(data if data and len(data) == width * height else None)
 
-    return target
\ No newline at end of file
+        return keyframes
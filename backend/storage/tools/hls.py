@@ -0,0 +1,98 @@
+"""
+HTTP Live Streaming: video is cut into short fMP4 segments listed by m3u8 playlists,
+so player loads only segments it plays, seeking does not need range requests into a huge file.
+
+Directory of a media: index.m3u8 (master playlist) => {size}.m3u8 (media playlist per rendition)
+=> {size}_init.mp4 + {size}_00000.m4s, {size}_00001.m4s, ...
+ffmpeg older than 3.4 could not write fMP4 segments, then they are MPEG-TS: {size}_00000.ts, ...
+"""
+import functools
+import logging
+import mimetypes
+import os
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE = 'application/vnd.apple.mpegurl'
+MASTER_PLAYLIST_NAME = 'index.m3u8'
+SEGMENT_SECONDS = 6
+
+SEGMENT_FMP4 = 'fmp4'
+SEGMENT_MPEGTS = 'mpegts'
+
+# Protocol version needed by playlists of the segment type, e.g. EXT-X-MAP of fMP4 init segment
+VERSIONS = {
+    SEGMENT_FMP4: 7,
+    SEGMENT_MPEGTS: 3,
+}
+
+MIMETYPES = {
+    '.m3u8': MIMETYPE,
+    '.m4s': 'video/iso.segment',
+    '.ts': 'video/mp2t',
+}
+
+
+def register_mimetypes():
+    """Let mimetypes (e.g. django.views.static.serve) know playlists and segments"""
+    for extension, mimetype in MIMETYPES.items():
+        mimetypes.add_type(mimetype, extension)
+
+
+def get_media_playlist_name(size):
+    return f'{size}.m3u8'
+
+
+@functools.lru_cache(maxsize=None)
+def get_segment_type():
+    """fMP4 if hls muxer of installed ffmpeg supports it (3.4+), otherwise MPEG-TS"""
+    from storage.tools import pipe
+
+    with pipe.run(('ffmpeg', '-hide_banner', '-h', 'muxer=hls'), hide_log=True, check=False) as f:
+        muxer_help = f.read().decode('utf-8', 'replace')
+
+    if 'hls_fmp4_init_filename' in muxer_help:
+        return SEGMENT_FMP4
+
+    logger.warning('ffmpeg could not write fMP4 HLS segments (needs 3.4+), MPEG-TS ones are used')
+    return SEGMENT_MPEGTS
+
+
+def get_segment_options(directory, size, segment_type=SEGMENT_FMP4):
+    """
+    ffmpeg output options (see storage.tools.ffmpeg.transcode) to cut MP4 into segments without re-encoding
+
+    >>> get_segment_options('d', 360, SEGMENT_MPEGTS)[-2:]
+    ('-hls_segment_filename', 'd/360_%05d.ts')
+    """
+    if segment_type == SEGMENT_FMP4:
+        type_options = ('-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', f'{size}_init.mp4')
+        extension = 'm4s'
+    else:
+        # The default of any version
+        type_options = ()
+        extension = 'ts'
+
+    return ('-map', '0', '-c', 'copy', '-f', 'hls', '-hls_time', SEGMENT_SECONDS, '-hls_playlist_type', 'vod',
+            *type_options, '-hls_segment_filename', os.path.join(directory, f'{size}_%05d.{extension}'))
+
+
+def render_master_playlist(variants, version=VERSIONS[SEGMENT_FMP4]):
+    """
+    variants -- [(media playlist name, bits per second, width, height), ...], the first one is played first.
+    Segments of all variants start at the same times (keyframes are forced), so they are independent.
+
+    >>> print(render_master_playlist([('360.m3u8', 800000, 640, 360)]), end='')
+    #EXTM3U
+    #EXT-X-VERSION:7
+    #EXT-X-INDEPENDENT-SEGMENTS
+    #EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+    360.m3u8
+    """
+    lines = ['#EXTM3U', f'#EXT-X-VERSION:{version}', '#EXT-X-INDEPENDENT-SEGMENTS']
+
+    for name, bandwidth, width, height in variants:
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}')
+        lines.append(name)
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,50 @@
+import fcntl
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class HostSemaphore:
+    """
+    At most `size` processes of the host (sharing `directory`) are inside, others wait.
+
+    Slots are lock files, locks are released by OS even if process is killed.
+    """
+    POLL_SECONDS = 5
+
+    def __init__(self, name, size=1, directory=None):
+        import tempfile
+
+        self.name = name
+        self.size = size
+        self.directory = directory or tempfile.gettempdir()
+        self.slot = None
+
+    def __enter__(self):
+        is_waiting = False
+
+        while True:
+            for num in range(self.size):
+                slot = open(os.path.join(self.directory, f'{self.name}.{num}.lock'), 'w')
+
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    slot.close()
+                    continue
+
+                self.slot = slot
+                return self
+
+            if not is_waiting:
+                is_waiting = True
+                logger.info(f'Wait for one of {self.size} {self.name} slots...')
+
+            time.sleep(self.POLL_SECONDS)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Closing the file releases the lock
+        self.slot.close()
+        self.slot = None
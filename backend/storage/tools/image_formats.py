@@ -0,0 +1,149 @@
+"""
+Alternative formats of generated images (thumbnails, renditions): smaller than JPEG, but not supported by all browsers.
+
+They are stored next to JPEG, with the same name but their own extension, e.g. thumbnail/1/2.jpg => thumbnail/1/2.webp.
+URL stays the same (of JPEG), format is picked by Accept header (see storage.views.serve_media).
+"""
+import io
+import mimetypes
+import os
+from collections import namedtuple
+
+from PIL import Image
+from django.core.files.base import ContentFile
+
+ImageFormat = namedtuple('ImageFormat', ['format', 'mimetype', 'extension', 'settings'])
+
+# In order of preference
+FORMATS = (
+    ImageFormat('AVIF', 'image/avif', 'avif', {'quality': 50, 'speed': 6}),
+    ImageFormat('WEBP', 'image/webp', 'webp', {'quality': 80, 'method': 6}),
+)
+
+# Only JPEG variants have alternatives
+SOURCE_EXTENSION = '.jpg'
+
+for image_format in FORMATS:
+    mimetypes.add_type(image_format.mimetype, f'.{image_format.extension}')
+
+
+def get_formats():
+    """Formats enabled in settings and supported by Pillow, e.g. AVIF needs a plugin"""
+    from django.conf import settings
+
+    Image.init()
+    return [f for f in FORMATS if f.format in settings.IMAGE_ALTERNATIVE_FORMATS and f.format in Image.SAVE]
+
+
+def get_alternative_name(name, image_format):
+    """
+    >>> get_alternative_name('thumbnail/1/2.jpg', FORMATS[1])
+    'thumbnail/1/2.webp'
+    """
+    return f'{os.path.splitext(name)[0]}.{image_format.extension}'
+
+
+def encode_alternatives(image):
+    """[(format, file), ...] for all enabled formats"""
+    result = []
+
+    for image_format in get_formats():
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format.format, **image_format.settings)
+        result.append((image_format, ContentFile(buffer.getvalue())))
+
+    return result
+
+
+def replace_file(storage, name, content):
+    """
+    Write content to a temporary file next to `name` and move it in place: previous version is served until
+    the new one is complete, concurrent writers do not see partial files
+    """
+    import tempfile
+
+    path = storage.path(name)
+    directory, basename = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'{basename}.', suffix='.part')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            content.seek(0)
+
+            for chunk in content.chunks():
+                f.write(chunk)
+
+        # mkstemp creates files readable only by owner
+        os.chmod(tmp_path, storage.file_permissions_mode or 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save_with_alternatives(storage, name, content, alternatives=()):
+    """Save JPEG and its alternatives exactly under given name, replacing previous versions"""
+    replace_file(storage, name, content)
+
+    for image_format, alternative_content in alternatives:
+        replace_file(storage, get_alternative_name(name, image_format), alternative_content)
+
+    return name
+
+
+def get_accepted_mimetypes(accept):
+    """
+    Media types of Accept header, except ones with q=0 (not acceptable)
+
+    >>> sorted(get_accepted_mimetypes('image/webp;q=0, image/avif; q=0.8, */*'))
+    ['*/*', 'image/avif']
+    """
+    accepted = set()
+
+    for media_range in accept.split(','):
+        mimetype, *params = media_range.split(';')
+        quality = 1
+
+        for param in params:
+            key, _, value = param.partition('=')
+
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+
+        if quality > 0:
+            accepted.add(mimetype.strip().lower())
+
+    return accepted
+
+
+def get_accepted_name(name, accept, exists):
+    """
+    Name of the best alternative accepted by browser, if it exists, or the name itself
+
+    >>> get_accepted_name('a/1.jpg', 'image/avif,image/webp,*/*', lambda name: name.endswith('webp'))
+    'a/1.webp'
+    >>> get_accepted_name('a/1.jpg', 'image/png,*/*', lambda name: True)
+    'a/1.jpg'
+    >>> get_accepted_name('a/1.jpg', 'image/webp;q=0,*/*', lambda name: True)
+    'a/1.jpg'
+    """
+    if not name.endswith(SOURCE_EXTENSION):
+        return name
+
+    accepted = get_accepted_mimetypes(accept)
+
+    for image_format in FORMATS:
+        if image_format.mimetype not in accepted:
+            continue
+
+        alternative_name = get_alternative_name(name, image_format)
+
+        if exists(alternative_name):
+            return alternative_name
+
+    return name
@@ -0,0 +1,8 @@
+from storage.tools.content_cache import cached_by_content
+
+
+@cached_by_content('libmagic', version=1)
+def get_mimetype(filename):
+    import magic
+
+    return magic.from_file(filename, mime=True)
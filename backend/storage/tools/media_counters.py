@@ -0,0 +1,137 @@
+"""
+Numbers of uploader's media by month of show_at and by category (storage.models.MediaMonthCounter,
+MediaCategoryCounter): catalog reads O(months + categories) rows instead of counting all media.
+
+They are changed by deltas in the same transaction as media (see `get_deltas` and `add`),
+`manage.py rebuild_counters` recomputes them from media.
+"""
+import datetime
+import itertools
+from collections import Counter
+
+# Media fields counters depend on
+FIELDS = ('show_at', 'categories')
+
+
+def get_month(show_at):
+    """The first day of the month in the current time zone, like TruncMonth"""
+    from django.utils import timezone
+
+    show_at = timezone.localtime(show_at)
+    return datetime.date(show_at.year, show_at.month, 1)
+
+
+def get_state(media):
+    """What media is counted by: (show_at, categories)"""
+    return media.show_at, tuple(media.categories or ())
+
+
+def get_deltas(uploader_id, old_state=None, new_state=None):
+    """
+    Changes of counters once media was changed from old state to new one (None -- no media), see get_state:
+    {(model name, uploader_id, key): delta}
+
+    >>> import pytz
+    >>> june, july = datetime.datetime(2017, 6, 2, tzinfo=pytz.utc), datetime.datetime(2017, 7, 2, tzinfo=pytz.utc)
+    >>> sorted(get_deltas(1, (june, (1,)), (july, (1, 2))).items())
+    [(('category', 1, 2), 1), (('month', 1, datetime.date(2017, 6, 1)), -1), (('month', 1, datetime.date(2017, 7, 1)), 1)]
+    """
+    deltas = Counter()
+
+    for state, sign in ((old_state, -1), (new_state, 1)):
+        if state is None:
+            continue
+
+        show_at, categories = state
+
+        if show_at is not None:
+            deltas[('month', uploader_id, get_month(show_at))] += sign
+
+        for category in set(categories):
+            deltas[('category', uploader_id, category)] += sign
+
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def get_models():
+    from storage.models import MediaCategoryCounter, MediaMonthCounter
+
+    return {
+        'month': (MediaMonthCounter, 'month'),
+        'category': (MediaCategoryCounter, 'category'),
+    }
+
+
+def add(deltas):
+    """
+    Apply deltas (see get_deltas): counters of each kind are changed in order of (uploader_id, key),
+    consecutive positive deltas by a single statement.
+
+    Missing counters are inserted for positive deltas only. Negative ones just update existing rows,
+    so deletion of media along with their uploader does not insert counters of the deleted user.
+    """
+    from django.db import connection
+
+    if not deltas:
+        return
+
+    with connection.cursor() as cursor:
+        for name, (model, column) in get_models().items():
+            table = model._meta.db_table
+            # Rows are locked in the same order by concurrent transactions, so they wait instead of a deadlock
+            rows = sorted((uploader_id, key, delta) for (kind, uploader_id, key), delta in deltas.items() if kind == name)
+
+            for positive, group in itertools.groupby(rows, key=lambda row: row[2] > 0):
+                group = list(group)
+
+                if positive:
+                    cursor.execute(
+                        f'INSERT INTO {table} (uploader_id, {column}, num) '
+                        f'VALUES {", ".join(["(%s, %s, %s)"] * len(group))} '
+                        f'ON CONFLICT (uploader_id, {column}) DO UPDATE SET num = {table}.num + EXCLUDED.num',
+                        [value for row in group for value in row])
+                else:
+                    for uploader_id, key, delta in group:
+                        cursor.execute(f'UPDATE {table} SET num = num + %s WHERE uploader_id = %s AND {column} = %s',
+                                       [delta, uploader_id, key])
+
+
+def rebuild(uploader_ids=None):
+    """Recompute counters of given uploaders (all if None) from media"""
+    from django.db import connection, transaction
+    from django.db.models import Count
+    from django.db.models.functions import TruncMonth
+    from storage.models import Media, MediaCategoryCounter, MediaMonthCounter
+
+    media = Media.objects.all()
+    month_counters = MediaMonthCounter.objects.all()
+    category_counters = MediaCategoryCounter.objects.all()
+
+    if uploader_ids is not None:
+        media = media.filter(uploader_id__in=uploader_ids)
+        month_counters = month_counters.filter(uploader_id__in=uploader_ids)
+        category_counters = category_counters.filter(uploader_id__in=uploader_ids)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Media saved meanwhile wait to change counters till they are recomputed, none of deltas is lost
+            cursor.execute(f'LOCK TABLE {MediaMonthCounter._meta.db_table}, {MediaCategoryCounter._meta.db_table} '
+                           f'IN EXCLUSIVE MODE')
+
+        month_counters.delete()
+        category_counters.delete()
+
+        months = (media.exclude(show_at=None).annotate(month=TruncMonth('show_at'))
+                  .values_list('uploader_id', 'month').order_by().annotate(Count('id')))
+        MediaMonthCounter.objects.bulk_create([
+            MediaMonthCounter(uploader_id=uploader_id, month=month.date(), num=num)
+            for uploader_id, month, num in months
+        ])
+
+        for category, name in Media.CATEGORIES:
+            categories = (media.filter(categories__contains=[category])
+                          .values_list('uploader_id').order_by().annotate(Count('id')))
+            MediaCategoryCounter.objects.bulk_create([
+                MediaCategoryCounter(uploader_id=uploader_id, category=category, num=num)
+                for uploader_id, num in categories
+            ])
@@ -0,0 +1,49 @@
+"""
+When media of an uploader were changed the last time, kept only in cache: catalog validates its responses
+(ETag, Last-Modified) without queries.
+
+It is per uploader, not per month: media move between months once show_at is extracted.
+"""
+import datetime
+import time
+
+KEY_TMPL = 'media_version:{uploader_id}'
+
+
+def get_cache():
+    from django.core.cache import caches
+
+    return caches['default']
+
+
+def get_modified_at(uploader_id):
+    """Timestamp of the last change. Unknown one (e.g. evicted) is now: responses made before are not valid."""
+    cache = get_cache()
+    key = KEY_TMPL.format(uploader_id=uploader_id)
+
+    modified_at = cache.get(key)
+
+    if modified_at is None:
+        cache.add(key, time.time(), timeout=None)
+        modified_at = cache.get(key)
+
+    return modified_at
+
+
+def get_last_modified(uploader_id):
+    return datetime.datetime.fromtimestamp(get_modified_at(uploader_id), tz=datetime.timezone.utc)
+
+
+def touch(uploader_ids):
+    """Mark media of uploaders as changed, once the current transaction (if any) is committed"""
+    from django.db import transaction
+
+    uploader_ids = set(uploader_ids)
+
+    def inner():
+        now = time.time()
+        get_cache().set_many({KEY_TMPL.format(uploader_id=uploader_id): now for uploader_id in uploader_ids},
+                             timeout=None)
+
+    # Otherwise a request made meanwhile could get the previous state under the new version
+    transaction.on_commit(inner)
@@ -0,0 +1,64 @@
+"""
+Run external tools reading their output from a pipe: small output stays in memory, big one is spilled to disk.
+"""
+import os
+import tempfile
+import threading
+
+# Output bigger than that is moved from memory into a temporary file
+MAX_MEMORY_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def run(cmd, hide_log=False, check=True, max_memory_size=MAX_MEMORY_SIZE, timeout=None):
+    """
+    Run command and return its stdout as a file (SpooledTemporaryFile) at position 0.
+
+    Only stdout is a pipe, stderr goes to log (or nowhere if hide_log), so reading stdout up to the end
+    could not deadlock. check -- raise ValueError if the command failed.
+    timeout -- seconds, then the process is killed and TimeoutError is raised.
+    """
+    from subprocess import Popen, PIPE, DEVNULL
+
+    cmd = [str(c) for c in cmd]
+    output = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+
+    process = Popen(cmd, stdin=DEVNULL, stdout=PIPE, stderr=DEVNULL if hide_log else None)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    # Reading blocks till the process exits, so it is killed by another thread
+    timer = threading.Timer(timeout, kill) if timeout else None
+
+    if timer:
+        timer.start()
+
+    try:
+        fd = process.stdout.fileno()
+
+        for chunk in iter(lambda: os.read(fd, READ_SIZE), b''):
+            output.write(chunk)
+    except Exception:
+        output.close()
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        process.wait()
+
+        if timer:
+            timer.cancel()
+
+    if timed_out.is_set():
+        output.close()
+        raise TimeoutError(f'{cmd[0]} did not finish in {timeout} seconds: {" ".join(cmd)}')
+
+    if check and process.returncode:
+        output.close()
+        raise ValueError(f'{cmd[0]} error code={process.returncode}: {" ".join(cmd)}')
+
+    output.seek(0)
+    return output
@@ -0,0 +1,191 @@
+"""
+Plans and latency of catalog queries on a synthetic table shaped like storage_media, see benchmark_* commands.
+
+Table is temporary, so it is dropped with the connection and never touches real media.
+"""
+import json
+import statistics
+
+from storage.const import MediaConstMixin
+
+# Share of media in category
+CATEGORY_SHARES = {
+    MediaConstMixin.CATEGORY_IMAGE: 0.85,
+    MediaConstMixin.CATEGORY_SELFIE: 0.05,
+    MediaConstMixin.CATEGORY_PANORAMA: 0.01,
+    MediaConstMixin.CATEGORY_SCREENSHOT: 0.03,
+    MediaConstMixin.CATEGORY_VIDEO: 0.12,
+    MediaConstMixin.CATEGORY_VIDEO_INTERVAL: 0.002,
+    MediaConstMixin.CATEGORY_VIDEO_SLOMO: 0.005,
+    MediaConstMixin.CATEGORY_BURST: 0.1,
+    MediaConstMixin.CATEGORY_MEDIA_PORTRAIT: 0.3,
+    MediaConstMixin.CATEGORY_MEDIA_LANDSCAPE: 0.65,
+    MediaConstMixin.CATEGORY_NON_MEDIA: 0.02,
+}
+
+
+# Share of media whose processing failed / is not finished yet, others are in the last state
+FAILED_SHARE = 0.01
+UNFINISHED_SHARE = 0.005
+# Share of media with shot_at, it is show_at up to seconds: media of a burst share it
+SHOT_AT_SHARE = 0.9
+
+# The same indexes as storage.models.Media has, by migrations; {table} is formatted
+INDEXES = (
+    # Foreign key
+    'CREATE INDEX {table}_uploader ON {table} (uploader_id)',
+    'CREATE INDEX {table}_uploader_categories_gin ON {table} USING gin (uploader_id, categories)',
+    'CREATE INDEX {table}_uploader_show_at_id ON {table} (uploader_id, show_at, id)',
+    'CREATE INDEX {table}_uploader_shot_at ON {table} (uploader_id, shot_at)',
+    'CREATE INDEX {table}_unfinished_state ON {table} (processing_state_code, id) WHERE processing_state_code < 30',
+)
+
+
+def create_table(cursor, table, rows=1000000, uploaders=100, years=10, seed=0.5):
+    """
+    Media of `uploaders` users evenly, shown during the last `years`, in categories by CATEGORY_SHARES.
+    Only primary key is indexed.
+    """
+    from processing.states import ProcessingState
+
+    categories = ', '.join(f'CASE WHEN random() < {share} THEN {category} END'
+                           for category, share in CATEGORY_SHARES.items())
+    codes = [state.code for state in ProcessingState.STATES]
+
+    cursor.execute('SELECT setseed(%s)', [seed])
+    cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {table} AS
+        SELECT
+            id,
+            uploader_id,
+            show_at,
+            CASE WHEN random() < {SHOT_AT_SHARE} THEN date_trunc('second', show_at) END AS shot_at,
+            CASE
+                -- negative code of any state but the initial one
+                WHEN state < {FAILED_SHARE}
+                    THEN -(%(codes)s::integer[])[2 + floor(random() * %(num)s)::integer]
+                -- any state but the last one
+                WHEN state < {FAILED_SHARE + UNFINISHED_SHARE}
+                    THEN (%(codes)s::integer[])[1 + floor(random() * %(num)s)::integer]
+                ELSE %(last)s
+            END AS processing_state_code,
+            categories
+        FROM (
+            SELECT
+                id,
+                1 + floor(random() * {uploaders})::integer AS uploader_id,
+                now() - random() * interval '{years * 365} days' AS show_at,
+                random() AS state,
+                array_remove(ARRAY[{categories}], NULL)::integer[] AS categories
+            FROM generate_series(1, %(rows)s) AS id
+        ) AS media
+    """, {'codes': codes, 'num': len(codes) - 1, 'last': codes[-1], 'rows': rows})
+    cursor.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+
+
+def create_indexes(cursor, table):
+    for sql in INDEXES:
+        cursor.execute(sql.format(table=table))
+
+
+def analyze(cursor, table):
+    cursor.execute(f'ANALYZE {table}')
+
+
+def get_nodes(plan):
+    """
+    Node types of the plan, with indexes they scan
+
+    >>> get_nodes({'Node Type': 'Limit', 'Plans': [{'Node Type': 'Index Scan', 'Index Name': 'a'}]})
+    ['Limit', 'Index Scan a']
+    """
+    node = plan['Node Type'] + (f' {plan["Index Name"]}' if plan.get('Index Name') else '')
+    return [node] + [node for sub_plan in plan.get('Plans', ()) for node in get_nodes(sub_plan)]
+
+
+def measure(cursor, sql, params=None, repeat=5):
+    """
+    EXPLAIN ANALYZE the query `repeat` times (the first one warms up the cache and is not counted):
+    {'cost': planner's total cost, 'ms': median execution time, 'nodes': [...]}
+    """
+    timings = []
+    plan = None
+
+    for num in range(repeat + 1):
+        cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}', params)
+        result = cursor.fetchone()[0]
+        # Parsed by psycopg2 once it is of json type
+        plan = (result if isinstance(result, list) else json.loads(result))[0]
+
+        if num:
+            timings.append(plan['Execution Time'])
+
+    return {
+        'cost': plan['Plan']['Total Cost'],
+        'ms': statistics.median(timings),
+        'nodes': get_nodes(plan['Plan']),
+    }
+
+
+def format_result(name, result):
+    return f'{name:<40} cost {result["cost"]:>12.1f} {result["ms"]:>10.2f} ms  {" > ".join(result["nodes"])}'
+
+
+# Access paths of the application: (name, SQL with {table}, params), as queries are made by Django
+QUERIES = (
+    # catalog.views.images_for_month
+    ('month: first page',
+     "SELECT * FROM {table} WHERE uploader_id = 1 AND show_at >= date_trunc('month', now() - interval '1 year') "
+     "AND show_at < date_trunc('month', now() - interval '11 months') ORDER BY show_at, id LIMIT 501", []),
+    ('month: next page',
+     "SELECT * FROM {table} WHERE uploader_id = 1 AND show_at >= date_trunc('month', now() - interval '1 year') "
+     "AND show_at < date_trunc('month', now() - interval '11 months') "
+     "AND (show_at > date_trunc('month', now() - interval '1 year') + interval '15 days' "
+     "OR (show_at = date_trunc('month', now() - interval '1 year') + interval '15 days' AND id > 0)) "
+     "ORDER BY show_at, id LIMIT 501", []),
+    # catalog.rest_views.MediaFilter
+    ('api: any-of categories + year',
+     "SELECT * FROM {table} WHERE uploader_id = 1 AND show_at >= date_trunc('year', now()) "
+     "AND show_at < date_trunc('year', now()) + interval '1 year' AND categories && %s ORDER BY show_at LIMIT 100",
+     [[2, 3]]),
+    ('api: all-of categories',
+     "SELECT * FROM {table} WHERE uploader_id = 1 AND categories @> %s ORDER BY show_at LIMIT 100", [[1, 21]]),
+    # processing.groups.by_shot_at.GroupMediaByShotAt
+    ('groups: media of the same shot',
+     "SELECT * FROM {table} WHERE uploader_id = 1 "
+     "AND shot_at = (SELECT shot_at FROM {table} WHERE uploader_id = 1 AND shot_at IS NOT NULL LIMIT 1)", []),
+    # reprocess --failed
+    ('reprocess: failed media', "SELECT id FROM {table} WHERE processing_state_code < 0 ORDER BY id", []),
+    ('reprocess: count of failed', "SELECT count(*) FROM {table} WHERE processing_state_code < 0", []),
+)
+
+
+def run_queries(cursor, table, queries=QUERIES, repeat=5):
+    """{name: result of measure}"""
+    return {name: measure(cursor, sql.format(table=table), params, repeat=repeat) for name, sql, params in queries}
+
+
+def compare(results, baseline, max_slowdown=1.2):
+    """
+    Lines of regressions: slower than baseline by more than `max_slowdown` times or another plan
+
+    >>> before = {'a': {'ms': 1.0, 'cost': 1, 'nodes': ['Index Scan i']}}
+    >>> compare({'a': {'ms': 3.0, 'cost': 1, 'nodes': ['Seq Scan']}}, before)
+    ['a: 1.00 => 3.00 ms', 'a: plan Index Scan i => Seq Scan']
+    """
+    regressions = []
+
+    for name, result in results.items():
+        before = baseline.get(name)
+
+        if not before:
+            continue
+
+        if result['ms'] > before['ms'] * max_slowdown:
+            regressions.append(f'{name}: {before["ms"]:.2f} => {result["ms"]:.2f} ms')
+
+        if result['nodes'] != before['nodes']:
+            regressions.append(f'{name}: plan {" > ".join(before["nodes"])} => {" > ".join(result["nodes"])}')
+
+    return regressions
@@ -0,0 +1,23 @@
+import os
+
+from django.utils.cache import patch_vary_headers
+from django.views.static import serve
+
+from storage.tools import hls
+from storage.tools.image_formats import SOURCE_EXTENSION, get_accepted_name
+
+hls.register_mimetypes()
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve, but generated images are served in the best format browser accepts"""
+    accepted_path = get_accepted_name(path, request.META.get('HTTP_ACCEPT', ''),
+                                      exists=lambda name: os.path.exists(os.path.join(document_root, name)))
+
+    response = serve(request, accepted_path, document_root=document_root, show_indexes=show_indexes)
+
+    if path.endswith(SOURCE_EXTENSION):
+        # Caches must not give WebP to browser that does not support it
+        patch_vary_headers(response, ('Accept',))
+
+    return response
@@ -0,0 +1,285 @@
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple, OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+RE_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+# SHA1 of the content received so far in order: [0, offset)
+HashState = namedtuple('HashState', ['sha1', 'offset'])
+
+
+class UploadError(ValueError):
+    pass
+
+
+def parse_content_range(value):
+    """
+    Returns [start, end) and total size (if known) of the chunk
+
+    >>> parse_content_range('bytes 0-1023/4096')
+    (0, 1024, 4096)
+    >>> parse_content_range('bytes 1024-1024/*')
+    (1024, 1025, None)
+    >>> parse_content_range('bytes 10-5/20')
+    Traceback (most recent call last):
+    ...
+    upload.chunked.UploadError: Invalid Content-Range: 'bytes 10-5/20'
+    """
+    match = RE_CONTENT_RANGE.search(value or '')
+
+    if not match or int(match.group(1)) > int(match.group(2)):
+        raise UploadError(f'Invalid Content-Range: {value!r}')
+
+    total = match.group(3)
+
+    return int(match.group(1)), int(match.group(2)) + 1, None if total == '*' else int(total)
+
+
+def merge_ranges(ranges, start, end):
+    """
+    Add [start, end) to sorted, not overlapping ranges
+
+    >>> merge_ranges([], 0, 10)
+    [[0, 10]]
+    >>> merge_ranges([[0, 10], [20, 30]], 10, 20)
+    [[0, 30]]
+    >>> merge_ranges([[0, 10], [20, 30]], 12, 15)
+    [[0, 10], [12, 15], [20, 30]]
+    >>> merge_ranges([[5, 10]], 0, 7)
+    [[0, 10]]
+    """
+    merged = []
+
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+
+    return merged
+
+
+def preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as ex:
+        if ex.errno == errno.ENOSPC:
+            raise
+        # Not supported by file system (or size is 0) -- at least make a sparse file of the proper size
+        os.ftruncate(fd, size)
+
+
+class ChunkedUpload:
+    """
+    Upload of a single (huge) file by chunks, chunks could come in any order, be re-sent or resumed later.
+
+    Content is written by positional writes into a preallocated file `upload/<uploader_id>/<upload_id>.part`
+    under MEDIA_ROOT, so a finished upload is moved to its place without copying.
+    Metadata (see upload.forms.UploadMetadataForm) and received ranges are in JSON file next to it.
+    """
+    DIRECTORY = 'upload'
+    READ_CHUNK_SIZE = 1 << 20
+
+    # Running hashes by upload, advanced by chunks coming in order to this process.
+    # hashlib could not be serialized => on finish the rest of content is read from disk.
+    # {name: (HashState, time.monotonic() when put)}, the least recently put first: uploads finished by another
+    # process or abandoned are evicted after CHUNKED_UPLOAD_EXPIRE_SECONDS.
+    HASHES = OrderedDict()
+    HASHES_LOCK = threading.Lock()
+
+    def __init__(self, uploader_id, upload_id):
+        self.upload_id = upload_id
+        self.name = f'{self.DIRECTORY}/{uploader_id}/{upload_id}'
+        self.content_name = f'{self.name}.part'
+        self.content_path = default_storage.path(self.content_name)
+        self.state_path = default_storage.path(f'{self.name}.json')
+
+    @classmethod
+    def create(cls, uploader_id, metadata=None, size=None):
+        upload = cls(uploader_id, uuid.uuid4().hex)
+
+        os.makedirs(os.path.dirname(upload.content_path), exist_ok=True)
+
+        fd = os.open(upload.content_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            preallocate(fd, size)
+        finally:
+            os.close(fd)
+
+        with open(upload.state_path, 'x') as f:
+            json.dump({'metadata': metadata, 'size': size, 'ranges': []}, f)
+
+        logger.info(f'Created chunked upload {upload.name} of {size} bytes')
+        return upload
+
+    def exists(self):
+        return os.path.exists(self.state_path) and os.path.exists(self.content_path)
+
+    def get_state(self):
+        with open(self.state_path) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return json.load(f)
+
+    def add_range(self, start, end):
+        with open(self.state_path, 'r+') as f:
+            # Chunks are written in parallel, but state is updated one by one
+            fcntl.flock(f, fcntl.LOCK_EX)
+            state = json.load(f)
+            state['ranges'] = merge_ranges(state['ranges'], start, end)
+
+            f.seek(0)
+            f.truncate()
+            json.dump(state, f)
+
+        return state
+
+    def write(self, start, end, stream):
+        """Write content from stream at [start, end), returns state with received ranges"""
+        hash_state = self.take_hash_state(start)
+        offset = start
+
+        fd = os.open(self.content_path, os.O_WRONLY)
+        try:
+            while offset < end:
+                data = stream.read(min(self.READ_CHUNK_SIZE, end - offset))
+
+                if not data:
+                    break
+
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, offset)
+                    view = view[written:]
+                    offset += written
+
+                if hash_state:
+                    hash_state.sha1.update(data)
+        finally:
+            os.close(fd)
+
+            if hash_state:
+                self.put_hash_state(HashState(hash_state.sha1, offset))
+
+        # Keep what was received even if connection was broken
+        state = self.add_range(start, offset) if offset > start else self.get_state()
+
+        if offset < end:
+            raise UploadError(f'Got {offset - start} bytes instead of {end - start}')
+
+        return state
+
+    def take_hash_state(self, offset):
+        """Running hash which could be continued by content from offset, it is taken to not be updated twice"""
+        with self.HASHES_LOCK:
+            hash_state, put_at = self.HASHES.get(self.name, (None, None))
+
+            if hash_state and (offset is None or hash_state.offset == offset):
+                del self.HASHES[self.name]
+                return hash_state
+
+        if hash_state is None and offset == 0:
+            return HashState(hashlib.sha1(), 0)
+
+    def put_hash_state(self, hash_state):
+        now = time.monotonic()
+
+        with self.HASHES_LOCK:
+            current, put_at = self.HASHES.get(self.name, (None, None))
+
+            if current is None or current.offset < hash_state.offset:
+                self.HASHES[self.name] = (hash_state, now)
+                self.HASHES.move_to_end(self.name)
+
+            self.evict_hash_states(expire_before=now - settings.CHUNKED_UPLOAD_EXPIRE_SECONDS)
+
+    @classmethod
+    def evict_hash_states(cls, expire_before=None):
+        """Must be called under HASHES_LOCK"""
+        while cls.HASHES:
+            name, (hash_state, put_at) = next(iter(cls.HASHES.items()))
+
+            if put_at >= expire_before:
+                break
+
+            del cls.HASHES[name]
+
+    def get_sha1_hex(self):
+        """Continue running hash by content that was not hashed yet (came out of order or to another process)"""
+        sha1, offset = self.take_hash_state(None) or HashState(hashlib.sha1(), 0)
+
+        if offset:
+            logger.info(f'{self.name}: {offset} bytes are hashed on the fly')
+
+        with open(self.content_path, 'rb') as f:
+            f.seek(offset)
+            for data in iter(lambda: f.read(self.READ_CHUNK_SIZE), b''):
+                sha1.update(data)
+
+        return sha1.hexdigest()
+
+    def finish(self, size=None, sha1_hex=None):
+        """Check that all content is received and matches expected size & hash"""
+        state = self.get_state()
+
+        if state['ranges'] != ([[0, size]] if size else []):
+            raise UploadError(f'Not all content is received: {state["ranges"]}')
+
+        actual_sha1 = self.get_sha1_hex()
+
+        if actual_sha1 != sha1_hex:
+            raise UploadError(f'File content does not match hash provided: {actual_sha1!r} != {sha1_hex!r}')
+
+    def move(self, new_name):
+        """Move content to its permanent place (relative to MEDIA_ROOT), upload is gone after that"""
+        from storage.models import Media
+
+        Media.move_file(storage=default_storage, old_name=self.content_name, new_name=new_name)
+        self.delete()
+
+    def delete(self):
+        with self.HASHES_LOCK:
+            self.HASHES.pop(self.name, None)
+
+        for path in (self.content_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def sweep_expired(cls, expire_seconds=None):
+        """Remove uploads that were not touched for a while, returns number of them"""
+        root = default_storage.path(cls.DIRECTORY)
+        expire_before = time.time() - expire_seconds
+        num = 0
+
+        if not os.path.isdir(root):
+            return num
+
+        for uploader_id in os.listdir(root):
+            touched_at = {}
+
+            for entry in os.scandir(os.path.join(root, uploader_id)):
+                upload_id = entry.name.split('.', 1)[0]
+                touched_at[upload_id] = max(touched_at.get(upload_id, 0), entry.stat().st_mtime)
+
+            for upload_id, mtime in touched_at.items():
+                if mtime < expire_before:
+                    logger.info(f'Remove expired chunked upload {cls.DIRECTORY}/{uploader_id}/{upload_id}')
+                    cls(uploader_id, upload_id).delete()
+                    num += 1
+
+        return num
@@ -20,14 +20,14 @@ def validate_hex(value):
                               params={'value': value})
 
 
-class UploadForm(forms.Form):
+class UploadMetadataForm(forms.Form):
+    """Description of uploaded file, without its content (see upload.chunked)"""
     session_id = forms.UUIDField()
     sha1 = forms.CharField(min_length=40, max_length=40, validators=[validate_hex])
     size = forms.IntegerField(min_value=0)
     last_modified = forms.IntegerField(min_value=0)
     name = forms.CharField(max_length=255)
     type = forms.CharField(max_length=127, required=False)
-    file = forms.FileField()
 
     FIELDS_MAPPING = {
         'last_modified': 'source_lastmodified',
@@ -45,20 +45,24 @@ class UploadForm(forms.Form):
     def clean_name(self):
         return os.path.basename(self.cleaned_data['name'])
 
+    @property
+    def model_data(self):
+        return map_dict(self.cleaned_data, self.FIELDS_MAPPING)
+
+
+class UploadForm(UploadMetadataForm):
+    file = forms.FileField()
+
     def clean(self):
         cleaned_data = super().clean()
 
         uploaded_file = cleaned_data['file']
 
         try:
-            # duck-typing
-            uploaded_file_path = uploaded_file.temporary_file_path()
+            # Calculated during upload, see upload.handlers
+            actual_sha1 = uploaded_file.sha1_hex
         except AttributeError:
-            # File is in memory -- calculate SHA1 via Python
-            actual_sha1 = hashlib.sha1(uploaded_file.read()).hexdigest()
-        else:
-            # File is in file system -- calculate SHA1 via binary tool
-            actual_sha1 = get_sha1_hex(uploaded_file_path)
+            actual_sha1 = self.get_sha1_hex(uploaded_file)
 
         if actual_sha1 != cleaned_data['sha1']:
             raise ValidationError({
@@ -74,6 +78,15 @@ class UploadForm(forms.Form):
 
         return cleaned_data
 
-    @property
-    def model_data(self):
-        return map_dict(self.cleaned_data, self.FIELDS_MAPPING)
+    @staticmethod
+    def get_sha1_hex(uploaded_file):
+        """Fallback for files uploaded without SHA1 upload handlers, reads the file once again"""
+        try:
+            # duck-typing
+            uploaded_file_path = uploaded_file.temporary_file_path()
+        except AttributeError:
+            # File is in memory -- calculate SHA1 via Python
+            return hashlib.sha1(uploaded_file.read()).hexdigest()
+        else:
+            # File is in file system -- calculate SHA1 via binary tool
+            return get_sha1_hex(uploaded_file_path)
@@ -0,0 +1,38 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class SHA1UploadHandlerMixin:
+    """Calculate SHA1 while receiving the file, so its content is not read again. Result is in `file.sha1_hex`."""
+
+    def new_file(self, *args, **kwargs):
+        # Before parent call since it could raise StopFutureHandlers
+        self.sha1 = hashlib.sha1()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.is_storing():
+            self.sha1.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+
+        if file is not None:
+            file.sha1_hex = self.sha1.hexdigest()
+
+        return file
+
+    def is_storing(self):
+        return True
+
+
+class SHA1MemoryFileUploadHandler(SHA1UploadHandlerMixin, MemoryFileUploadHandler):
+    def is_storing(self):
+        # Big files are passed to the next handler
+        return self.activated
+
+
+class SHA1TemporaryFileUploadHandler(SHA1UploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
@@ -17,6 +17,10 @@ let UPLOAD_DIV;
 const LOAD_RETRIES_NUM = 5;
 const LOAD_RETRIES_BASE = 2;
 
+// Files bigger than that are uploaded by chunks, which could be re-sent (see upload.chunked)
+const CHUNKED_UPLOAD_MIN_SIZE = 64 * 1024 * 1024;
+const CHUNKED_UPLOAD_CHUNK_SIZE = 16 * 1024 * 1024;
+
 // How often we could re-sort
 const UPLOAD_SORT_DELAY_MS = 500;
 
@@ -585,6 +589,28 @@ function upload_file(file) {
     let progress_div = document.getElementById('currently_uploading');
     progress_div.appendChild(renderUploadProgress(file));
 
+    if(file.file.size >= CHUNKED_UPLOAD_MIN_SIZE) {
+        return upload_file_chunked(file);
+    }
+
+    let data = get_upload_form_data(file);
+    data.set('file', file.file);
+
+    return fetch_w_progress('/upload/file/', {
+        method: 'POST',
+        credentials: 'same-origin',
+        body: data,
+        headers: {'X-CSRFToken': getCookie('csrftoken')}
+    }, function(e){
+        update_progress(file, e);
+    }).then(parse_upload_response).then(function(json){
+        file.media = json.media;
+        console.log('Uploaded file', file);
+        return file;
+    });
+}
+
+function get_upload_form_data(file) {
     let data = new FormData();
     data.set('session_id', UPLOAD_SESSION_ID);
     data.set('name', file.file.name);
@@ -592,30 +618,85 @@ function upload_file(file) {
     data.set('type', file.file.type);
     data.set('last_modified', file.file.lastModified);
     data.set('sha1', file.sha1);
-    data.set('file', file.file);
+    return data;
+}
 
-    return fetch_w_progress('/upload/file/', {
+function parse_upload_response(response) {
+    // Extract error from JSON response first
+    return response.json().then(function(json){
+        if(json.error) {
+            throw Error(JSON.stringify(json.error));
+        } else if(!response.ok) {
+            throw Error('Failed to upload');
+        }
+        return json;
+    }, function(){
+        throw Error('Failed to upload');
+    });
+}
+
+function upload_file_chunked(file) {
+    return fetch('/upload/chunked/', {
         method: 'POST',
         credentials: 'same-origin',
-        body: data,
+        body: get_upload_form_data(file),
         headers: {'X-CSRFToken': getCookie('csrftoken')}
+    }).then(parse_upload_response).then(function(json){
+        return upload_chunks(file, json.upload, 0);
+    }).then(function(upload){
+        return fetch(`/upload/chunked/${upload.id}/finish/`, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'X-CSRFToken': getCookie('csrftoken')}
+        });
+    }).then(parse_upload_response).then(function(json){
+        file.media = json.media;
+        console.log('Uploaded file by chunks', file);
+        return file;
+    });
+}
+
+function get_missing_range(upload) {
+    // First range [start, end) server has not received yet, not bigger than a chunk
+    let ranges = upload.ranges;
+    let start = (ranges.length && ranges[0][0] === 0) ? ranges[0][1] : 0;
+    let next_range = ranges.find(function(range){ return range[0] > start; });
+    let end = next_range ? next_range[0] : upload.size;
+    return [start, Math.min(end, start + CHUNKED_UPLOAD_CHUNK_SIZE)];
+}
+
+function upload_chunks(file, upload, retry) {
+    let range = get_missing_range(upload);
+    let start = range[0];
+    let end = range[1];
+
+    if(start >= end) {
+        // Everything is received
+        return upload;
+    }
+
+    return fetch_w_progress(`/upload/chunked/${upload.id}/`, {
+        method: 'PUT',
+        credentials: 'same-origin',
+        body: file.file.slice(start, end),
+        headers: {
+            'X-CSRFToken': getCookie('csrftoken'),
+            'Content-Range': `bytes ${start}-${end - 1}/${upload.size}`
+        }
     }, function(e){
-        update_progress(file, e);
-    }).then(function(response){
-        // Extract error from JSON response first
-        return response.json().then(function(json){
-            if(json.error) {
-                throw Error(JSON.stringify(json.error));
-            } else if(!response.ok) {
-                throw Error('Failed to upload');
-            }
-            return json;
-        }, function(){
-            throw Error('Failed to upload');
-        }).then(function(json){
-            file.media = json.media;
-            console.log('Uploaded file', file);
-            return file;
+        update_progress(file, {lengthComputable: true, loaded: start + e.loaded, total: upload.size});
+    }).then(parse_upload_response).then(function(json){
+        return upload_chunks(file, json.upload, 0);
+    }, function(err){
+        if(retry >= LOAD_RETRIES_NUM) {
+            throw err;
+        }
+        console.warn('Failed to upload chunk, resume', file, err);
+        // Ask what server has actually received and continue from there
+        return sleep(Math.pow(LOAD_RETRIES_BASE, retry)).then(function(){
+            return fetch(`/upload/chunked/${upload.id}/`, {credentials: 'same-origin'});
+        }).then(parse_upload_response).then(function(json){
+            return upload_chunks(file, json.upload, retry + 1);
         });
     });
 }
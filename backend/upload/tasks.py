@@ -4,3 +4,11 @@ from celery import shared_task
 @shared_task
 def add(x, y):
     return x + y
+
+
+@shared_task
+def sweep_expired_chunked_uploads():
+    from django.conf import settings
+    from upload.chunked import ChunkedUpload
+
+    return ChunkedUpload.sweep_expired(expire_seconds=settings.CHUNKED_UPLOAD_EXPIRE_SECONDS)
@@ -7,5 +7,9 @@ app_name = 'upload'
 urlpatterns = [
     url(r'^$', views.upload, name='upload'),
     url(r'^file/$', views.upload_file),
+    url(r'^chunked/$', views.create_chunked_upload),
+    url(r'^chunked/(?P<upload_id>[0-9a-f]{32})/$', views.chunked_upload),
+    url(r'^chunked/(?P<upload_id>[0-9a-f]{32})/finish/$', views.finish_chunked_upload),
+    url(r'^media/present/$', views.check_present_many),
     url(r'^media/(?P<alg>sha1)_(?P<digest>[0-9a-f]{40})_(?P<size>\d+)/$', views.check_present),
 ]
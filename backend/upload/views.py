@@ -1,17 +1,27 @@
+import json
 import logging
 import datetime
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.files.storage import default_storage
 from django.db import IntegrityError
 from django.template.response import TemplateResponse
-from django.http import JsonResponse, HttpResponseNotFound
+from django.http import JsonResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
 
 from storage import models
-from upload.forms import UploadForm
+from upload.chunked import ChunkedUpload, UploadError, parse_content_range
+from storage.helpers import hex_to_base85
+from upload.forms import RE_HEX, UploadForm, UploadMetadataForm
 
 logger = logging.getLogger(__name__)
 
+# Max number of files checked by one request of check_present_many
+PRESENT_MANY_MAX_NUM = 10000
+# Number of media sent by one chunk of streamed response
+PRESENT_MANY_CHUNK_SIZE = 500
+
 
 @login_required
 def upload(request):
@@ -43,6 +53,10 @@ def upload_file(request):
 
     media = models.Media(uploader_id=request.user.id, **form.model_data)
 
+    return save_uploaded_media(media)
+
+
+def save_uploaded_media(media, delete_duplicate_content=False):
     try:
         # This save is as dummy as possible -- return only ID and do all processing in background
         media.save()
@@ -50,10 +64,103 @@ def upload_file(request):
 
     except IntegrityError:
         logger.warning(f'Got duplicate image: {media.unique_key}')
+
+        if delete_duplicate_content:
+            # Content is already stored under another name -- do not keep a copy without Media
+            media.content.delete(save=False)
+
         media = models.Media.objects.get(**media.unique_key)
         return JsonResponse(uploaded_media2dict(media))
 
 
+def chunked_upload2dict(upload_id, state):
+    return {'upload': {'id': upload_id, 'size': state['size'], 'ranges': state['ranges']}}
+
+
+@login_required
+@require_http_methods(['POST'])
+def create_chunked_upload(request):
+    """Start upload of a file by chunks, body is the same as for upload_file, but without file"""
+    form = UploadMetadataForm(request.POST)
+
+    if not form.is_valid():
+        return JsonResponse({'error': dict(form.errors)}, status=400)   # HTTP 400 Bad request
+
+    if form.cleaned_data['size'] > settings.CHUNKED_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': {'size': [f'File is bigger than {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes']}},
+                            status=400)
+
+    upload = ChunkedUpload.create(uploader_id=request.user.id, metadata=request.POST.dict(),
+                                  size=form.cleaned_data['size'])
+
+    return JsonResponse(chunked_upload2dict(upload.upload_id, upload.get_state()), status=201)
+
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def chunked_upload(request, upload_id=None):
+    """
+    GET -- received ranges, to resume an upload
+    PUT -- write a chunk, position is in header `Content-Range: bytes <first>-<last>/<size>`
+    DELETE -- cancel the upload
+    """
+    upload = ChunkedUpload(uploader_id=request.user.id, upload_id=upload_id)
+
+    if not upload.exists():
+        return HttpResponseNotFound()
+
+    if request.method == 'DELETE':
+        upload.delete()
+        return JsonResponse({})
+
+    state = upload.get_state()
+
+    if request.method == 'PUT':
+        try:
+            start, end, total = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+
+            if total not in (None, state['size']) or end > state['size']:
+                raise UploadError(f'Chunk [{start}, {end}) is out of file size {state["size"]}')
+            if int(request.META.get('CONTENT_LENGTH') or 0) != end - start:
+                raise UploadError('Content-Length does not match Content-Range')
+
+            state = upload.write(start, end, request)
+        except UploadError as ex:
+            return JsonResponse({'error': str(ex), **chunked_upload2dict(upload_id, upload.get_state())}, status=400)
+
+    return JsonResponse(chunked_upload2dict(upload_id, state))
+
+
+@login_required
+@require_http_methods(['POST'])
+def finish_chunked_upload(request, upload_id=None):
+    """Check received content and create Media exactly like upload_file does"""
+    upload = ChunkedUpload(uploader_id=request.user.id, upload_id=upload_id)
+
+    if not upload.exists():
+        return HttpResponseNotFound()
+
+    form = UploadMetadataForm(upload.get_state()['metadata'])
+
+    if not form.is_valid():
+        return JsonResponse({'error': dict(form.errors)}, status=400)   # HTTP 400 Bad request
+
+    media = models.Media(uploader_id=request.user.id, **form.model_data)
+
+    try:
+        upload.finish(size=media.size_bytes, sha1_hex=media.sha1_hex)
+    except UploadError as ex:
+        return JsonResponse({'error': str(ex)}, status=400)
+
+    # Same name as FileField would give to uploaded file, but content is moved instead of copied
+    content_name = default_storage.get_available_name(media.content.field.generate_filename(media, upload.name))
+    upload.move(content_name)
+    media.content = content_name
+
+    # Content moved out of the upload would be left without Media otherwise
+    return save_uploaded_media(media, delete_duplicate_content=True)
+
+
 @login_required
 def check_present(request, alg=None, digest=None, size=None):
     import binascii
@@ -70,3 +177,80 @@ def check_present(request, alg=None, digest=None, size=None):
         return HttpResponseNotFound()
 
     return JsonResponse(uploaded_media2dict(media))
+
+
+def parse_media_keys(body):
+    """[["<sha1 hex>", <size>], ...] => {(sha1_b85, size_bytes), ...}"""
+    try:
+        files = json.loads(body.decode('utf-8'))['files']
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError('Expected JSON: {"files": [["<sha1 hex>", <size>], ...]}')
+
+    if not isinstance(files, list) or len(files) > PRESENT_MANY_MAX_NUM:
+        raise ValueError(f'Expected list of at most {PRESENT_MANY_MAX_NUM} files')
+
+    keys = set()
+
+    for item in files:
+        try:
+            digest, size = item
+        except (TypeError, ValueError):
+            raise ValueError(f'Expected pair of SHA1 and size: {item!r}')
+
+        if not isinstance(digest, str) or len(digest) != 40 or not RE_HEX.search(digest):
+            raise ValueError(f'Expected SHA1 hex digest: {digest!r}')
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f'Expected size in bytes: {size!r}')
+
+        keys.add((hex_to_base85(digest).decode('ascii'), size))
+
+    return keys
+
+
+def iter_present_media(uploader_id=None, keys=None):
+    """JSON of present media by chunks, media are found by a single query"""
+    qs = models.Media.objects.filter(
+        uploader_id=uploader_id,
+        sha1_b85__in={sha1_b85 for sha1_b85, size_bytes in keys},
+        size_bytes__in={size_bytes for sha1_b85, size_bytes in keys},
+    ).only('id', 'sha1_b85', 'size_bytes', 'thumbnail')
+
+    yield '{"present": ['
+
+    chunk = []
+    separator = ''
+
+    for media in (qs.iterator() if keys else ()):
+        if (media.sha1_b85, media.size_bytes) not in keys:
+            # Hash of one requested file, but size of another one
+            continue
+
+        chunk.append(json.dumps({'sha1': media.sha1_hex, 'size': media.size_bytes, **uploaded_media2dict(media)}))
+
+        if len(chunk) >= PRESENT_MANY_CHUNK_SIZE:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+
+    if chunk:
+        yield separator + ','.join(chunk)
+
+    yield ']}'
+
+
+@login_required
+@require_http_methods(['POST'])
+def check_present_many(request):
+    """
+    Which files are already uploaded, like check_present, but for thousands of files at once.
+
+    Body: {"files": [["<sha1 hex>", <size>], ...]}
+    Response: {"present": [{"sha1": "<sha1 hex>", "size": <size>, "media": {...}}, ...]}, files not found are omitted
+    """
+    try:
+        keys = parse_media_keys(request.body)
+    except ValueError as ex:
+        return JsonResponse({'error': str(ex)}, status=400)   # HTTP 400 Bad request
+
+    return StreamingHttpResponse(iter_present_media(uploader_id=request.user.id, keys=keys),
+                                 content_type='application/json')